@@ -0,0 +1,128 @@
+# Client of the long-lived CGCNN inference server (see server.py).
+# Only depends on the standard library, so that a prediction request does not
+# pay the import of torch: the server holds the model.
+
+import argparse
+import os
+import sys
+from multiprocessing.connection import Client
+
+# environment variable holding the key shared by the server and its clients
+AUTHKEY_ENV = "CGCNN_SERVER_AUTHKEY"
+
+
+def parse_address(address):
+    """
+    Address of a server: ``host:port`` for a TCP socket, else the path of a
+    Unix socket.
+    """
+    if isinstance(address, tuple):
+        return address
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def server_authkey():
+    """Key of ``$CGCNN_SERVER_AUTHKEY``, or None if not set."""
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return authkey.encode() if authkey else None
+
+
+class PredictionClient:
+    """
+    Connection to a :class:`cgcnn.server.PredictionServer`.
+
+    Args:
+        address (str): ``host:port``, or path of the Unix socket of the server.
+        authkey (bytes, optional): key of the server (default: ``$CGCNN_SERVER_AUTHKEY``).
+
+    :raises RuntimeError: from the requests, when the server fails to serve them
+    """
+
+    def __init__(self, address, authkey=None):
+        self._conn = Client(parse_address(address), authkey=authkey or server_authkey())
+
+    def _request(self, op, **params):
+        self._conn.send(dict(op=op, **params))
+        response = self._conn.recv()
+        if "error" in response:
+            raise RuntimeError(f"CGCNN server: {response['error']}")
+        return response
+
+    def predict_dir(self, cifpath, output_csv, **options):
+        """
+        Predict the structures of a directory, as :func:`cgcnn.predict.predict_cgcnn`
+        with ``predict_only`` (``options``: ``batch_size``, ``workers``,
+        ``resume``, ``graph_cache``, ``max_atoms``).
+
+        :returns: absolute path of the predictions CSV.
+        """
+        return self._request("predict_dir", cifpath=os.path.abspath(cifpath),
+                             output_csv=os.path.abspath(output_csv), options=options)["output_csv"]
+
+    def predict_structures(self, structures):
+        """
+        Predict structures held in memory.
+
+        :param list structures: ``(id, structure)`` pairs, where a structure
+            is a :class:`pymatgen.core.Structure` or a ``(lattice, frac_coords,
+            numbers)`` tuple of arrays.
+        :returns: ``(id, prediction)`` pairs, in the order of ``structures``
+            (the prediction of a server with an ensemble is a ``(mean, std)`` pair).
+        """
+        return self._request("predict", kind="structures", items=list(structures))["predictions"]
+
+    def predict_graphs(self, graphs):
+        """
+        Predict crystal graphs, as built by
+        :meth:`cgcnn.data.CrystalGraphFeaturizer.graph`.
+
+        :param list graphs: ``(id, (numbers, nbr_fea_idx, nbr_dist))`` pairs.
+        :returns: ``(id, prediction)`` pairs, in the order of ``graphs``, as
+            :meth:`predict_structures`.
+        """
+        return self._request("predict", kind="graphs", items=list(graphs))["predictions"]
+
+    def ping(self):
+        """:returns: the model path and the number of requests served."""
+        return self._request("ping")
+
+    def shutdown(self):
+        """Stop the server."""
+        self._request("shutdown")
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _build_argparser():
+    parser = argparse.ArgumentParser(description="Predict a directory of structures with a CGCNN server")
+    parser.add_argument("address", help="host:port, or path of the Unix socket of the server")
+    parser.add_argument("cifpath", help="path to the directory of structures")
+    parser.add_argument("--output-csv", required=True, help="output CSV path")
+    parser.add_argument("-b", "--batch-size", default=None, type=int, metavar="N", help="mini-batch size")
+    parser.add_argument("-j", "--workers", default=None, type=int, metavar="N", help="number of data loading workers")
+    parser.add_argument("--resume", action="store_true", help="Continue after the predictions already in the output CSV")
+    parser.add_argument("--graph-cache", default=None, help="Optional directory of a persistent crystal graph cache")
+    parser.add_argument("--max-atoms", default=None, type=int, metavar="N", help="maximum number of atoms per batch")
+    return parser
+
+
+if __name__ == "__main__":
+    cli = _build_argparser().parse_args(sys.argv[1:])
+    options = {key: value for key, value in (("batch_size", cli.batch_size), ("workers", cli.workers),
+                                             ("resume", cli.resume), ("graph_cache", cli.graph_cache),
+                                             ("max_atoms", cli.max_atoms))
+               if value is not None}
+    with PredictionClient(cli.address) as client:
+        csv_path = client.predict_dir(cli.cifpath, cli.output_csv, **options)
+    print(f"Wrote predictions to: {csv_path}")
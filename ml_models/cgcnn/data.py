@@ -1,19 +1,26 @@
 from __future__ import print_function, division
 
 import csv
-import functools
+import hashlib
 import json
 import os
 import random
 import warnings
+from collections import OrderedDict
 
 import numpy as np
 import torch
 from pymatgen.core.structure import Structure
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, IterableDataset, \
+    Sampler, get_worker_info
 from torch.utils.data.dataloader import default_collate
 from torch.utils.data.sampler import SubsetRandomSampler
 
+from tools.partition import count_cif_sites
+from tools.structure_store import StructureStore, is_structure_store
+
+from .graph_cache import GraphCache
+
 
 def get_train_val_test_loader(dataset, collate_fn=default_collate,
                               batch_size=64, train_ratio=None,
@@ -105,7 +112,8 @@ def collate_pool(dataset_list):
       (atom_fea, nbr_fea, nbr_fea_idx, target)
 
       atom_fea: torch.Tensor shape (n_i, atom_fea_len)
-      nbr_fea: torch.Tensor shape (n_i, M, nbr_fea_len)
+      nbr_fea: torch.Tensor shape (n_i, M, nbr_fea_len), or (n_i, M) (raw
+        distances)
       nbr_fea_idx: torch.LongTensor shape (n_i, M)
       target: torch.Tensor shape (1, )
       cif_id: str or int
@@ -116,12 +124,12 @@ def collate_pool(dataset_list):
 
     batch_atom_fea: torch.Tensor shape (N, orig_atom_fea_len)
       Atom features from atom type
-    batch_nbr_fea: torch.Tensor shape (N, M, nbr_fea_len)
-      Bond features of each atom's M neighbors
+    batch_nbr_fea: torch.Tensor shape (N, M, nbr_fea_len), or (N, M)
+      Bond features (or raw distances) of each atom's M neighbors
     batch_nbr_fea_idx: torch.LongTensor shape (N, M)
       Indices of M neighbors of each atom
-    crystal_atom_idx: list of torch.LongTensor of length N0
-      Mapping from the crystal idx to atom idx
+    crystal_atom_idx: torch.LongTensor shape (N0,)
+      Number of atoms of each crystal, whose atoms are consecutive
     target: torch.Tensor shape (N, 1)
       Target value for prediction
     batch_cif_ids: list
@@ -136,15 +144,14 @@ def collate_pool(dataset_list):
         batch_atom_fea.append(atom_fea)
         batch_nbr_fea.append(nbr_fea)
         batch_nbr_fea_idx.append(nbr_fea_idx + base_idx)
-        new_idx = torch.LongTensor(np.arange(n_i) + base_idx)
-        crystal_atom_idx.append(new_idx)
+        crystal_atom_idx.append(n_i)
         batch_target.append(target)
         batch_cif_ids.append(cif_id)
         base_idx += n_i
     return (torch.cat(batch_atom_fea, dim=0),
             torch.cat(batch_nbr_fea, dim=0),
             torch.cat(batch_nbr_fea_idx, dim=0),
-            crystal_atom_idx), \
+            torch.LongTensor(crystal_atom_idx)), \
         torch.stack(batch_target, dim=0), \
         batch_cif_ids
 
@@ -194,6 +201,16 @@ class GaussianDistance(object):
         return np.exp(-(distances[..., np.newaxis] - self.filter)**2 /
                       self.var**2)
 
+    def expand_tensor(self, distances):
+        """
+        Same as expand, for a torch.Tensor on any device (e.g. a batch of
+        raw distances already copied to the GPU).
+        """
+        centers = torch.as_tensor(self.filter, dtype=distances.dtype,
+                                  device=distances.device)
+        return torch.exp(-(distances.unsqueeze(-1) - centers)**2 /
+                         self.var**2)
+
 
 class AtomInitializer(object):
     """
@@ -210,7 +227,24 @@ class AtomInitializer(object):
         assert atom_type in self.atom_types
         return self._embedding[atom_type]
 
+    def get_atom_fea_array(self, atom_types):
+        """
+        Features of an array of integer atom types, shape (n, atom_fea_len),
+        gathered from a dense table of the embeddings.
+        """
+        if getattr(self, '_table', None) is None:
+            size = max(self._embedding) + 1
+            self._table = np.stack([
+                self._embedding.get(i, np.full_like(
+                    next(iter(self._embedding.values())), np.nan))
+                for i in range(size)])
+        atom_types = np.asarray(atom_types)
+        assert all(atom_type in self.atom_types
+                   for atom_type in np.unique(atom_types))
+        return self._table[atom_types]
+
     def load_state_dict(self, state_dict):
+        self._table = None
         self._embedding = state_dict
         self.atom_types = set(self._embedding.keys())
         self._decodedict = {idx: atom_type for atom_type, idx in
@@ -250,6 +284,251 @@ class AtomCustomJSONInitializer(AtomInitializer):
             self._embedding[key] = np.array(value, dtype=float)
 
 
+class CrystalGraphFeaturizer(object):
+    """
+    Build the crystal graph of a structure: atom features from the element
+    embedding and neighbor features from the Gaussian expansion of the
+    distances to the max_num_nbr nearest neighbors within radius.
+
+    Parameters
+    ----------
+
+    atom_init_file: str
+        The path to the atom_init.json file
+    max_num_nbr: int
+        The maximum number of neighbors while constructing the crystal graph
+    radius: float
+        The cutoff radius for searching neighbors
+    dmin: float
+        The minimum distance for constructing GaussianDistance
+    step: float
+        The step size for constructing GaussianDistance
+    raw_distances: bool
+        If True, nbr_fea holds the raw distances, shape (n_i, M); the
+        Gaussian expansion is left to the consumer (see
+        GaussianDistance.expand_tensor)
+    """
+
+    # neighbor search margin of a family reference: covers the variants
+    # scaled down to 1 / (1 + margin) of the reference
+    FAMILY_RADIUS_MARGIN = 0.1
+    # number of family references kept
+    MAX_FAMILIES = 64
+    # relative tolerance of equidistant neighbors, see _nearest
+    TIE_RTOL = 1e-6
+    # version of the graphs built by graph(), part of the graph cache keys
+    GRAPH_VERSION = 3
+
+    def __init__(self, atom_init_file, max_num_nbr=12, radius=8, dmin=0,
+                 step=0.2, raw_distances=False):
+        self.max_num_nbr, self.radius = max_num_nbr, radius
+        self.raw_distances = raw_distances
+        self._families = OrderedDict()
+        self.ari = AtomCustomJSONInitializer(atom_init_file)
+        self.gdf = GaussianDistance(dmin=dmin, dmax=self.radius, step=step)
+
+    @property
+    def orig_atom_fea_len(self):
+        """Number of atom features"""
+        return len(next(iter(self.ari._embedding.values())))
+
+    @property
+    def nbr_fea_len(self):
+        """Number of bond features"""
+        return len(self.gdf.filter)
+
+    def __call__(self, crystal, cif_id=None):
+        """
+        Parameters
+        ----------
+
+        crystal: pymatgen.core.Structure
+        cif_id: str or int
+          Only used in warnings
+
+        Returns
+        -------
+
+        atom_fea: torch.Tensor shape (n_i, atom_fea_len)
+        nbr_fea: torch.Tensor shape (n_i, M, nbr_fea_len), or (n_i, M)
+          with raw_distances
+        nbr_fea_idx: torch.LongTensor shape (n_i, M)
+        """
+        return self.features(*self.graph(crystal, cif_id))
+
+    def graph(self, crystal, cif_id=None, family=None):
+        """
+        Compact crystal graph, i.e. what the features are computed from.
+
+        Structures given with the same family key are expected to share the
+        geometry of a prototype, up to an isotropic scaling of the lattice
+        and whatever their species (e.g. all the element permutations and
+        lattice scales generated from a prototype). Their graphs are derived
+        from a single neighbor search, with a radius enlarged by FAMILY_RADIUS_MARGIN:
+        the distances are scaled and only the cutoff membership is
+        recomputed. A structure that is not a scaled variant of the family
+        falls back to its own neighbor search. Either way, the neighbors kept
+        from a shell of equidistant neighbors across the max_num_nbr cutoff
+        are the ones of lowest index (see _nearest).
+
+        Returns
+        -------
+
+        numbers: np.ndarray shape (n_i,)
+          Atomic numbers
+        nbr_fea_idx: np.ndarray shape (n_i, M)
+          Indices of the M nearest neighbors of each atom
+        nbr_dist: np.ndarray shape (n_i, M)
+          Distances to those neighbors (radius + 1 for the padding)
+        """
+        numbers = np.array(crystal.atomic_numbers)
+        if family is None:
+            neighbors = self._neighbors(crystal, self.radius)
+            return (numbers,) + self._scatter(len(numbers), *neighbors,
+                                              cif_id=cif_id)
+
+        ref = self._families.get(family)
+        match = None if ref is None else self._match(ref, crystal)
+        if match is None:
+            radius = self.radius * (1 + self.FAMILY_RADIUS_MARGIN)
+            ref = {'lattice': crystal.lattice.matrix,
+                   'frac_coords': crystal.frac_coords, 'radius': radius,
+                   'neighbors': self._neighbors(crystal, radius)}
+            self._families[family] = ref
+            if len(self._families) > self.MAX_FAMILIES:
+                self._families.popitem(last=False)
+            match = 1., None
+        else:
+            self._families.move_to_end(family)
+        scale, site_of_ref = match
+        centers, points, distances = ref['neighbors']
+        distances = distances * scale
+        if site_of_ref is not None:
+            # sites listed in another order (e.g. CIF files grouped by
+            # species): renumber, and order the ties by the new indices
+            centers, points, distances = self._nearest(
+                site_of_ref[centers], site_of_ref[points], distances)
+        # same inclusion test as the neighbor search
+        within = distances <= self.radius + 1e-8
+        return (numbers,) + self._scatter(
+            len(numbers), centers[within], points[within], distances[within],
+            cif_id=cif_id)
+
+    def _match(self, ref, crystal):
+        """
+        Match crystal to the family reference.
+
+        Returns
+        -------
+
+        None if crystal is not a scaled variant of the reference, else
+        (scale, site_of_ref), where site_of_ref[j] is the site of crystal at
+        the position of the reference site j (None if in the same order)
+        """
+        frac_coords = crystal.frac_coords
+        if len(frac_coords) != len(ref['frac_coords']):
+            return None
+        site_of_ref = None
+        if not np.allclose(frac_coords, ref['frac_coords'], rtol=0,
+                           atol=1e-8):
+            if 'site_order' not in ref:
+                ref['site_order'], ref['wrapped'] = \
+                    self._site_order(ref['frac_coords'])
+            order, wrapped = self._site_order(frac_coords)
+            if not np.allclose(wrapped[order],
+                               ref['wrapped'][ref['site_order']],
+                               rtol=0, atol=1e-5):
+                return None
+            site_of_ref = np.empty(len(order), dtype=np.int64)
+            site_of_ref[ref['site_order']] = order
+        lattice = crystal.lattice.matrix
+        scale = np.cbrt(np.linalg.det(lattice) / np.linalg.det(ref['lattice']))
+        if not np.allclose(lattice, scale * ref['lattice'], rtol=1e-6,
+                           atol=1e-8):
+            return None
+        # the reference search must cover the radius of this variant
+        if scale * ref['radius'] < self.radius:
+            return None
+        return scale, site_of_ref
+
+    @staticmethod
+    def _site_order(frac_coords):
+        """Sites sorted by their (wrapped, rounded) fractional coordinates."""
+        wrapped = np.round(np.mod(frac_coords, 1.), 5) % 1.
+        return np.lexsort(wrapped.T[::-1]), wrapped
+
+    def _neighbors(self, crystal, radius):
+        """Nearest neighbor pairs within radius, see _nearest."""
+        centers, points, _, distances = crystal.get_neighbor_list(radius)
+        return self._nearest(centers, points, distances)
+
+    def _nearest(self, centers, points, distances):
+        """
+        The max_num_nbr nearest neighbor pairs of each center, and the ones
+        equidistant (within TIE_RTOL) to the last of them: the only ones that
+        can be kept, whatever the scale of the structure and the cutoff.
+
+        The pairs are sorted by center, then by increasing distance, the
+        equidistant ones by index: which of them are kept at the max_num_nbr
+        cutoff does not depend on the order of the search nor on the
+        rounding of the distances, and a scaled variant keeps the same ones.
+        """
+        order = np.lexsort((distances, centers))
+        centers, points, distances = \
+            centers[order], points[order], distances[order]
+        new_shell = np.ones(len(centers), dtype=bool)
+        new_shell[1:] = (centers[1:] != centers[:-1]) | \
+            (np.diff(distances) > self.TIE_RTOL * distances[1:])
+        shell = np.cumsum(new_shell)
+        counts = np.bincount(centers)
+        rank = np.arange(len(centers)) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        cutoff_shell = np.zeros(len(counts), dtype=shell.dtype)
+        last = rank == self.max_num_nbr - 1
+        cutoff_shell[centers[last]] = shell[last]
+        keep = (rank < self.max_num_nbr) | (shell == cutoff_shell[centers])
+        order = np.lexsort((points[keep], shell[keep]))
+        return centers[keep][order], points[keep][order], \
+            distances[keep][order]
+
+    def _scatter(self, n_atoms, centers, points, distances, cif_id=None):
+        """Padded (n_i, M) arrays of the first M neighbors of each atom."""
+        counts = np.bincount(centers, minlength=n_atoms)
+        rank = np.arange(len(centers)) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        keep = rank < self.max_num_nbr
+        nbr_fea_idx = np.zeros((n_atoms, self.max_num_nbr), dtype=np.int64)
+        nbr_dist = np.full((n_atoms, self.max_num_nbr), self.radius + 1.)
+        nbr_fea_idx[centers[keep], rank[keep]] = points[keep]
+        nbr_dist[centers[keep], rank[keep]] = distances[keep]
+        if counts.min() < self.max_num_nbr:
+            warnings.warn(
+                f"{cif_id} not find enough neighbors to build graph. "
+                "If it happens frequently, consider increase radius."
+            )
+        return nbr_fea_idx, nbr_dist
+
+    def features(self, numbers, nbr_fea_idx, nbr_dist):
+        """Features of a graph returned by graph()."""
+        # the graph does not depend on the species: permutation variants only
+        # differ by the rows gathered here
+        atom_fea = self.ari.get_atom_fea_array(numbers)
+        nbr_fea = nbr_dist if self.raw_distances else self.gdf.expand(nbr_dist)
+        atom_fea = torch.Tensor(atom_fea)
+        nbr_fea = torch.Tensor(nbr_fea)
+        nbr_fea_idx = torch.LongTensor(nbr_fea_idx)
+        return atom_fea, nbr_fea, nbr_fea_idx
+
+
+def cif_num_atoms(cif_file):
+    """
+    Number of atoms of a CIF file, from the rows of its atom site loop (times
+    their multiplicity, if given). Only meant as a cheap estimate: the
+    symmetry operations and partial occupancies are not applied.
+    """
+    return count_cif_sites(cif_file, multiplicity=True)
+
+
 class CIFData(Dataset):
     """
     The CIFData dataset is a wrapper for a dataset where the crystal structures
@@ -273,6 +552,18 @@ class CIFData(Dataset):
     ID.cif: a CIF file that recodes the crystal structure, where ID is the
     unique ID for the crystal.
 
+    Instead of the CIF files, root_dir can hold a structure store (see
+    tools/structure_store.py); the structures are then read from its shards.
+
+    When root_dir holds the manifest.csv written by the structure
+    generation, the candidates generated from the same prototype (element
+    permutations and lattice scales) are featurized as a family, from one
+    neighbor search (see CrystalGraphFeaturizer.graph).
+
+    With graph_cache_dir, the crystal graphs are kept in a persistent cache
+    (see graph_cache.py) keyed by the content of the structures, so they are
+    built once across runs and DataLoader workers.
+
     Parameters
     ----------
 
@@ -288,19 +579,29 @@ class CIFData(Dataset):
         The step size for constructing GaussianDistance
     random_seed: int
         Random seed for shuffling the dataset
+    shuffle: bool
+        Shuffle the dataset; without shuffling, the crystals are kept in the
+        order of id_prop.csv (e.g. for inference, see InferenceBatchSampler)
+    graph_cache_dir: str
+        Directory of the persistent graph cache (None: no cache)
+    raw_distances: bool
+        Emit the raw neighbor distances instead of their Gaussian expansion
+        (see CrystalGraphFeaturizer)
 
     Returns
     -------
 
     atom_fea: torch.Tensor shape (n_i, atom_fea_len)
-    nbr_fea: torch.Tensor shape (n_i, M, nbr_fea_len)
+    nbr_fea: torch.Tensor shape (n_i, M, nbr_fea_len), or (n_i, M) with
+      raw_distances
     nbr_fea_idx: torch.LongTensor shape (n_i, M)
     target: torch.Tensor shape (1, )
     cif_id: str or int
     """
 
     def __init__(self, root_dir, max_num_nbr=12, radius=8, dmin=0, step=0.2,
-                 random_seed=123):
+                 random_seed=123, graph_cache_dir=None, raw_distances=False,
+                 shuffle=True):
         self.root_dir = root_dir
         self.max_num_nbr, self.radius = max_num_nbr, radius
         assert os.path.exists(root_dir), 'root_dir does not exist!'
@@ -309,47 +610,200 @@ class CIFData(Dataset):
         with open(id_prop_file) as f:
             reader = csv.reader(f)
             self.id_prop_data = [row for row in reader]
-        random.seed(random_seed)
-        random.shuffle(self.id_prop_data)
+        if shuffle:
+            random.seed(random_seed)
+            random.shuffle(self.id_prop_data)
         atom_init_file = os.path.join(self.root_dir, 'atom_init.json')
         assert os.path.exists(atom_init_file), 'atom_init.json does not exist!'
-        self.ari = AtomCustomJSONInitializer(atom_init_file)
-        self.gdf = GaussianDistance(dmin=dmin, dmax=self.radius, step=step)
+        self.featurizer = CrystalGraphFeaturizer(
+            atom_init_file, max_num_nbr=max_num_nbr, radius=radius, dmin=dmin,
+            step=step, raw_distances=raw_distances)
+        self.ari, self.gdf = self.featurizer.ari, self.featurizer.gdf
+        self.store = StructureStore(self.root_dir) \
+            if is_structure_store(self.root_dir) else None
+        self.graph_cache = GraphCache(graph_cache_dir) \
+            if graph_cache_dir else None
+        self.families = {}
+        manifest_file = os.path.join(self.root_dir, 'manifest.csv')
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                self.families = {row['id']: row['prototype']
+                                 for row in csv.DictReader(f)}
 
     def __len__(self):
         return len(self.id_prop_data)
 
-    @functools.lru_cache(maxsize=None)  # Cache loaded structures
+    def sizes(self):
+        """
+        Number of atoms of every crystal, in dataset order, read without
+        parsing the structures (see cif_num_atoms for the CIF files).
+        """
+        if self.store is not None:
+            natoms = dict(zip(self.store.ids(), self.store.num_atoms()))
+            return [natoms[cif_id] for cif_id, _ in self.id_prop_data]
+        return [cif_num_atoms(os.path.join(self.root_dir, cif_id + '.cif'))
+                for cif_id, _ in self.id_prop_data]
+
+    def _load_structure(self, cif_id):
+        if self.store is not None:
+            return self.store.get_structure(cif_id)
+        return Structure.from_file(os.path.join(self.root_dir,
+                                                cif_id + '.cif'))
+
+    def _content_key(self, cif_id):
+        """Hash of the structure content and of the graph parameters."""
+        h = hashlib.sha1(repr((self.max_num_nbr, self.radius,
+                               CrystalGraphFeaturizer.GRAPH_VERSION)).encode())
+        if self.store is not None:
+            for array in self.store.get_arrays(cif_id):
+                h.update(np.ascontiguousarray(array).tobytes())
+        else:
+            with open(os.path.join(self.root_dir, cif_id + '.cif'),
+                      'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
     def __getitem__(self, idx):
         cif_id, target = self.id_prop_data[idx]
-        crystal = Structure.from_file(os.path.join(self.root_dir,
-                                                   cif_id + '.cif'))
-        atom_fea = np.vstack([self.ari.get_atom_fea(crystal[i].specie.number)
-                              for i in range(len(crystal))])
-        atom_fea = torch.Tensor(atom_fea)
-        all_nbrs = crystal.get_all_neighbors(self.radius, include_index=True)
-        all_nbrs = [sorted(nbrs, key=lambda x: x[1]) for nbrs in all_nbrs]
-        nbr_fea_idx, nbr_fea = [], []
-        for nbr in all_nbrs:
-            if len(nbr) < self.max_num_nbr:
-                warnings.warn(
-                    f"{cif_id} not find enough neighbors to build graph. "
-                    "If it happens frequently, consider increase radius."
-                )
-                nbr_fea_idx.append(list(map(lambda x: x[2], nbr)) +
-                                   [0] * (self.max_num_nbr - len(nbr)))
-                nbr_fea.append(list(map(lambda x: x[1], nbr)) +
-                               [self.radius + 1.] * (self.max_num_nbr -
-                                                     len(nbr)))
-            else:
-                nbr_fea_idx.append(list(map(lambda x: x[2],
-                                            nbr[:self.max_num_nbr])))
-                nbr_fea.append(list(map(lambda x: x[1],
-                                        nbr[:self.max_num_nbr])))
-        nbr_fea_idx, nbr_fea = np.array(nbr_fea_idx), np.array(nbr_fea)
-        nbr_fea = self.gdf.expand(nbr_fea)
-        atom_fea = torch.Tensor(atom_fea)
-        nbr_fea = torch.Tensor(nbr_fea)
-        nbr_fea_idx = torch.LongTensor(nbr_fea_idx)
+        family = self.families.get(cif_id)
+        if self.graph_cache is None:
+            graph = self.featurizer.graph(self._load_structure(cif_id), cif_id,
+                                          family)
+        else:
+            key = self._content_key(cif_id)
+            graph = self.graph_cache.get(key)
+            if graph is None:
+                graph = self.featurizer.graph(self._load_structure(cif_id),
+                                              cif_id, family)
+                self.graph_cache.put(key, *graph)
+        atom_fea, nbr_fea, nbr_fea_idx = self.featurizer.features(*graph)
         target = torch.Tensor([float(target)])
         return (atom_fea, nbr_fea, nbr_fea_idx), target, cif_id
+
+
+class InferenceBatchSampler(Sampler):
+    """
+    Deterministic batches of a map-style dataset (e.g. CIFData) for
+    inference.
+
+    The dataset is read in storage order, by windows of `window` batches:
+    within a window, the items are sorted by size so that a batch holds
+    crystals of similar sizes, while the reads stay local (structure store
+    shards, graph families). The order only depends on the sizes, so a run
+    interrupted after its first `start` items resumes with the same batches.
+
+    With max_atoms, a batch also ends before its total size exceeds
+    max_atoms (a larger crystal is a batch on its own): the memory used by a
+    batch is proportional to its number of atoms (times the fixed number of
+    neighbors), not to its number of crystals.
+
+    Parameters
+    ----------
+
+    sizes: list
+        Size (or size estimate, see CIFData.sizes) of every item
+    batch_size: int
+        Number of items per batch
+    window: int
+        Number of batches sorted together
+    start: int
+        Number of leading items (in the order of the sampler) to skip
+    max_atoms: int
+        Maximum total size of a batch (None: no limit)
+    stop: int
+        Position (in the order of the sampler) after the last item, e.g. to
+        split the items among devices (None: all the items)
+    """
+
+    def __init__(self, sizes, batch_size, window=16, start=0, max_atoms=None,
+                 stop=None):
+        self.sizes = np.asarray(sizes)
+        self.batch_size, self.window, self.start = batch_size, window, start
+        self.max_atoms, self.stop = max_atoms, stop
+
+    def order(self):
+        """Indices of all the items, in the order of the batches."""
+        span = self.batch_size * self.window
+        order = [lo + np.argsort(self.sizes[lo:lo + span], kind='stable')
+                 for lo in range(0, len(self.sizes), span)]
+        return np.concatenate(order).tolist() if order else []
+
+    def batches(self):
+        """Indices of the items of every batch."""
+        order = self.order()[self.start:self.stop]
+        if self.max_atoms is None:
+            return [order[lo:lo + self.batch_size]
+                    for lo in range(0, len(order), self.batch_size)]
+        batches, batch, n_atoms = [], [], 0
+        for idx in order:
+            if batch and (len(batch) == self.batch_size or
+                          n_atoms + self.sizes[idx] > self.max_atoms):
+                batches.append(batch)
+                batch, n_atoms = [], 0
+            batch.append(idx)
+            n_atoms += self.sizes[idx]
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        if self.max_atoms is None:
+            n = len(range(len(self.sizes))[self.start:self.stop])
+            return (n + self.batch_size - 1) // self.batch_size
+        return len(self.batches())
+
+
+class StructureStreamData(IterableDataset):
+    """
+    Dataset over structures generated on the fly, featurized as they are
+    produced so that no structure file is written or read.
+
+    The jobs are split among the DataLoader workers, so generation and
+    featurization run in the workers while the model consumes the batches.
+
+    Parameters
+    ----------
+
+    jobs: list
+        Units of work (e.g. prototype files)
+    generate: callable
+        generate(job) yields (cif_id, pymatgen.core.Structure) pairs, which
+        share the geometry of a prototype up to an isotropic scaling (see
+        CrystalGraphFeaturizer.graph). Must be picklable when the DataLoader
+        uses worker processes.
+    atom_init_file: str
+        The path to the atom_init.json file
+    max_num_nbr, radius, dmin, step, raw_distances:
+        See CrystalGraphFeaturizer
+    target: float
+        Placeholder target value attached to every structure
+
+    Returns
+    -------
+
+    Same items as CIFData.
+    """
+
+    def __init__(self, jobs, generate, atom_init_file, max_num_nbr=12,
+                 radius=8, dmin=0, step=0.2, target=0.5, raw_distances=False):
+        self.jobs = list(jobs)
+        self.generate = generate
+        self.featurizer = CrystalGraphFeaturizer(
+            atom_init_file, max_num_nbr=max_num_nbr, radius=radius, dmin=dmin,
+            step=step, raw_distances=raw_distances)
+        self.target = target
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        job_ids = range(len(self.jobs))
+        if worker_info is not None:
+            job_ids = job_ids[worker_info.id::worker_info.num_workers]
+        for job_id in job_ids:
+            for cif_id, crystal in self.generate(self.jobs[job_id]):
+                # the structures of a job share the geometry of its prototype
+                graph = self.featurizer.graph(crystal, cif_id, family=job_id)
+                yield self.featurizer.features(*graph), \
+                    torch.Tensor([self.target]), cif_id
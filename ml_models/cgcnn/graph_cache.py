@@ -0,0 +1,146 @@
+from __future__ import print_function, division
+
+import csv
+import glob
+import os
+import uuid
+from multiprocessing.util import Finalize
+
+import numpy as np
+
+
+class GraphCache(object):
+    """
+    Persistent cache of crystal graphs, keyed by content hashes.
+
+    A cache entry is the compact graph returned by
+    CrystalGraphFeaturizer.graph(): the atomic numbers, the neighbor indices
+    and the raw neighbor distances. The entries are written in immutable
+    shards of memory-mappable .npy files, so that the cache is shared by runs
+    (e.g. with another checkpoint or selection threshold) and read without
+    loading whole shards:
+
+    cache_dir
+    ├── index_<writer>.csv          "<key>,<shard>,<row>" for every entry
+    ├── <shard>_numbers.npy         (sum(n_i),) atomic numbers
+    ├── <shard>_nbr_fea_idx.npy     (sum(n_i), M) neighbor indices
+    ├── <shard>_nbr_dist.npy        (sum(n_i), M) neighbor distances
+    ├── <shard>_offsets.npy         (n_entries + 1,) first atom of each entry
+    ├── ...
+
+    Every process (e.g. every DataLoader worker) writes its own shards and
+    index file. New entries are buffered and written every flush_size
+    entries, and when the process exits.
+
+    Parameters
+    ----------
+
+    cache_dir: str
+        Directory of the cache (created if missing)
+    flush_size: int
+        Number of buffered entries written as one shard
+    """
+
+    ARRAYS = ('numbers', 'nbr_fea_idx', 'nbr_dist')
+
+    def __init__(self, cache_dir, flush_size=4096):
+        self.cache_dir = cache_dir
+        self.flush_size = flush_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self._index = None
+        self._shards = {}
+        self._buffer = {}
+        self._writer = None
+        self._n_shards = 0
+        self._pid = None
+
+    def __getstate__(self):
+        # the state of a process (buffer, opened shards, writer) is not shared
+        return {'cache_dir': self.cache_dir, 'flush_size': self.flush_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _load_index(self):
+        self._index = {}
+        for index_file in glob.glob(os.path.join(self.cache_dir,
+                                                 'index_*.csv')):
+            with open(index_file) as f:
+                for key, shard, row in csv.reader(f):
+                    self._index[key] = (shard, int(row))
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = {
+                name: np.load(os.path.join(self.cache_dir,
+                                           f'{shard}_{name}.npy'),
+                              mmap_mode='r')
+                for name in self.ARRAYS + ('offsets',)}
+        return self._shards[shard]
+
+    def get(self, key):
+        """
+        Returns
+        -------
+
+        (numbers, nbr_fea_idx, nbr_dist) of the entry, or None if not cached
+        """
+        if key in self._buffer:
+            return self._buffer[key]
+        if self._index is None:
+            self._load_index()
+        if key not in self._index:
+            return None
+        shard, row = self._index[key]
+        arrays = self._shard(shard)
+        start, end = arrays['offsets'][row], arrays['offsets'][row + 1]
+        # copied out of the read-only mapping
+        return tuple(np.array(arrays[name][start:end])
+                     for name in self.ARRAYS)
+
+    def put(self, key, numbers, nbr_fea_idx, nbr_dist):
+        """Add an entry; it is written with the next shard."""
+        if self._pid != os.getpid():
+            # first entry of this process (possibly a fork of the process
+            # that created the cache): write the remaining entries at exit
+            self._buffer, self._writer, self._n_shards = {}, None, 0
+            self._pid = os.getpid()
+            Finalize(self, self.flush, exitpriority=10)
+        self._buffer[key] = (np.asarray(numbers, dtype=np.int16),
+                             np.asarray(nbr_fea_idx, dtype=np.int32),
+                             np.asarray(nbr_dist, dtype=np.float32))
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered entries as a new shard."""
+        if not self._buffer:
+            return
+        if self._writer is None:
+            self._writer = f'{os.getpid()}_{uuid.uuid4().hex[:8]}'
+        shard = f'{self._writer}_{self._n_shards:05d}'
+        keys = list(self._buffer)
+        entries = [self._buffer[key] for key in keys]
+        arrays = {name: np.concatenate([entry[i] for entry in entries])
+                  for i, name in enumerate(self.ARRAYS)}
+        arrays['offsets'] = np.concatenate(
+            ([0], np.cumsum([len(entry[0]) for entry in entries])))
+        for name, array in arrays.items():
+            path = os.path.join(self.cache_dir, f'{shard}_{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        # the shard is complete before it is referenced by the index
+        with open(os.path.join(self.cache_dir, f'index_{self._writer}.csv'),
+                  'a') as f:
+            for row, key in enumerate(keys):
+                f.write(f'{key},{shard},{row}\n')
+        if self._index is not None:
+            self._index.update((key, (shard, row))
+                               for row, key in enumerate(keys))
+        self._n_shards += 1
+        self._buffer = {}
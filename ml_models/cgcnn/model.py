@@ -74,6 +74,23 @@ class ConvLayer(nn.Module):
         out = self.softplus2(atom_in_fea + nbr_sumed)
         return out
 
+    def fold_batch_norm(self):
+        """
+        Fold bn1 into fc_full, for inference: in eval mode, the batch
+        normalization is an affine map of the outputs of fc_full, so the
+        folded layer computes the same features with one operation less.
+        """
+        bn = self.bn1
+        if isinstance(bn, nn.Identity):
+            return
+        assert not self.training, 'batch statistics cannot be folded'
+        with torch.no_grad():
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+            self.fc_full.weight.mul_(scale.unsqueeze(1))
+            self.fc_full.bias.copy_(
+                (self.fc_full.bias - bn.running_mean) * scale + bn.bias)
+        self.bn1 = nn.Identity()
+
 
 class CrystalGraphConvNet(nn.Module):
     """
@@ -141,8 +158,8 @@ class CrystalGraphConvNet(nn.Module):
           Bond features of each atom's M neighbors
         nbr_fea_idx: torch.LongTensor shape (N, M)
           Indices of M neighbors of each atom
-        crystal_atom_idx: list of torch.LongTensor of length N0
-          Mapping from the crystal idx to atom idx
+        crystal_atom_idx: torch.LongTensor shape (N0,)
+          Number of atoms of each crystal (see pooling)
 
         Returns
         -------
@@ -167,6 +184,16 @@ class CrystalGraphConvNet(nn.Module):
             out = self.logsoftmax(out)
         return out
 
+    def fold_batch_norm(self):
+        """
+        Fold the batch normalizations that follow a linear layer into it
+        (see ConvLayer.fold_batch_norm), for inference. Returns the model.
+        """
+        self.eval()
+        for conv_func in self.convs:
+            conv_func.fold_batch_norm()
+        return self
+
     def pooling(self, atom_fea, crystal_atom_idx):
         """
         Pooling the atom features to crystal features
@@ -179,11 +206,22 @@ class CrystalGraphConvNet(nn.Module):
 
         atom_fea: Variable(torch.Tensor) shape (N, atom_fea_len)
           Atom feature vectors of the batch
-        crystal_atom_idx: list of torch.LongTensor of length N0
-          Mapping from the crystal idx to atom idx
+        crystal_atom_idx: torch.LongTensor shape (N0,)
+          Number of atoms of each crystal, whose atoms are consecutive (see
+          collate_pool). A list of N0 torch.LongTensor, mapping each crystal
+          to the indices of its atoms, is also accepted.
         """
-        assert sum([len(idx_map) for idx_map in crystal_atom_idx]) ==\
-            atom_fea.data.shape[0]
-        summed_fea = [torch.mean(atom_fea[idx_map], dim=0, keepdim=True)
-                      for idx_map in crystal_atom_idx]
-        return torch.cat(summed_fea, dim=0)
+        if isinstance(crystal_atom_idx, (list, tuple)):
+            counts = torch.tensor([len(idx_map) for idx_map in crystal_atom_idx],
+                                  device=atom_fea.device)
+            atom_fea = atom_fea[torch.cat(list(crystal_atom_idx))]
+        else:
+            counts = crystal_atom_idx
+        # segment mean: one scatter-add over the atoms of the batch (with
+        # output_size, no synchronization with the device)
+        crystal_idx = torch.repeat_interleave(
+            torch.arange(len(counts), device=atom_fea.device), counts,
+            output_size=atom_fea.shape[0])
+        summed_fea = atom_fea.new_zeros(len(counts), atom_fea.shape[1])
+        summed_fea.index_add_(0, crystal_idx, atom_fea)
+        return summed_fea / counts.unsqueeze(1).to(atom_fea.dtype)
@@ -3,23 +3,47 @@
 # function `predict_cgcnn` to run inference on CIF files with a pretrained CGCNN.
 
 import argparse
+import contextlib
+import hashlib
 import os
 import shutil
 import sys
 import time
+import warnings
+from collections import OrderedDict
 from types import SimpleNamespace
-from typing import Optional, Tuple
+from typing import Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 from sklearn import metrics
-from torch.autograd import Variable
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 
-from cgcnn.data import CIFData, collate_pool
+from cgcnn.data import CIFData, InferenceBatchSampler, collate_pool
 from cgcnn.model import CrystalGraphConvNet
 
+# share of the free device memory given to a batch, see _atom_budget
+BATCH_MEMORY_FRACTION = 0.5
+# number of atoms of the batch probing the memory used per atom
+PROBE_ATOMS = 1024
+# number of batches whose predictions are copied to the host at once, see _predict
+COPY_EVERY = 16
+# autocast data type of each --precision (None: no autocast; int8: dynamic
+# quantization of the linear layers, see _inference_model)
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16, "int8": None}
+# checkpoint entries kept in the weights-only artifacts and in memory, see
+# _load_checkpoint
+ARTIFACT_KEYS = ("args", "state_dict", "normalizer", "epoch", "best_mae_error")
+# minimum number of checkpoints and of inference engines kept by a process
+# (more for a larger ensemble), see _cache_size
+MAX_ENGINES = 2
+
+# checkpoints and inference engines loaded by this process
+_checkpoints = OrderedDict()
+_engines = OrderedDict()
+
 
 def predict_cgcnn(
     modelpath: str,
@@ -30,9 +54,60 @@ def predict_cgcnn(
     print_freq: int = 10,
     chunk_id: int = 1,
     output_csv: Optional[str] = None,
+    graph_cache: Optional[str] = None,
+    resume: bool = False,
+    max_atoms: int = 0,
+    precision: str = "fp32",
+    compile_model: bool = False,
+    predict_only: bool = False,
+    copy_every: int = COPY_EVERY,
+    devices: Optional[Union[str, Sequence[str]]] = None,
+    model_cache: Optional[str] = None,
+    threads: int = 0,
+    ensemble: Optional[Union[str, Sequence[str]]] = None,
 ) -> str:
     """
     Callable wrapper that prepares config and runs inference; returns CSV path.
+
+    ``graph_cache`` is the directory of a persistent crystal graph cache
+    (see :class:`cgcnn.graph_cache.GraphCache`), shared across runs.
+
+    The crystals are predicted in a deterministic order and the predictions
+    are appended to the CSV batch by batch. With ``resume``, a run continues
+    after the predictions already in ``output_csv`` (if they were written in
+    the same order, e.g. by a killed run on the same structures).
+
+    A batch holds at most ``batch_size`` crystals and ``max_atoms`` atoms;
+    if ``max_atoms`` is 0, the atom budget is derived from the free memory of
+    the GPU (see :func:`_atom_budget`), and not bounded on a CPU.
+
+    ``precision`` and ``compile_model`` select the inference engine, see
+    :func:`_inference_model`.
+
+    With ``predict_only``, the targets of ``id_prop.csv`` are only copied to
+    the CSV, and no loss or metric is computed; the predictions are copied
+    to the host every ``copy_every`` batches (see :func:`_predict`).
+
+    ``devices`` lists the devices to predict on (e.g. ``["cuda:0",
+    "cuda:1"]``, or ``"all"`` for every visible GPU); with several devices,
+    the crystals are split among one process per device and their
+    predictions merged into ``output_csv`` (see :func:`_run_devices`).
+    ``"sockets"`` predicts on the CPUs, with one process per socket. If
+    None, a single process predicts on the current GPU, or on the CPU.
+    On a CPU, the model runs on ``threads`` threads (0: the CPUs of the
+    process not taken by the ``workers``, see :func:`_set_cpu_threads`).
+
+    The checkpoint is read once per process, and the ready model is reused
+    by the next predictions of the process (see :func:`_load_engine`).
+    ``model_cache`` is a directory of weights-only artifacts of the
+    checkpoints, memory-mapped instead of unpickled (see
+    :func:`_load_checkpoint`).
+
+    ``ensemble`` lists further checkpoints (or a comma-separated string of
+    them), evaluated with the model of ``modelpath`` on the same batches: the
+    CSV then holds the mean and the standard deviation of their predictions
+    (see :func:`_predictions`). An ensemble is only predicted, as with
+    ``predict_only``.
     """
     if output_csv is None:
         output_csv = f"test_results_{chunk_id}.csv"
@@ -46,22 +121,122 @@ def predict_cgcnn(
         print_freq=print_freq,
         chunk_id=chunk_id,
         output_csv=output_csv,
+        graph_cache=graph_cache,
+        resume=resume,
+        max_atoms=max_atoms,
+        precision=precision,
+        compile_model=compile_model,
+        predict_only=predict_only,
+        copy_every=copy_every,
+        model_cache=model_cache,
+        threads=threads,
+        ensemble=_resolve_ensemble(ensemble),
     )
 
-    model_args = _load_model_args(args.modelpath)
+    model_args = _load_model_args(args.modelpath, model_cache, _cache_size(args))
 
     # compute cuda flag once, store on args for convenience
     args.cuda = (not args.disable_cuda) and torch.cuda.is_available()
 
-    _ = _run(args, model_args)  # returns (metric_value, csv_path)
+    devices = _resolve_devices(devices, args.cuda)
+    if len(devices) > 1:
+        _run_devices(args, model_args, devices)
+    else:
+        if devices:
+            _use_device(args, devices[0])
+        _ = _run(args, model_args)  # returns (metric_value, csv_path)
+    return os.path.abspath(args.output_csv)
+
+
+def predict_cgcnn_stream(
+    modelpath: str,
+    dataset: IterableDataset,
+    output_csv: str,
+    batch_size: int = 256,
+    workers: int = 0,
+    disable_cuda: bool = False,
+    print_freq: int = 10,
+    precision: str = "fp32",
+    compile_model: bool = False,
+    predict_only: bool = False,
+    ensemble: Optional[Union[str, Sequence[str]]] = None,
+) -> str:
+    """
+    Run inference on structures produced on the fly (e.g. a
+    :class:`cgcnn.data.StructureStreamData`); returns CSV path.
+
+    See :func:`predict_cgcnn` for the options.
+    """
+    args = SimpleNamespace(
+        modelpath=modelpath,
+        cifpath=None,
+        batch_size=batch_size,
+        workers=workers,
+        disable_cuda=disable_cuda,
+        print_freq=print_freq,
+        output_csv=output_csv,
+        precision=precision,
+        compile_model=compile_model,
+        predict_only=predict_only,
+        ensemble=_resolve_ensemble(ensemble),
+    )
+    model_args = _load_model_args(args.modelpath, max_entries=_cache_size(args))
+    args.cuda = (not args.disable_cuda) and torch.cuda.is_available()
+
+    _ = _run(args, model_args, dataset=dataset)
     return os.path.abspath(args.output_csv)
 
 
-def _load_model_args(modelpath: str) -> SimpleNamespace:
+def _cache_size(args: SimpleNamespace) -> int:
+    """
+    Number of checkpoints and of engines kept by the process for ``args``:
+    ``MAX_ENGINES``, or every model of ``args.ensemble`` (with the one of
+    ``args.modelpath``), so that repeated runs do not evict their own models.
+    """
+    return max(MAX_ENGINES, 1 + len(getattr(args, "ensemble", None) or ()))
+
+
+def _load_checkpoint(modelpath: str, model_cache: Optional[str] = None, max_entries: int = MAX_ENGINES) -> dict:
+    """
+    The checkpoint of ``modelpath``, read once per process (until the file
+    changes). Only its ``ARTIFACT_KEYS`` entries (not the optimizer state)
+    are kept, for the last ``max_entries`` checkpoints (see :func:`_cache_size`).
+
+    With ``model_cache``, the checkpoint is read from a weights-only artifact
+    of the directory: the ``ARTIFACT_KEYS`` entries of the checkpoint (not
+    the optimizer state), loaded with ``weights_only`` and memory-mapped. The
+    artifact is written by the first load of the checkpoint.
+    """
+    stat = os.stat(modelpath)
+    key = (os.path.abspath(modelpath), stat.st_mtime_ns, stat.st_size)
+    if key in _checkpoints:
+        _checkpoints.move_to_end(key)
+        return _checkpoints[key]
+    artifact = None
+    if model_cache:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        artifact = os.path.join(model_cache, f"{digest}.pt")
+    if artifact is not None and os.path.isfile(artifact):
+        checkpoint = torch.load(artifact, map_location="cpu", weights_only=True, mmap=True)
+    else:
+        checkpoint = torch.load(modelpath, map_location=lambda storage, loc: storage)
+        checkpoint = {name: checkpoint[name] for name in ARTIFACT_KEYS if name in checkpoint}
+        if artifact is not None:
+            os.makedirs(model_cache, exist_ok=True)
+            torch.save(checkpoint, artifact + ".tmp")
+            os.replace(artifact + ".tmp", artifact)
+    _checkpoints[key] = checkpoint
+    while len(_checkpoints) > max_entries:
+        _checkpoints.popitem(last=False)
+    return checkpoint
+
+
+def _load_model_args(modelpath: str, model_cache: Optional[str] = None,
+                     max_entries: int = MAX_ENGINES) -> SimpleNamespace:
     """Load model hyperparameters from checkpoint; fall back to defaults."""
     if os.path.isfile(modelpath):
         print(f"=> loading model params '{modelpath}'")
-        model_checkpoint = torch.load(modelpath, map_location=lambda storage, loc: storage)
+        model_checkpoint = _load_checkpoint(modelpath, model_cache, max_entries)
         # Checkpoint is expected to have an "args" dict-like payload
         model_args = SimpleNamespace(**model_checkpoint["args"])
         print(f"=> loaded model params '{modelpath}'")
@@ -71,10 +246,9 @@ def _load_model_args(modelpath: str) -> SimpleNamespace:
     return model_args
 
 
-def _build_model(dataset: CIFData, model_args: SimpleNamespace, use_cuda: bool) -> Tuple[nn.Module, int, int]:
-    structures, _, _ = dataset[0]
-    orig_atom_fea_len = structures[0].shape[-1]
-    nbr_fea_len = structures[1].shape[-1]
+def _build_model(featurizer, model_args: SimpleNamespace, use_cuda: bool) -> Tuple[nn.Module, int, int]:
+    orig_atom_fea_len = featurizer.orig_atom_fea_len
+    nbr_fea_len = featurizer.nbr_fea_len
     model = CrystalGraphConvNet(
         orig_atom_fea_len,
         nbr_fea_len,
@@ -89,37 +263,444 @@ def _build_model(dataset: CIFData, model_args: SimpleNamespace, use_cuda: bool)
     return model, orig_atom_fea_len, nbr_fea_len
 
 
-def _run(args: SimpleNamespace, model_args: SimpleNamespace):
-    """Main evaluation entry. Returns (metric_value, csv_path)."""
-    dataset = CIFData(args.cifpath)
-    test_loader = DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-        shuffle=True,
-        num_workers=args.workers,
-        collate_fn=collate_pool,
-        pin_memory=args.cuda,
-    )
-
-    model, _, _ = _build_model(dataset, model_args, args.cuda)
+def _run(args: SimpleNamespace, model_args: SimpleNamespace, dataset=None, engine=None):
+    """
+    Main evaluation entry. Returns (metric_value, csv_path).
 
+    ``engine`` is the ``(model, normalizer)`` of :func:`_load_engine`, e.g.
+    kept by a :class:`cgcnn.server.PredictionServer` across runs (loaded from
+    ``args.modelpath`` if None). The engines of ``args.ensemble`` are loaded
+    by :func:`_load_ensemble`.
+    """
+    args.start = 0
+    if not args.cuda:
+        _set_cpu_threads(args)
+    if dataset is None:
+        # the Gaussian expansion of the distances is done on the device, see _validate
+        dataset = CIFData(args.cifpath, graph_cache_dir=getattr(args, "graph_cache", None), raw_distances=True,
+                          shuffle=False)
+    if engine is None:
+        engine = _load_engine(args, model_args, dataset.featurizer)
+    model, normalizer = engine
+    ensemble = _load_ensemble(args, model_args, dataset.featurizer)
     criterion = nn.NLLLoss() if model_args.task == "classification" else nn.MSELoss()
+
+    if not isinstance(dataset, IterableDataset):
+        max_atoms = _atom_budget(model, dataset.featurizer, args)
+        print(f"=> batches of at most {args.batch_size} crystals and {max_atoms or 'any number of'} atoms")
+        # share of the items of this process, see _run_devices
+        first, stop = getattr(args, "shard", (0, None))
+        sampler = InferenceBatchSampler(dataset.sizes(), args.batch_size, start=first, max_atoms=max_atoms,
+                                        stop=stop)
+        if getattr(args, "resume", False):
+            ids = [dataset.id_prop_data[idx][0] for idx in sampler.order()[first:stop]]
+            args.start = _resume_offset(args.output_csv, ids)
+            sampler.start = first + args.start
+            print(f"=> resuming after {args.start} predictions")
+        test_loader = DataLoader(
+            dataset,
+            batch_sampler=sampler,
+            num_workers=args.workers,
+            collate_fn=collate_pool,
+            pin_memory=args.cuda,
+        )
+    else:
+        test_loader = DataLoader(
+            dataset,
+            batch_size=args.batch_size,
+            num_workers=args.workers,
+            collate_fn=collate_pool,
+            pin_memory=args.cuda,
+        )
+
+    if getattr(args, "predict_only", False) or ensemble:
+        metric = _predict(args, model_args, test_loader, model, normalizer, ensemble)
+    else:
+        metric = _validate(args, model_args, test_loader, model, criterion, normalizer, test=True)
+    if getattr(dataset, "graph_cache", None) is not None:
+        # graphs built in this process (the workers flush theirs at exit)
+        dataset.graph_cache.flush()
+    return metric, args.output_csv
+
+
+def _load_engine(args: SimpleNamespace, model_args: SimpleNamespace, featurizer, modelpath: Optional[str] = None):
+    """
+    Load the model of ``modelpath`` (default: ``args.modelpath``) for
+    ``featurizer``'s features.
+
+    The feature lengths come from the featurizer (atom_init.json and the
+    Gaussian filter), not from the structures. The last engines (see
+    :func:`_cache_size`) are kept by the process, keyed by the checkpoint,
+    the feature lengths, the device and the engine options.
+
+    :returns: ``(model, normalizer)``, the model being the inference engine
+        of :func:`_inference_model`
+    """
+    modelpath = modelpath or args.modelpath
+    if os.path.isfile(modelpath):
+        stat = os.stat(modelpath)
+        checkpoint_key = (os.path.abspath(modelpath), stat.st_mtime_ns, stat.st_size)
+    else:
+        checkpoint_key = None
+    key = (checkpoint_key, featurizer.orig_atom_fea_len, featurizer.nbr_fea_len,
+           torch.cuda.current_device() if args.cuda else "cpu",
+           getattr(args, "precision", "fp32"), getattr(args, "compile_model", False))
+    if checkpoint_key is not None and key in _engines:
+        _engines.move_to_end(key)
+        return _engines[key]
+
+    model, _, _ = _build_model(featurizer, model_args, args.cuda)
     normalizer = Normalizer(torch.zeros(3))
 
-    if os.path.isfile(args.modelpath):
-        print(f"=> loading model '{args.modelpath}'")
-        checkpoint = torch.load(args.modelpath, map_location=lambda storage, loc: storage)
+    if os.path.isfile(modelpath):
+        print(f"=> loading model '{modelpath}'")
+        checkpoint = _load_checkpoint(modelpath, getattr(args, "model_cache", None), _cache_size(args))
         model.load_state_dict(checkpoint["state_dict"])
         normalizer.load_state_dict(checkpoint["normalizer"])
         print(
-            f"=> loaded model '{args.modelpath}' "
+            f"=> loaded model '{modelpath}' "
             f"(epoch {checkpoint['epoch']}, validation {checkpoint['best_mae_error']})"
         )
     else:
-        print(f"=> no model found at '{args.modelpath}'")
+        print(f"=> no model found at '{modelpath}'")
+        return _inference_model(model, args), normalizer
+    _engines[key] = _inference_model(model, args), normalizer
+    while len(_engines) > _cache_size(args):
+        _engines.popitem(last=False)
+    return _engines[key]
+
+
+def _resolve_ensemble(ensemble) -> list:
+    """Checkpoints of ``ensemble`` (see :func:`predict_cgcnn`); [] if None."""
+    if not ensemble:
+        return []
+    if isinstance(ensemble, str):
+        ensemble = ensemble.split(",")
+    return list(ensemble)
+
+
+def _load_ensemble(args: SimpleNamespace, model_args: SimpleNamespace, featurizer) -> list:
+    """
+    Engines (see :func:`_load_engine`) of the checkpoints of ``args.ensemble``,
+    whose architectures may differ from the one of ``args.modelpath``.
+
+    :raises ValueError: if a checkpoint does not exist, or was trained for
+        another task
+    """
+    engines = []
+    for modelpath in getattr(args, "ensemble", None) or ():
+        if not os.path.isfile(modelpath):
+            raise ValueError(f"No ensemble checkpoint at '{modelpath}'")
+        member_args = _load_model_args(modelpath, getattr(args, "model_cache", None), _cache_size(args))
+        if member_args.task != model_args.task:
+            raise ValueError(f"Ensemble checkpoint '{modelpath}' was trained for {member_args.task}, not {model_args.task}")
+        engines.append(_load_engine(args, member_args, featurizer, modelpath))
+    return engines
+
+
+def _resolve_devices(devices, use_cuda: bool) -> list:
+    """
+    Device names of ``devices`` (see :func:`predict_cgcnn`); [] if None.
+    ``cpu:<k>`` is the CPUs of the k-th socket of the process.
+    """
+    if not devices:
+        return []
+    if isinstance(devices, str):
+        if devices == "all":
+            n_gpus = torch.cuda.device_count() if use_cuda else 0
+            return [f"cuda:{k}" for k in range(n_gpus)] or ["cpu"]
+        if devices == "sockets":
+            return [f"cpu:{k}" for k in range(len(_cpu_sockets()))]
+        devices = devices.split(",")
+    return list(devices)
+
+
+def _available_cpus() -> set:
+    """CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return os.sched_getaffinity(0)
+    return set(range(os.cpu_count() or 1))
+
+
+def _cpu_sockets() -> list:
+    """CPUs of this process, grouped by socket (physical package)."""
+    sockets = {}
+    for cpu in sorted(_available_cpus()):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id") as f:
+                socket = int(f.read())
+        except (OSError, ValueError):
+            socket = 0
+        sockets.setdefault(socket, set()).add(cpu)
+    return [sockets[socket] for socket in sorted(sockets)]
+
+
+def _set_cpu_threads(args: SimpleNamespace):
+    """
+    Intra-op threads of the model on a CPU: ``args.threads`` if positive, else
+    the CPUs of the process left by its DataLoader workers (at least one).
+    """
+    threads = getattr(args, "threads", 0) or max(len(_available_cpus()) - args.workers, 1)
+    torch.set_num_threads(threads)
+    print(f"=> predicting on {threads} CPU threads")
+
+
+def _use_device(args: SimpleNamespace, device: str):
+    """Make ``device`` the device of this process."""
+    args.cuda = device.startswith("cuda")
+    if args.cuda:
+        torch.cuda.set_device(device)
+    elif device.startswith("cpu:") and hasattr(os, "sched_setaffinity"):
+        # the process and its DataLoader workers stay on the CPUs of a socket
+        os.sched_setaffinity(0, _cpu_sockets()[int(device[len("cpu:"):])])
 
-    metric = _validate(args, model_args, test_loader, model, criterion, normalizer, test=True)
-    return metric, args.output_csv
+
+def _run_shard(args: SimpleNamespace, model_args: SimpleNamespace, device: str):
+    """Entry point of the process of a device, see :func:`_run_devices`."""
+    _use_device(args, device)
+    _run(args, model_args)
+
+
+def _run_devices(args: SimpleNamespace, model_args: SimpleNamespace, devices: Sequence[str]):
+    """
+    Predict with one process per device, then merge their predictions.
+
+    The crystals, in the order of :class:`cgcnn.data.InferenceBatchSampler`,
+    are split in contiguous shards of about the same number of atoms. The
+    process of a device writes the predictions of its shard to
+    ``<output_csv>.part<rank>``; the parts are then concatenated, so that
+    ``output_csv`` has the rows of a single-device run. With ``resume``, a
+    process continues its own part, or the rows of a merged ``output_csv``.
+    The DataLoader workers are divided among the processes.
+
+    :raises RuntimeError: if the process of a device fails
+    """
+    dataset = CIFData(args.cifpath, shuffle=False)
+    sizes = dataset.sizes()
+    order = InferenceBatchSampler(sizes, args.batch_size).order()
+    cum_sizes = np.cumsum([sizes[idx] for idx in order])
+    n_devices = len(devices)
+    bounds = [0] * (n_devices + 1)
+    if len(order):
+        bounds = [0] + [min(int(np.searchsorted(cum_sizes, cum_sizes[-1] * k / n_devices)) + 1, len(order))
+                        for k in range(1, n_devices)] + [len(order)]
+    parts = [f"{args.output_csv}.part{rank}" for rank in range(n_devices)]
+
+    if getattr(args, "resume", False) and os.path.isfile(args.output_csv) \
+            and not any(os.path.isfile(part) for part in parts):
+        # a merged output: its complete rows are the first rows of the parts
+        n_done = _resume_offset(args.output_csv, [dataset.id_prop_data[idx][0] for idx in order])
+        with open(args.output_csv) as f:
+            rows = f.readlines()[:n_done]
+        for part, first, stop in zip(parts, bounds[:-1], bounds[1:]):
+            with open(part, "w") as f:
+                f.writelines(rows[first:stop])
+
+    ctx = mp.get_context("spawn")
+    processes = []
+    for rank, device in enumerate(devices):
+        shard_args = SimpleNamespace(**vars(args))
+        shard_args.output_csv = parts[rank]
+        shard_args.shard = (bounds[rank], bounds[rank + 1])
+        shard_args.workers = max(args.workers // n_devices, 1) if args.workers else 0
+        process = ctx.Process(target=_run_shard, args=(shard_args, model_args, device))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+    for device, process in zip(devices, processes):
+        if process.exitcode != 0:
+            raise RuntimeError(f"CGCNN prediction failed on {device} (exit code {process.exitcode})")
+
+    with open(args.output_csv, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out)
+    for part in parts:
+        os.remove(part)
+
+
+def _inference_model(model, args: SimpleNamespace):
+    """
+    The inference engine selected by ``args``, from a loaded model.
+
+    The batch normalizations are folded into the preceding linear layers
+    (see :meth:`cgcnn.model.CrystalGraphConvNet.fold_batch_norm`). With
+    ``args.compile_model``, the model is compiled by :func:`torch.compile`
+    for dynamic shapes (the number of atoms changes with every batch). The
+    forward pass runs under autocast when ``args.precision`` is ``bf16`` or
+    ``fp16`` (GPU only), see :func:`_autocast`. With ``int8`` (CPU only),
+    the weights of the linear layers of the atoms and their neighbors are
+    quantized to int8, and their inputs dynamically, batch by batch.
+
+    :raises ValueError: on an unknown precision, fp16 without a GPU, or int8
+        on a GPU
+    """
+    precision = getattr(args, "precision", "fp32")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    if precision == "fp16" and not args.cuda:
+        raise ValueError("fp16 inference needs a GPU, use bf16 on a CPU")
+    if precision == "int8" and args.cuda:
+        raise ValueError("int8 inference runs on a CPU, use bf16 or fp16 on a GPU")
+    model = model.fold_batch_norm()
+    if precision == "int8":
+        with warnings.catch_warnings():
+            # torch deprecates the quantized tensors, not the dynamic quantization itself
+            warnings.simplefilter("ignore", UserWarning)
+            # the layers applied to every atom and neighbor, with a scale per
+            # output feature; the head, applied once per crystal, stays in fp32
+            qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+            model = torch.ao.quantization.quantize_dynamic(model, {"embedding": qconfig, "convs": qconfig},
+                                                           dtype=torch.qint8)
+    if getattr(args, "compile_model", False):
+        model = torch.compile(model, dynamic=True)
+    return model
+
+
+def _autocast(args: SimpleNamespace):
+    """Autocast context of the forward pass for ``args.precision``."""
+    dtype = PRECISIONS[getattr(args, "precision", "fp32")]
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type="cuda" if args.cuda else "cpu", dtype=dtype)
+
+
+def _atom_budget(model, featurizer, args: SimpleNamespace) -> Optional[int]:
+    """
+    Maximum number of atoms of a batch: ``args.max_atoms`` if positive, else
+    ``BATCH_MEMORY_FRACTION`` of the free GPU memory divided by the memory
+    used per atom by the forward pass, measured on a synthetic batch
+    (``None``, i.e. no limit, on a CPU).
+    """
+    max_atoms = getattr(args, "max_atoms", 0)
+    if max_atoms > 0:
+        return max_atoms
+    if not args.cuda:
+        return None
+    device = torch.device("cuda")
+    n_atoms, max_num_nbr = PROBE_ATOMS, featurizer.max_num_nbr
+    atom_fea = torch.zeros(n_atoms, featurizer.orig_atom_fea_len, device=device)
+    nbr_fea = featurizer.gdf.expand_tensor(torch.zeros(n_atoms, max_num_nbr, device=device))
+    nbr_fea_idx = torch.zeros(n_atoms, max_num_nbr, dtype=torch.long, device=device)
+    crystal_atom_idx = torch.tensor([n_atoms], device=device)
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base = torch.cuda.memory_allocated()
+    with torch.no_grad(), _autocast(args):
+        model(atom_fea, nbr_fea, nbr_fea_idx, crystal_atom_idx)
+    per_atom = max(torch.cuda.max_memory_allocated() - base, 1) / n_atoms
+    del atom_fea, nbr_fea, nbr_fea_idx
+    torch.cuda.empty_cache()
+    free, _ = torch.cuda.mem_get_info()
+    return max(int(BATCH_MEMORY_FRACTION * free / per_atom), 1)
+
+
+def _resume_offset(output_csv: str, ids) -> int:
+    """
+    Number of predictions of a previous run that can be kept: the rows of
+    ``output_csv`` if they are the first ``ids``, else 0. A row left
+    incomplete by a killed run is dropped.
+    """
+    if not os.path.isfile(output_csv):
+        return 0
+    with open(output_csv, "rb+") as f:
+        content = f.read()
+        complete = content.rfind(b"\n") + 1
+        f.truncate(complete)
+    done = [line.split(",", 1)[0] for line in content[:complete].decode().splitlines()]
+    return len(done) if done == list(ids[:len(done)]) else 0
+
+
+def _device_inputs(args: SimpleNamespace, input, gdf):
+    """Inputs of a collated batch on the device, with expanded distances."""
+    with torch.no_grad():
+        if args.cuda:
+            input_var = tuple(tensor.cuda(non_blocking=True) for tensor in input)
+        else:
+            input_var = tuple(input)
+        if input_var[1].dim() == 2:
+            # raw (N, M) distances: expand them once on the device
+            input_var = (input_var[0], gdf.expand_tensor(input_var[1])) + input_var[2:]
+    return input_var
+
+
+def _predict(args: SimpleNamespace, model_args: SimpleNamespace, loader, model, normalizer, ensemble=()):
+    """
+    Prediction loop without targets or metrics; writes the predictions (of
+    the ensemble, see :func:`_predictions`).
+
+    The rows of :func:`_predictions` are appended to the CSV as they come,
+    so that a killed run can be resumed. Returns None (no metric).
+    """
+    import csv
+    start = time.time()
+    with open(args.output_csv, "a" if getattr(args, "start", 0) else "w", newline="") as out_file:
+        writer = csv.writer(out_file)
+        for rows in _predictions(args, model_args, loader, model, normalizer, loader.dataset.featurizer.gdf,
+                                 ensemble):
+            writer.writerows(rows)
+            out_file.flush()
+    print(f" ** predicted in {time.time() - start:.3f} s")
+    return None
+
+
+def _predictions(args: SimpleNamespace, model_args: SimpleNamespace, loader, model, normalizer, gdf, ensemble=()):
+    """
+    Predictions of the batches of ``loader``, without targets or metrics.
+
+    The predictions stay on the device and are copied to the host every
+    ``COPY_EVERY`` batches (``args.copy_every``), so that the loop only waits
+    for the device at those copies. Yields the ``(cif_id, target,
+    prediction)`` rows of every copy; the targets read from the dataset are
+    placeholders, returned as they are.
+
+    ``ensemble`` holds further ``(model, normalizer)`` engines: every batch
+    is moved to the device once and evaluated by all the models, and the rows
+    are ``(cif_id, target, mean, std)`` of their predictions (population
+    standard deviation).
+    """
+    copy_every = getattr(args, "copy_every", COPY_EVERY)
+    engines = [(model, normalizer)] + list(ensemble)
+    pending = []
+
+    def copy_pending():
+        preds = torch.cat([pred for pred, _, _ in pending]).cpu().tolist()
+        targets = [target for _, batch_targets, _ in pending for target in batch_targets]
+        cif_ids = [cif_id for _, _, batch_cif_ids in pending for cif_id in batch_cif_ids]
+        pending.clear()
+        return [(cif_id, target, *pred) for cif_id, target, pred in zip(cif_ids, targets, preds)]
+
+    for member, _ in engines:
+        member.eval()
+    start = time.time()
+    # iterable (streamed) datasets have no length
+    n_batches = "?" if isinstance(loader.dataset, IterableDataset) else len(loader)
+    for i, (input, target, batch_cif_ids) in enumerate(loader):
+        input_var = _device_inputs(args, input, gdf)
+        member_preds = []
+        for member, member_normalizer in engines:
+            with torch.no_grad(), _autocast(args):
+                output = member(*input_var)
+            with torch.no_grad():
+                output = output.float()
+                if model_args.task == "regression":
+                    member_preds.append(member_normalizer.denorm(output).view(-1))
+                else:
+                    member_preds.append(torch.exp(output)[:, 1])
+        with torch.no_grad():
+            if len(member_preds) == 1:
+                pred = member_preds[0].view(-1, 1)
+            else:
+                std, mean = torch.std_mean(torch.stack(member_preds), dim=0, correction=0)
+                pred = torch.stack([mean, std], dim=1)
+        pending.append((pred, target.view(-1).tolist(), batch_cif_ids))
+        if len(pending) == copy_every:
+            yield copy_pending()
+        if i % args.print_freq == 0:
+            print(f"Predict: [{i}/{n_batches}]\tElapsed {time.time() - start:.3f}")
+    if pending:
+        yield copy_pending()
 
 
 def _validate(
@@ -145,24 +726,19 @@ def _validate(
         auc_scores = AverageMeter()
 
     if test:
-        test_targets = []
-        test_preds = []
-        test_cif_ids = []
+        import csv
+        # written batch by batch, so that a killed run can be resumed
+        out_file = open(args.output_csv, "a" if getattr(args, "start", 0) else "w", newline="")
+        writer = csv.writer(out_file)
 
     model.eval()
     end = time.time()
+    # iterable (streamed) datasets have no length
+    n_batches = "?" if isinstance(val_loader.dataset, IterableDataset) else len(val_loader)
+    gdf = val_loader.dataset.featurizer.gdf
 
     for i, (input, target, batch_cif_ids) in enumerate(val_loader):
-        with torch.no_grad():
-            if args.cuda:
-                input_var = (
-                    Variable(input[0].cuda(non_blocking=True)),
-                    Variable(input[1].cuda(non_blocking=True)),
-                    input[2].cuda(non_blocking=True),
-                    [crys_idx.cuda(non_blocking=True) for crys_idx in input[3]],
-                )
-            else:
-                input_var = (Variable(input[0]), Variable(input[1]), input[2], input[3])
+        input_var = _device_inputs(args, input, gdf)
 
         if model_args.task == "regression":
             target_normed = normalizer.norm(target)
@@ -172,7 +748,9 @@ def _validate(
         with torch.no_grad():
             target_var = target_normed.cuda(non_blocking=True) if args.cuda else target_normed
 
-        output = model(*input_var)
+        with torch.no_grad(), _autocast(args):
+            output = model(*input_var)
+        output = output.float()
         loss = criterion(output, target_var)
 
         if model_args.task == "regression":
@@ -181,9 +759,8 @@ def _validate(
             mae_errors.update(mae_error, target.size(0))
             if test:
                 test_pred = normalizer.denorm(output.data.cpu())
-                test_targets += target.view(-1).tolist()
-                test_preds += test_pred.view(-1).tolist()
-                test_cif_ids += batch_cif_ids
+                writer.writerows(zip(batch_cif_ids, target.view(-1).tolist(), test_pred.view(-1).tolist()))
+                out_file.flush()
         else:
             accuracy, precision, recall, fscore, auc_score = class_eval(output.data.cpu(), target)
             losses.update(loss.data.cpu().item(), target.size(0))
@@ -195,9 +772,8 @@ def _validate(
             if test:
                 test_pred = torch.exp(output.data.cpu())
                 assert test_pred.shape[1] == 2
-                test_targets += target.view(-1).tolist()
-                test_preds += test_pred[:, 1].tolist()
-                test_cif_ids += batch_cif_ids
+                writer.writerows(zip(batch_cif_ids, target.view(-1).tolist(), test_pred[:, 1].tolist()))
+                out_file.flush()
 
         batch_time.update(time.time() - end)
         end = time.time()
@@ -205,14 +781,14 @@ def _validate(
         if i % args.print_freq == 0:
             if model_args.task == "regression":
                 print(
-                    f"Test: [{i}/{len(val_loader)}]\t"
+                    f"Test: [{i}/{n_batches}]\t"
                     f"Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t"
                     f"Loss {losses.val:.4f} ({losses.avg:.4f})\t"
                     f"MAE {mae_errors.val:.3f} ({mae_errors.avg:.3f})"
                 )
             else:
                 print(
-                    f"Test: [{i}/{len(val_loader)}]\t"
+                    f"Test: [{i}/{n_batches}]\t"
                     f"Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t"
                     f"Loss {losses.val:.4f} ({losses.avg:.4f})\t"
                     f"Accu {accuracies.val:.3f} ({accuracies.avg:.3f})\t"
@@ -223,11 +799,7 @@ def _validate(
                 )
 
     if test:
-        import csv
-        with open(args.output_csv, "w") as f:
-            writer = csv.writer(f)
-            for cif_id, target, pred in zip(test_cif_ids, test_targets, test_preds):
-                writer.writerow((cif_id, target, pred))
+        out_file.close()
 
     if model_args.task == "regression":
         print(f" ** MAE {mae_errors.avg:.3f}")
@@ -317,6 +889,26 @@ def _build_argparser():
     parser.add_argument("--print-freq", "-p", default=10, type=int, metavar="N", help="print frequency")
     parser.add_argument("--chunk_id", type=int, default=1, help="Chunk index (1-based)")
     parser.add_argument("--output-csv", default=None, help="Optional output CSV path")
+    parser.add_argument("--graph-cache", default=None, help="Optional directory of a persistent crystal graph cache")
+    parser.add_argument("--resume", action="store_true", help="Continue after the predictions already in the output CSV")
+    parser.add_argument("--max-atoms", default=0, type=int, metavar="N",
+                        help="maximum number of atoms per batch (0: derived from the free GPU memory)")
+    parser.add_argument("--precision", default="fp32", choices=list(PRECISIONS),
+                        help="precision of the forward pass (bf16/fp16 under autocast, fp16 on a GPU only, int8 on a CPU only)")
+    parser.add_argument("--compile", dest="compile_model", action="store_true",
+                        help="compile the model with torch.compile")
+    parser.add_argument("--predict-only", action="store_true",
+                        help="only write the predictions (no loss or metric on the targets)")
+    parser.add_argument("--copy-every", default=COPY_EVERY, type=int, metavar="N",
+                        help="with --predict-only, copy the predictions to the host every N batches")
+    parser.add_argument("--devices", default=None,
+                        help="comma-separated devices to predict on, one process each (e.g. cuda:0,cuda:1), or 'all' GPUs")
+    parser.add_argument("--model-cache", default=None,
+                        help="Optional directory of weights-only, memory-mapped artifacts of the checkpoints")
+    parser.add_argument("--threads", default=0, type=int, metavar="N",
+                        help="threads of the model on a CPU (0: the CPUs not taken by the data loading workers)")
+    parser.add_argument("--ensemble", default=None,
+                        help="comma-separated further checkpoints, predicted with the model (writes their mean and std)")
     return parser
 
 
@@ -331,5 +923,16 @@ if __name__ == "__main__":
         print_freq=cli.print_freq,
         chunk_id=cli.chunk_id,
         output_csv=cli.output_csv,
+        graph_cache=cli.graph_cache,
+        resume=cli.resume,
+        max_atoms=cli.max_atoms,
+        precision=cli.precision,
+        compile_model=cli.compile_model,
+        predict_only=cli.predict_only,
+        copy_every=cli.copy_every,
+        devices=cli.devices,
+        model_cache=cli.model_cache,
+        threads=cli.threads,
+        ensemble=cli.ensemble,
     )
     print(f"Wrote predictions to: {csv_path}")
@@ -0,0 +1,177 @@
+# Long-lived CGCNN inference server.
+# Loads the model once (torch import, CUDA context, checkpoint) and serves the
+# prediction requests of PredictionClient (see client.py) over a local socket,
+# so that repeated predictions (e.g. of several element systems) do not pay
+# that startup.
+
+import argparse
+import os
+import sys
+from multiprocessing.connection import Listener
+from types import SimpleNamespace
+
+import torch
+from pymatgen.core import Lattice, Structure
+from torch.utils.data import DataLoader
+
+from cgcnn.client import parse_address, server_authkey
+from cgcnn.data import CrystalGraphFeaturizer, InferenceBatchSampler, collate_pool
+from cgcnn.predict import (COPY_EVERY, _atom_budget, _cache_size, _load_engine, _load_ensemble, _load_model_args,
+                           _predictions, _resolve_ensemble, _run)
+
+# options of a predict_dir request (see PredictionClient.predict_dir)
+DIR_OPTIONS = ("batch_size", "workers", "resume", "graph_cache", "max_atoms")
+
+
+class PredictionServer:
+    """
+    CGCNN model held in memory, serving prediction requests.
+
+    A request is a dict whose ``op`` is ``predict_dir`` (predict a directory
+    of structures into a CSV, as :func:`cgcnn.predict.predict_cgcnn` with
+    ``predict_only``), ``predict`` (structures or crystal graphs sent with
+    the request), ``ping`` or ``shutdown``. The response is a dict, with an
+    ``error`` if the request failed; the server keeps serving.
+
+    Args:
+        modelpath (str): path to the trained model.
+        atom_init_file (str, optional): atom_init.json of the features of the
+            structures sent with the requests (default: the one of this package).
+        disable_cuda (bool): predict on the CPU.
+        precision (str), compile_model (bool): inference engine, see
+            :func:`cgcnn.predict._inference_model`.
+        batch_size (int), max_atoms (int): default batch bounds, see
+            :func:`cgcnn.predict.predict_cgcnn`.
+        ensemble (list or str, optional): further checkpoints, predicted with
+            the model (mean and standard deviation), see
+            :func:`cgcnn.predict.predict_cgcnn`.
+    """
+
+    def __init__(self, modelpath, atom_init_file=None, disable_cuda=False, precision="fp32",
+                 compile_model=False, batch_size=256, max_atoms=0, ensemble=None):
+        self.args = SimpleNamespace(
+            modelpath=modelpath,
+            batch_size=batch_size,
+            workers=0,
+            disable_cuda=disable_cuda,
+            print_freq=100,
+            precision=precision,
+            compile_model=compile_model,
+            max_atoms=max_atoms,
+            predict_only=True,
+            copy_every=COPY_EVERY,
+            ensemble=_resolve_ensemble(ensemble),
+        )
+        self.args.cuda = (not disable_cuda) and torch.cuda.is_available()
+        if atom_init_file is None:
+            atom_init_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "atom_init.json")
+        self.model_args = _load_model_args(modelpath, max_entries=_cache_size(self.args))
+        # the Gaussian expansion of the distances is done on the device
+        self.featurizer = CrystalGraphFeaturizer(atom_init_file, raw_distances=True)
+        self.engine = _load_engine(self.args, self.model_args, self.featurizer)
+        self.ensemble = _load_ensemble(self.args, self.model_args, self.featurizer)
+        self.max_atoms = _atom_budget(self.engine[0], self.featurizer, self.args)
+        self.n_requests = 0
+
+    def handle(self, request):
+        """:returns: the response to a request."""
+        self.n_requests += 1
+        try:
+            op = request["op"]
+            if op == "predict_dir":
+                return {"output_csv": self._predict_dir(request["cifpath"], request["output_csv"],
+                                                        request.get("options", {}))}
+            if op == "predict":
+                return {"predictions": self._predict_items(request["items"], request.get("kind", "structures"))}
+            if op == "ping":
+                return {"model": self.args.modelpath, "requests": self.n_requests}
+            if op == "shutdown":
+                return {}
+            raise ValueError(f"Unknown request '{op}'")
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def _predict_dir(self, cifpath, output_csv, options):
+        unknown = set(options) - set(DIR_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options {', '.join(sorted(unknown))}")
+        args = SimpleNamespace(**vars(self.args))
+        # the budget measured at startup, unless overridden
+        args.max_atoms = self.max_atoms or 0
+        args.__dict__.update(options)
+        args.cifpath, args.output_csv = cifpath, output_csv
+        _run(args, self.model_args, engine=self.engine)
+        return os.path.abspath(output_csv)
+
+    def _predict_items(self, items, kind):
+        if kind not in ("structures", "graphs"):
+            raise ValueError(f"Unknown kind '{kind}'")
+        data, sizes = [], []
+        for position, (_, item) in enumerate(items):
+            if kind == "graphs":
+                graph = item
+            else:
+                crystal = item if isinstance(item, Structure) else Structure(Lattice(item[0]), list(item[2]), item[1])
+                graph = self.featurizer.graph(crystal)
+            data.append((self.featurizer.features(*graph), torch.zeros(1), position))
+            sizes.append(len(graph[0]))
+        loader = DataLoader(data, batch_sampler=InferenceBatchSampler(sizes, self.args.batch_size,
+                                                                      max_atoms=self.max_atoms),
+                            collate_fn=collate_pool)
+        preds = [None] * len(items)
+        for rows in _predictions(self.args, self.model_args, loader, *self.engine, self.featurizer.gdf,
+                                 self.ensemble):
+            for position, _, *pred in rows:
+                # (mean, std) of an ensemble
+                preds[position] = pred[0] if len(pred) == 1 else tuple(pred)
+        return [(item_id, pred) for (item_id, _), pred in zip(items, preds)]
+
+    def serve(self, address, authkey=None):
+        """
+        Serve the requests sent to ``address`` (``host:port``, or the path of
+        a Unix socket) until a ``shutdown`` request. The connections are
+        served one at a time, in the order they come.
+
+        :raises ValueError: for a TCP address without ``authkey``
+        """
+        address = parse_address(address)
+        authkey = authkey or server_authkey()
+        if isinstance(address, tuple) and authkey is None:
+            raise ValueError("A TCP server needs an authentication key")
+        with Listener(address, authkey=authkey) as listener:
+            print(f"=> serving '{self.args.modelpath}' at {listener.address}")
+            while True:
+                with listener.accept() as conn:
+                    while True:
+                        try:
+                            request = conn.recv()
+                        except EOFError:
+                            break
+                        conn.send(self.handle(request))
+                        if request.get("op") == "shutdown":
+                            return
+
+
+def _build_argparser():
+    parser = argparse.ArgumentParser(description="Serve CGCNN predictions")
+    parser.add_argument("modelpath", help="path to the trained model.")
+    parser.add_argument("address", help="host:port, or path of a Unix socket (key of TCP servers: $CGCNN_SERVER_AUTHKEY)")
+    parser.add_argument("--atom-init", default=None, help="atom_init.json of the structures sent with the requests")
+    parser.add_argument("-b", "--batch-size", default=256, type=int, metavar="N", help="mini-batch size")
+    parser.add_argument("--max-atoms", default=0, type=int, metavar="N",
+                        help="maximum number of atoms per batch (0: derived from the free GPU memory)")
+    parser.add_argument("--disable-cuda", action="store_true", help="Disable CUDA")
+    parser.add_argument("--precision", default="fp32", help="precision of the forward pass (fp32, bf16, fp16, int8)")
+    parser.add_argument("--compile", dest="compile_model", action="store_true",
+                        help="compile the model with torch.compile")
+    parser.add_argument("--ensemble", default=None,
+                        help="comma-separated further checkpoints, predicted with the model (mean and std)")
+    return parser
+
+
+if __name__ == "__main__":
+    cli = _build_argparser().parse_args(sys.argv[1:])
+    server = PredictionServer(cli.modelpath, atom_init_file=cli.atom_init, disable_cuda=cli.disable_cuda,
+                              precision=cli.precision, compile_model=cli.compile_model,
+                              batch_size=cli.batch_size, max_atoms=cli.max_atoms, ensemble=cli.ensemble)
+    server.serve(cli.address)
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import csv
 import os
 import shutil
-from parsl import bash_app
+from functools import partial
+from parsl import bash_app, python_app
 
 from parsl_configs.parsl_executors_labels import CGCNN_EXECUTOR_LABEL
 from tools.config_labels import ConfigKeys as CK
+from tools.config_manager import get_optional
 import ml_models.cgcnn as cgcnn_pkg
 
 
@@ -14,18 +17,42 @@ def cmd_cgcnn_prediction(config, n_chunks, id):
     Prepare the working environment and build the command to run CGCNN predictions.
 
     The prediction workload is partitioned into ``n_chunks`` disjoint segments.
-    This task handles the segment identified by ``id``.
+    This task handles the segment identified by ``id``, i.e. the candidates
+    generated by the same chunk of
+    :func:`~parsl_tasks.gen_structures.run_gen_structures`. Those chunks are
+    balanced by number of generated atoms (see :mod:`tools.partition`), which
+    is also what drives the featurization and inference cost.
 
     :param dict config:
         A :class:`~tools.config_manager.ConfigManager` (or dict with the same
         fields). The following keys are read:
 
         - ``work_dir`` (str): root working directory for inputs/outputs
-        - ``batch_size`` (int): inference batch size
-        - ``num_workers`` (int): data-loading workers for inference
+        - ``batch_size`` (int): inference batch size (number of structures)
+        - ``cgcnn_max_atoms`` (int): maximum number of atoms of a batch (0:
+          derived from the free GPU memory)
+        - ``cgcnn_precision`` (str): ``fp32``, ``bf16``, ``fp16`` or ``int8``
+        - ``cgcnn_compile`` (int): compile the model with ``torch.compile``
+        - ``cgcnn_gpus_per_task`` (int): GPUs of the task, each predicting a
+          share of the chunk (0: the CPUs of the task, one process per socket)
+        - ``num_workers`` (int): data-loading workers for inference (on CPUs:
+          CPUs of the task, a quarter of them loading the data)
+        - ``cgcnn_graph_cache_dir`` (str): persistent crystal graph cache
+          shared across runs (empty: no cache)
+        - ``cgcnn_model_cache_dir`` (str): weights-only artifacts of the
+          checkpoint (empty: the checkpoint is read)
+        - ``cgcnn_ensemble`` (str): further checkpoints, comma-separated; the
+          mean and standard deviation of the ensemble are then written
+        - ``cgcnn_server`` (str): address of a running inference server
+          (``ml_models/cgcnn/server.py``); the chunk is then sent to it, and
+          the engine and GPU options are those of the server
 
         See :class:`~tools.config_manager.ConfigManager` for full field descriptions.
 
+    The predictions are written batch by batch in a deterministic order, and
+    a retried task resumes after those of its previous attempt. The targets
+    of the generated candidates are placeholders, so no metric is computed.
+
     :param int n_chunks:
         Total number of chunks for the workload.
 
@@ -53,13 +80,126 @@ def cmd_cgcnn_prediction(config, n_chunks, id):
     except Exception as e:
         raise
     num_workers = config[CK.NUM_WORKERS]
+    graph_cache = get_optional(config, CK.CGCNN_GRAPH_CACHE)
+    max_atoms = int(get_optional(config, CK.CGCNN_MAX_ATOMS))
+    precision = get_optional(config, CK.CGCNN_PRECISION)
+    compile_model = int(get_optional(config, CK.CGCNN_COMPILE))
+    n_gpus = int(get_optional(config, CK.CGCNN_GPUS))
+    server = get_optional(config, CK.CGCNN_SERVER)
+    model_cache = get_optional(config, CK.CGCNN_MODEL_CACHE)
+    ensemble = get_optional(config, CK.CGCNN_ENSEMBLE)
+    if server:
+        # the model is already loaded by the server: a light client process
+        return (
+            f"python {os.path.join(pkg_dir, 'client.py')} {server} {dir_structures} "
+            f"--output-csv {os.path.join(config[CK.WORK_DIR], f'test_results_{id}.csv')} "
+            f"--batch-size {config[CK.BATCH_SIZE]} --workers {num_workers} --resume"
+            + (f" --graph-cache {graph_cache}" if graph_cache else "")
+            + (f" --max-atoms {max_atoms}" if max_atoms > 0 else "")
+        )
+    if n_gpus > 0:
+        resources, workers, devices = f" --gpus={n_gpus}", num_workers, ("all" if n_gpus > 1 else "")
+    else:
+        # the CPUs of the task run the model, but for the data loading workers
+        resources, workers, devices = "", max(num_workers // 4, 1), "sockets"
     return (
-        f"srun -N 1 -n 1 --exclusive -c {num_workers} --gpus=1 "
+        f"srun -N 1 -n 1 --exclusive -c {num_workers}{resources} "
         f"python {predict_script_path} {model_path} {dir_structures} "
-        f"--batch-size {config[CK.BATCH_SIZE]} --workers {num_workers} --chunk_id {id}"
+        f"--batch-size {config[CK.BATCH_SIZE]} --workers {workers} --chunk_id {id} --resume --predict-only"
+        + (f" --graph-cache {graph_cache}" if graph_cache else "")
+        + (f" --max-atoms {max_atoms}" if max_atoms > 0 else "")
+        + f" --precision {precision}"
+        + (" --compile" if compile_model else "")
+        + (" --disable-cuda" if n_gpus == 0 else "")
+        + (f" --devices {devices}" if devices else "")
+        + (f" --model-cache {model_cache}" if model_cache else "")
+        + (f" --ensemble {ensemble}" if ensemble else "")
     )
 
 
 @bash_app(executors=[CGCNN_EXECUTOR_LABEL])
 def cgcnn_prediction(config, n_chunks, id):
     return cmd_cgcnn_prediction(config, n_chunks, id)
+
+
+def _streamed_candidates_to_keep(csv_file, ef_threshold):
+    """
+    Ids of the candidates of a chunk that the selection may still pick.
+
+    :func:`parsl_tasks.select_structures.read_csv` keeps the candidates below
+    ``ef_threshold`` (at most ``MAX_STRUCTURES`` of them), or the lowest
+    ``MIN_STRUCTURES`` ones. Any candidate it picks over the merged results is
+    among the same subset of its own chunk, so only that subset is written.
+    """
+    from parsl_tasks.select_structures import MIN_STRUCTURES, MAX_STRUCTURES
+    with open(csv_file) as f:
+        rows = sorted(((row[0], float(row[2])) for row in csv.reader(f)), key=lambda x: x[1])
+    n_below = sum(1 for _, ef in rows if ef < ef_threshold)
+    n_keep = max(min(n_below, MAX_STRUCTURES), MIN_STRUCTURES)
+    return [cif_id for cif_id, _ in rows[:n_keep]]
+
+
+def run_gen_cgcnn_stream(config, n_chunks, chunk_id):
+    """
+    Generate the candidates of a chunk and predict their formation energy in
+    the same process, without writing the generated structures first.
+
+    Streaming alternative to :func:`parsl_tasks.gen_structures.run_gen_structures`
+    followed by :func:`cmd_cgcnn_prediction`: the DataLoader workers generate
+    and featurize the candidates of their share of the chunk's prototypes while
+    the model consumes the batches. Once the predictions are written, only the
+    candidates that the selection step may pick are regenerated and written to
+    ``work_dir/structures/<chunk_id>``.
+
+    :param dict config:
+        A :class:`~tools.config_manager.ConfigManager` (or dict with the same
+        fields). Reads the keys of
+        :func:`~parsl_tasks.gen_structures.run_gen_structures`, plus
+        ``cgcnn_batch_size``, ``cgcnn_precision``, ``cgcnn_compile`` and
+        ``formation_energy_threshold``.
+
+    :param int n_chunks:
+        Total number of chunks for the workload.
+
+    :param int chunk_id:
+        Index of the partition to execute, where ``1 <= chunk_id <= n_chunks``.
+
+    :returns: Absolute path to this partition’s predictions CSV.
+    :rtype: str
+    """
+    from ml_models.cgcnn.data import StructureStreamData
+    from ml_models.cgcnn.predict import predict_cgcnn_stream
+    from parsl_tasks.gen_structures import (chunk_prototypes, generate_candidates,
+                                            materialize_candidates, _generation_options)
+
+    options, _ = _generation_options(config)
+    os.makedirs(config[CK.WORK_DIR], exist_ok=True)
+    pkg_dir = os.path.dirname(cgcnn_pkg.__file__)
+    generate = partial(generate_candidates,
+                       dirs=os.path.abspath(config[CK.INITIAL_STRS]),
+                       elements=str(config[CK.ELEMENTS]).split('-'),
+                       chunk_id=chunk_id,
+                       **options)
+    dataset = StructureStreamData(chunk_prototypes(config, n_chunks, chunk_id), generate,
+                                  os.path.join(pkg_dir, "atom_init.json"), raw_distances=True)
+
+    out_csv = predict_cgcnn_stream(
+        modelpath=os.path.join(pkg_dir, "form_1st.pth.tar"),
+        dataset=dataset,
+        output_csv=os.path.join(config[CK.WORK_DIR], f"test_results_{chunk_id}.csv"),
+        batch_size=int(config[CK.BATCH_SIZE]),
+        workers=int(config[CK.NUM_WORKERS]),
+        precision=get_optional(config, CK.CGCNN_PRECISION),
+        compile_model=bool(int(get_optional(config, CK.CGCNN_COMPILE))),
+        predict_only=True,
+        ensemble=get_optional(config, CK.CGCNN_ENSEMBLE),
+    )
+
+    keep = _streamed_candidates_to_keep(out_csv, float(config[CK.EF_THR]))
+    materialize_candidates(config, n_chunks, chunk_id, keep)
+    return out_csv
+
+
+@python_app(executors=[CGCNN_EXECUTOR_LABEL])
+def gen_cgcnn_stream(config, n_chunks, chunk_id):
+    return run_gen_cgcnn_stream(config, n_chunks, chunk_id)
@@ -1,13 +1,25 @@
 from parsl import python_app
 from itertools import permutations
 from multiprocessing import Pool
-from pymatgen.core import Structure
+from collections import defaultdict
+from pymatgen.core import Element, Lattice, Structure
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+from pymatgen.analysis.molecule_structure_comparator import CovalentRadius
+import numpy as np
+import functools
 import warnings
+import json
+import csv
 import math
+import time
 import os
 
 from parsl_configs.parsl_executors_labels import GENERATE_EXECUTOR_LABEL
 from tools.config_labels import ConfigKeys as CK
+from tools.config_manager import get_optional
+from tools.structure_store import INDEX_FILE as STORE_INDEX_FILE, SHARD_PREFIX, StructureStoreWriter
+from tools.partition import TIMINGS_FILE, balanced_partition, estimate_costs, read_timings
+from tools.prototype_cache import load_prototype
 
 badele_vec = ['D', 'He', 'Ne', 'Ar', 'Br', 'Kr', 'Tc', 'Xe', 'At', 'Rn', 'Pm', 'Fr', 'Rf',
               'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
@@ -15,39 +27,628 @@ badele_vec = ['D', 'He', 'Ne', 'Ar', 'Br', 'Kr', 'Tc', 'Xe', 'At', 'Rn', 'Pm', '
               'F', 'Cl', 'Br', 'I', 'O']
 
 LATTICE_SCALES = [0.96, 0.98, 1.0, 1.02, 1.04]
+ADAPTIVE_SCALES = "adaptive"
 
 
-def _generate_structures(structure_file, elements, dirs):
-    """Generate new structures by permuting elements and scaling lattices."""
+PROGRESS_FILE = "gen_progress.csv"
+OPTIONS_FILE = "gen_options.json"
+PERMUTATION_MODES = ("all", "unique")
+STRUCTURE_FORMATS = ("cif", "npz")
+
+# tolerances used to detect the symmetry operations of a prototype
+SYMPREC = 0.01
+SITE_MATCH_TOL = 0.05  # angstrom
+
+
+def _site_permutations(lattice, frac_coords):
+    """
+    Site permutations induced by the symmetry operations of the prototype skeleton.
+
+    The skeleton is the prototype with every site occupied by the same species,
+    so an operation that exchanges two Wyckoff positions occupied by different
+    species is kept. Row ``k`` maps site ``i`` to site ``perms[k][i]``.
+    """
+    skeleton = Structure(Lattice(lattice), ["H"] * len(frac_coords), frac_coords)
+    try:
+        ops = SpacegroupAnalyzer(skeleton, symprec=SYMPREC).get_symmetry_operations()
+    except Exception:
+        ops = []
+
+    identity = np.arange(len(frac_coords))
+    perms = [identity]
+    for op in ops:
+        diff = op.operate_multi(frac_coords)[:, np.newaxis, :] - frac_coords[np.newaxis, :, :]
+        diff -= np.round(diff)
+        dist = np.linalg.norm(diff @ lattice, axis=-1)
+        perm = np.argmin(dist, axis=1)
+        if dist[identity, perm].max() < SITE_MATCH_TOL and len(np.unique(perm)) == len(perm):
+            perms.append(perm)
+    return np.unique(np.array(perms), axis=0)
+
+
+def _unique_permutations(site_species, element_permutations, elements, site_perms):
+    """
+    Indices of the element permutations that give symmetry-distinct structures.
+
+    Every permutation colors the prototype sites with the target elements. Two
+    colorings are equivalent when a symmetry operation of the skeleton maps one
+    onto the other; the lexicographically smallest image is used as the
+    canonical form, and only the first permutation of each class is kept.
+
+    :param site_species: index (in the prototype composition) of each site species
+    :param element_permutations: candidate permutations of ``elements``
+    :param elements: target elements
+    :param site_perms: output of :func:`_site_permutations`
+    """
+    kept, seen = [], set()
+    for p, perm in enumerate(element_permutations):
+        species_ids = np.array([elements.index(el) for el in perm])
+        coloring = species_ids[site_species]
+        images = coloring[site_perms]
+        canonical = tuple(images[np.lexsort(images.T[::-1])[0]])
+        if canonical not in seen:
+            seen.add(canonical)
+            kept.append(p)
+    return kept
+
+
+@functools.lru_cache(maxsize=None)
+def _atomic_volume(symbol):
+    """Volume of the atomic sphere of an element (NaN if its radius is unknown)."""
+    element = Element(symbol)
+    radius = element.atomic_radius or element.atomic_radius_calculated
+    return float(radius) ** 3 if radius else np.nan
+
+
+def _adaptive_scales(prototype_species, site_species, perm_species):
+    """
+    One lattice scale per element permutation, estimated from atomic volumes.
+
+    The volume of the prototype is scaled by the ratio between the summed
+    atomic volumes of the substituted and of the original sites, i.e. the
+    lattice vectors by the cube root of that ratio. The scale is 1 when an
+    atomic radius is unknown.
+
+    :param prototype_species: species symbol of each prototype site
+    :param site_species: index of each site species (see :func:`_substitute`)
+    :param perm_species: (n_perms, n_elements) symbols of the target permutations
+    :returns: (n_perms,) scales
+    """
+    old_volume = sum(_atomic_volume(el) for el in prototype_species)
+    perm_volumes = np.vectorize(_atomic_volume, otypes=[float])(np.asarray(perm_species))
+    new_volume = perm_volumes[:, site_species].sum(axis=1)
+    scales = np.cbrt(new_volume / old_volume)
+    return np.where(np.isfinite(scales), scales, 1.0)
+
+
+@functools.lru_cache(maxsize=None)
+def _covalent_radius(symbol):
+    """Covalent radius of an element, or its atomic radius if not tabulated."""
+    if symbol in CovalentRadius.radius:
+        return CovalentRadius.radius[symbol]
+    element = Element(symbol)
+    return float(element.atomic_radius or element.atomic_radius_calculated or 0.0)
+
+
+def _close_pairs(prototype, cutoff, cache):
+    """
+    Site pairs of the prototype closer than ``cutoff``, including periodic images.
+
+    The neighbor search is done once per prototype: ``cache`` holds the pairs
+    found with the largest cutoff so far, which are filtered for a smaller one.
+
+    :returns: ``(centers, neighbors, distances)`` arrays
+    """
+    if cache.get("cutoff", -1.0) < cutoff:
+        skeleton = Structure(Lattice(prototype.lattice), ["H"] * len(prototype.frac_coords), prototype.frac_coords)
+        centers, neighbors, _, distances = skeleton.get_neighbor_list(cutoff)
+        cache.update(cutoff=cutoff, pairs=(centers, neighbors, distances))
+    centers, neighbors, distances = cache["pairs"]
+    close = distances < cutoff
+    return centers[close], neighbors[close], distances[close]
+
+
+def _substitute(prototype, elements, permutation_mode="all", site_perms=None, lattice_scales=LATTICE_SCALES,
+                min_distance_factor=0.0, pair_cache=None):
+    """
+    Substitute the target elements into a prototype and scale its lattice.
+
+    The species of every permutation are taken from a site -> species index
+    map, and all the scaled lattices are derived at once from the prototype
+    lattice matrix (an isotropic volume scaling by ``scale ** 3`` multiplies
+    the lattice vectors by ``scale``).
+
+    :param Prototype prototype: an allowed prototype (see :mod:`tools.prototype_cache`)
+    :param site_perms: output of :func:`_site_permutations`, computed if not given
+    :param lattice_scales: scales applied to every permutation, or
+        ``"adaptive"`` for a single scale per permutation (see :func:`_adaptive_scales`)
+    :param float min_distance_factor: if positive, the candidates with two
+        atoms closer than ``min_distance_factor`` times the sum of their
+        covalent radii are rejected
+    :param dict pair_cache: cache of :func:`_close_pairs`, shared by the calls on the same prototype
+    :returns: ``(candidates, n_skipped, n_rejected)`` (see :func:`_generate_arrays`);
+        ``n_rejected`` is the number of candidates rejected by the distance check
+    """
     element_permutations = list(permutations(elements))
-    structures = []
-    original_structure = Structure.from_file(os.path.join(dirs, structure_file))
+
+    # species of the prototype, in order of appearance
+    elements_to_substitute = list(dict.fromkeys(prototype.species))
+    site_species = np.array([elements_to_substitute.index(el) for el in prototype.species])
+    element_numbers = {el: Element(el).Z for el in elements}
+
+    kept_permutations = range(len(element_permutations))
+    if permutation_mode == "unique":
+        if site_perms is None:
+            site_perms = _site_permutations(prototype.lattice, prototype.frac_coords)
+        kept_permutations = _unique_permutations(
+            site_species, element_permutations, elements, site_perms)
+
+    if lattice_scales == ADAPTIVE_SCALES:
+        # (n_perms, 1) scales: one candidate per permutation
+        scales = _adaptive_scales(prototype.species, site_species, element_permutations)[:, np.newaxis]
+    else:
+        scales = np.broadcast_to(np.asarray(lattice_scales), (len(element_permutations), len(lattice_scales)))
+    lattices = scales[:, :, np.newaxis, np.newaxis] * prototype.lattice
+    n_scales = scales.shape[1]
+
+    # distances scale with the lattice: one neighbor search, at scale 1, covers every candidate
+    keep = np.ones(scales.shape, dtype=bool)
+    if min_distance_factor > 0:
+        radii = np.array([[_covalent_radius(el) for el in perm] for perm in element_permutations])
+        cutoff = min_distance_factor * 2 * radii.max() / scales.min()
+        centers, neighbors, distances = _close_pairs(prototype, cutoff, {} if pair_cache is None else pair_cache)
+        if len(distances):
+            site_radii = radii[:, site_species]
+            # smallest distance / (r_i + r_j) of each permutation
+            closest = (distances / (site_radii[:, centers] + site_radii[:, neighbors])).min(axis=1)
+            keep = scales * closest[:, np.newaxis] >= min_distance_factor
+
+    candidates = []
+    n_rejected = 0
+    for p in kept_permutations:
+        perm_numbers = np.array([element_numbers[el] for el in element_permutations[p]])
+        numbers = perm_numbers[site_species]
+        for s in range(n_scales):
+            if keep[p, s]:
+                candidates.append((p * n_scales + s, lattices[p, s], numbers))
+            else:
+                n_rejected += 1
+
+    return candidates, len(element_permutations) - len(kept_permutations), n_rejected
+
+
+def _generate_arrays(structure_file, elements, dirs, permutation_mode="all", prototype_cache="",
+                     lattice_scales=LATTICE_SCALES, min_distance_factor=0.0):
+    """
+    Generate new structures by permuting elements and scaling lattices, as arrays.
+
+    The prototype is parsed once, or read from the prototype cache
+    (:mod:`tools.prototype_cache`) when ``prototype_cache`` is set. All the
+    candidates share the fractional coordinates of the prototype.
+
+    :returns: ``(frac_coords, candidates, n_skipped)``, where ``candidates`` is
+        a list of ``(offset, lattice, numbers)`` tuples. ``offset`` is the
+        position of the candidate in the full permutation x scale grid, so that
+        identifiers stay stable whether or not equivalent permutations are
+        dropped. ``n_skipped`` is the number of dropped symmetry-equivalent
+        permutations. Candidates rejected by the distance check (see
+        :func:`_substitute`) are left out.
+    """
+    prototype = load_prototype(os.path.join(dirs, structure_file), badele_vec, prototype_cache)
 
     # Skip if any disallowed element present
-    if any(element.symbol in badele_vec for element in original_structure.composition):
-        return []
+    if not prototype.allowed:
+        return None, [], 0
+
+    candidates, n_skipped, _ = _substitute(prototype, elements, permutation_mode, lattice_scales=lattice_scales,
+                                           min_distance_factor=min_distance_factor)
+    return prototype.frac_coords, candidates, n_skipped
 
-    elements_to_substitute = [el.symbol for el in original_structure.composition]
 
-    for perm in element_permutations:
-        for scale in LATTICE_SCALES:
-            new_structure = original_structure.copy()
-            for i, site in enumerate(new_structure):
-                if site.specie.symbol in elements_to_substitute:
-                    new_structure.replace(i, perm[elements_to_substitute.index(site.specie.symbol)])
-            new_structure.scale_lattice(new_structure.volume * (scale ** 3))
-            structures.append(new_structure)
+def _generate_structures(structure_file, elements, dirs, **options):
+    """
+    Generate new structures by permuting elements and scaling lattices.
 
-    return structures
+    :param options: generation options of :func:`_generate_arrays`
+    :returns: ``(candidates, n_skipped)``, where ``candidates`` is a list of
+        ``(offset, structure)`` pairs (see :func:`_generate_arrays`).
+    """
+    frac_coords, candidates, n_skipped = _generate_arrays(structure_file, elements, dirs, **options)
+    return [(offset, Structure(Lattice(lattice), numbers.tolist(), frac_coords))
+            for offset, lattice, numbers in candidates], n_skipped
 
 
 def _process_structure(args):
-    """Process a single structure file and write generated CIFs."""
-    structure_file, start_index, dirs, elements, chunk_id = args
-    structures = _generate_structures(structure_file, elements, dirs)
-    for i, structure in enumerate(structures, start=start_index):
-        structure.to(filename=f"{chunk_id}_{i}.cif")
-    return len(structures)
+    """
+    Process a single structure file, for every element system of the batch.
+
+    The prototype is read (and its symmetry analyzed) once, then the
+    candidates of each system are generated. With the ``cif`` format, they
+    are written as CIF files to the directory of their system. With the
+    ``npz`` format, they are returned as ``(lattice, frac_coords, numbers)``
+    arrays so that the caller appends them to the structure store; no
+    :class:`~pymatgen.core.Structure` is built in that case.
+
+    Returns the ``(structure_file, start_index)`` job, then, for each system,
+    the ids of the generated structures, the number of skipped permutations,
+    the number of rejected candidates and the arrays (``None`` with the ``cif`` format), and the processing
+    time in seconds.
+    """
+    structure_file, start_index, dirs, systems, chunk_id, options, structure_format = args
+    start = time.time()
+    prototype = load_prototype(os.path.join(dirs, structure_file), badele_vec, options["prototype_cache"])
+
+    results = []
+    site_perms = None
+    pair_cache = {}
+    if prototype.allowed and options["permutation_mode"] == "unique":
+        site_perms = _site_permutations(prototype.lattice, prototype.frac_coords)
+    for elements, dir_structures in systems:
+        # Skip if any disallowed element present
+        candidates, n_skipped, n_rejected = [], 0, 0
+        if prototype.allowed:
+            candidates, n_skipped, n_rejected = _substitute(
+                prototype, elements, options["permutation_mode"], site_perms, options["lattice_scales"],
+                options["min_distance_factor"], pair_cache)
+        ids, arrays = [], []
+        for offset, lattice, numbers in candidates:
+            if structure_format == "cif":
+                structure = Structure(Lattice(lattice), numbers.tolist(), prototype.frac_coords)
+                structure.to(filename=os.path.join(dir_structures, f"{chunk_id}_{start_index + offset}.cif"))
+            else:
+                arrays.append((lattice, prototype.frac_coords, numbers.astype(np.int16)))
+            ids.append(start_index + offset)
+        results.append((ids, n_skipped, n_rejected, arrays if structure_format == "npz" else None))
+    return (structure_file, start_index), results, time.time() - start
+
+
+def _generation_options(config):
+    """
+    Read and validate the generation options of the config.
+
+    :returns: ``(options, structure_format)``, where ``options`` holds the
+        keyword arguments of :func:`_generate_arrays`
+    """
+    permutation_mode = get_optional(config, CK.GEN_PERMUTATIONS)
+    if permutation_mode not in PERMUTATION_MODES:
+        raise ValueError(f"{CK.GEN_PERMUTATIONS} must be one of {PERMUTATION_MODES}, got '{permutation_mode}'.")
+    structure_format = get_optional(config, CK.STRUCTURE_FORMAT)
+    if structure_format not in STRUCTURE_FORMATS:
+        raise ValueError(f"{CK.STRUCTURE_FORMAT} must be one of {STRUCTURE_FORMATS}, got '{structure_format}'.")
+    options = {
+        "permutation_mode": permutation_mode,
+        "prototype_cache": get_optional(config, CK.PROTOTYPE_CACHE),
+        "lattice_scales": _parse_lattice_scales(get_optional(config, CK.LATTICE_SCALES)),
+        "min_distance_factor": float(get_optional(config, CK.MIN_DISTANCE_FACTOR)),
+    }
+    return options, structure_format
+
+
+def _options_record(config, n_chunks, elements):
+    """
+    Options the outputs of a chunk depend on, as recorded in ``OPTIONS_FILE``:
+    a chunk is resumed, or considered complete, only if they are unchanged.
+    """
+    options, structure_format = _generation_options(config)
+    numall = _num_candidates_per_prototype(elements, options["lattice_scales"])
+    record = {
+        "elements": list(elements),
+        "initial_structures_dir": os.path.abspath(config[CK.INITIAL_STRS]),
+        "n_chunks": n_chunks,
+        "gen_timings": get_optional(config, CK.GEN_TIMINGS),
+        "structure_format": structure_format,
+        "permutation_mode": options["permutation_mode"],
+        "lattice_scales": options["lattice_scales"],
+        "min_distance_factor": options["min_distance_factor"],
+        "numall": numall,
+        "n_scales": numall // math.factorial(len(elements)),
+    }
+    # as read back from the file
+    return json.loads(json.dumps(record))
+
+
+def _parse_lattice_scales(value):
+    """Parse the ``lattice_scales`` option: comma-separated scales, or ``"adaptive"``."""
+    if str(value).strip() == ADAPTIVE_SCALES:
+        return ADAPTIVE_SCALES
+    try:
+        scales = tuple(float(scale) for scale in str(value).split(","))
+    except ValueError:
+        scales = ()
+    if not scales or min(scales) <= 0:
+        raise ValueError(f"{CK.LATTICE_SCALES} must be '{ADAPTIVE_SCALES}' or positive comma-separated scales, got '{value}'.")
+    return scales
+
+
+def _element_systems(config):
+    """
+    Element systems generated by one :func:`run_gen_structures` call.
+
+    The first one is ``elements``, written to ``work_dir``; each system of
+    ``batch_elements`` is written next to it, to ``<work_dir>/../<system>``,
+    which is the work directory a run on that system would use. A system
+    listed twice is generated once.
+
+    :returns: list of ``(elements, work_dir)`` pairs
+    :raises ValueError: if the systems do not all have the same number of
+        elements, or if a system is a permutation of another one (its work
+        directory would be left empty)
+    """
+    work_dir = os.path.abspath(config[CK.WORK_DIR])
+    systems = [(str(config[CK.ELEMENTS]).split('-'), work_dir)]
+    # two outputs in the same directory would truncate each other's files
+    seen = {tuple(sorted(systems[0][0])): work_dir}
+    for system in get_optional(config, CK.BATCH_ELEMENTS).split(","):
+        system = system.strip()
+        if not system:
+            continue
+        elements = system.split('-')
+        system_dir = os.path.join(os.path.dirname(work_dir), system)
+        if system_dir in seen.values():
+            continue
+        if tuple(sorted(elements)) in seen:
+            raise ValueError(f"'{system}' of {CK.BATCH_ELEMENTS} is a permutation of a system already generated "
+                             f"to {seen[tuple(sorted(elements))]}: list each system once, in one element order.")
+        seen[tuple(sorted(elements))] = system_dir
+        systems.append((elements, system_dir))
+    # the same id space (and chunk partition) is used for all the systems
+    if len({len(elements) for elements, _ in systems}) > 1:
+        raise ValueError(f"All the systems of {CK.BATCH_ELEMENTS} must have as many elements as '{config[CK.ELEMENTS]}'.")
+    return systems
+
+
+def _num_candidates_per_prototype(elements, lattice_scales=LATTICE_SCALES):
+    """Size of the permutation x scale grid, i.e. the id range reserved per prototype."""
+    n_scales = 1 if lattice_scales == ADAPTIVE_SCALES else len(lattice_scales)
+    return math.factorial(len(elements)) * n_scales
+
+
+def chunk_prototypes(config, n_chunks, chunk_id):
+    """
+    Prototype files assigned to a chunk.
+
+    The prototypes are distributed among the chunks so that their estimated
+    costs are balanced (see :mod:`tools.partition`): the number of sites times
+    the number of generated variants, or the timings of a previous run when
+    ``gen_timings`` is set.
+
+    :returns: list of ``(structure_file, start_index)`` pairs, where
+        ``start_index`` is the index of the first candidate generated from
+        the prototype (candidate ids are ``"<chunk_id>_<index>"``).
+    :rtype: list
+
+    :raises SystemExit: if ``chunk_id`` is out of range
+    :raises ValueError: if ``gen_timings`` is within the structures
+        directory this run writes to
+    """
+    if chunk_id < 1 or chunk_id > n_chunks:
+        raise SystemExit("chunk_id must be between 1 and n_chunks.")
+
+    dirs = os.path.abspath(config[CK.INITIAL_STRS])
+    # sorted, so that every chunk computes the same partition
+    structure_files = sorted(f for f in os.listdir(dirs) if f.endswith('.cif'))
+    elements = [ele for ele in str(config[CK.ELEMENTS]).split('-')]
+    numall = _num_candidates_per_prototype(elements, _generation_options(config)[0]["lattice_scales"])
+
+    # Divide work into cost-balanced chunks
+    costs = estimate_costs(dirs, structure_files, numall, _previous_timings(config))
+    sel_files = balanced_partition(costs, n_chunks)[chunk_id - 1]
+
+    return [(structure_files[i], i * numall + 1) for i in sel_files]
+
+
+def _previous_timings(config):
+    """
+    Read the ``gen_timings`` of the config.
+
+    The timings must come from a previous run: the chunks of this run write
+    their ``timings.csv`` as they go, so they would each read different
+    timings and compute overlapping partitions.
+
+    :raises ValueError: if ``gen_timings`` is within a structures directory
+        of this run (of ``work_dir`` or of a ``batch_elements`` system)
+    """
+    path = get_optional(config, CK.GEN_TIMINGS)
+    if not path:
+        return {}
+    path = os.path.realpath(path)
+    for _, work_dir in _element_systems(config):
+        dir_structures = os.path.realpath(os.path.join(work_dir, "structures"))
+        if os.path.commonpath([path, dir_structures]) == dir_structures:
+            raise ValueError(f"{CK.GEN_TIMINGS} must point to the timings of a previous run, "
+                             f"not to {dir_structures}, written by this run.")
+    return read_timings(path)
+
+
+def generate_candidates(job, dirs, elements, chunk_id, **options):
+    """
+    Generate the candidates of one prototype in memory.
+
+    :param tuple job: ``(structure_file, start_index)``, as returned by :func:`chunk_prototypes`
+    :param options: generation options of :func:`_generate_arrays`
+    :returns: a generator of ``(cif_id, structure)`` pairs
+    """
+    structure_file, start_index = job
+    structures, _ = _generate_structures(structure_file, elements, dirs, **options)
+    for offset, structure in structures:
+        yield f"{chunk_id}_{start_index + offset}", structure
+
+
+def materialize_candidates(config, n_chunks, chunk_id, ids):
+    """
+    Regenerate a subset of the candidates of a chunk and write them, with their
+    ``id_prop.csv``, to ``work_dir/structures/<chunk_id>``.
+
+    Candidate ids encode the prototype and the position in the permutation x
+    scale grid, so any candidate can be rebuilt without having been stored.
+
+    :param iterable ids: candidate ids (``"<chunk_id>_<index>"``) to write
+    :returns: Absolute path to this chunk’s ``id_prop.csv``.
+    :rtype: str
+    """
+    options, structure_format = _generation_options(config)
+    dir_structures = os.path.join(config[CK.WORK_DIR], "structures", str(chunk_id))
+    os.makedirs(dir_structures, exist_ok=True)
+    dirs = os.path.abspath(config[CK.INITIAL_STRS])
+    elements = [ele for ele in str(config[CK.ELEMENTS]).split('-')]
+    numall = _num_candidates_per_prototype(elements, options["lattice_scales"])
+
+    warnings.filterwarnings("ignore")
+
+    # group the requested candidates by prototype
+    offsets = defaultdict(set)
+    for cif_id in ids:
+        idx = int(str(cif_id).split("_")[1])
+        offsets[(idx - 1) // numall].add((idx - 1) % numall)
+
+    out_csv = os.path.join(dir_structures, "id_prop.csv")
+    writer = StructureStoreWriter(dir_structures) if structure_format == "npz" else None
+    with open(out_csv, 'w', newline='') as f:
+        for structure_file, start_index in chunk_prototypes(config, n_chunks, chunk_id):
+            wanted = offsets.get((start_index - 1) // numall)
+            if not wanted:
+                continue
+            structures, _ = _generate_structures(structure_file, elements, dirs, **options)
+            for offset, structure in structures:
+                if offset not in wanted:
+                    continue
+                cif_id = f"{chunk_id}_{start_index + offset}"
+                if writer is not None:
+                    writer.add_structure(cif_id, structure)
+                else:
+                    structure.to(filename=os.path.join(dir_structures, f"{cif_id}.cif"))
+                f.write(f"{cif_id},0.5\n")
+    if writer is not None:
+        writer.close()
+    return out_csv
+
+
+def _progress_counts(row):
+    """
+    ``(start_index, n_generated, n_skipped, n_rejected)`` of a
+    ``PROGRESS_FILE`` row, or None if the row is incomplete.
+    """
+    if len(row) != 5 or not all(c.isdigit() for c in row[1:]):
+        return None
+    return tuple(int(c) for c in row[1:])
+
+
+class _ChunkOutput:
+    """
+    Incremental outputs of a chunk for one element system.
+
+    The rows of ``id_prop.csv`` and ``timings.csv`` are appended as the
+    prototypes complete, and every completed prototype is recorded in
+    ``PROGRESS_FILE`` once its structures are on disk: right away with the
+    ``cif`` format, and when the store shard holding its last structure is
+    written with the ``npz`` format. On restart, the recorded prototypes are
+    skipped and the rows of the others are dropped (as is a progress row
+    left incomplete by a kill, whose prototype is then generated again).
+    The generation options are recorded in ``OPTIONS_FILE``: if they changed
+    since the previous run, the chunk starts afresh.
+
+    ``manifest.csv`` gives, for every structure, the index of its prototype,
+    of its element permutation and of its lattice scale: the structures of a
+    prototype share its geometry up to an isotropic scaling, which the CGCNN
+    featurization takes advantage of (see ``ml_models/cgcnn/data.py``).
+    """
+
+    def __init__(self, dir_structures, chunk_id, record):
+        self.dir = dir_structures
+        self.chunk_id = chunk_id
+        self.numall = record["numall"]
+        self.n_scales = record["n_scales"]
+        self.done = {}
+        progress = os.path.join(dir_structures, PROGRESS_FILE)
+        options_file = os.path.join(dir_structures, OPTIONS_FILE)
+        recorded = None
+        if os.path.exists(options_file):
+            with open(options_file) as f:
+                recorded = json.load(f)
+        if recorded == record and os.path.exists(progress):
+            with open(progress) as f:
+                for row in csv.reader(f):
+                    counts = _progress_counts(row)
+                    if counts is not None:
+                        self.done[row[0]] = counts
+
+        # keep the rows of the completed prototypes only
+        numall = self.numall
+        done_prototypes = {(start_index - 1) // numall for start_index, *_ in self.done.values()}
+        self._rewrite("id_prop.csv", lambda row: (int(row[0].split("_")[1]) - 1) // numall in done_prototypes)
+        self._rewrite("manifest.csv", lambda row: row[0] == "id" or int(row[1]) in done_prototypes)
+        self._rewrite(TIMINGS_FILE, lambda row: row[0] in self.done)
+        self._rewrite(PROGRESS_FILE, lambda row: row[0] in self.done)
+        if not self.done:
+            # fresh start: drop the store of a previous run
+            for f in os.listdir(dir_structures):
+                if f == STORE_INDEX_FILE or f.startswith(SHARD_PREFIX):
+                    os.remove(os.path.join(dir_structures, f))
+        # the chunk is complete again once closed
+        if os.path.exists(os.path.join(dir_structures, "gen_stats.json")):
+            os.remove(os.path.join(dir_structures, "gen_stats.json"))
+        with open(options_file, 'w') as f:
+            json.dump(record, f)
+
+        self.writer = StructureStoreWriter(dir_structures) if record["structure_format"] == "npz" else None
+        self._id_prop = open(os.path.join(dir_structures, "id_prop.csv"), 'a', newline='')
+        manifest = os.path.join(dir_structures, "manifest.csv")
+        write_header = not os.path.exists(manifest)
+        self._manifest = open(manifest, 'a', newline='')
+        if write_header:
+            self._manifest.write("id,prototype,permutation,scale\n")
+        self._timings = open(os.path.join(dir_structures, TIMINGS_FILE), 'a', newline='')
+        self._progress = open(progress, 'a', newline='')
+        self._pending = []
+
+    def _rewrite(self, name, keep):
+        path = os.path.join(self.dir, name)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            rows = [row for row in csv.reader(f) if row and keep(row)]
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+    def add(self, structure_file, start_index, ids, n_skipped, n_rejected, arrays, seconds):
+        """Record the structures generated from one prototype."""
+        flushed = False
+        if self.writer is not None:
+            for idx, (lattice, frac_coords, numbers) in zip(ids, arrays):
+                flushed |= self.writer.add(f"{self.chunk_id}_{idx}", lattice, frac_coords, numbers)
+        if flushed:
+            # the earlier prototypes are on disk, this one may be only partially
+            self._commit()
+        self._pending.append((structure_file, start_index, ids, n_skipped, n_rejected, seconds))
+        if self.writer is None:
+            self._commit()
+
+    def _commit(self):
+        for structure_file, start_index, ids, n_skipped, n_rejected, seconds in self._pending:
+            self._id_prop.writelines(f"{self.chunk_id}_{idx},0.5\n" for idx in ids)
+            prototype = (start_index - 1) // self.numall
+            self._manifest.writelines(
+                f"{self.chunk_id}_{idx},{prototype},{(idx - start_index) // self.n_scales},{(idx - start_index) % self.n_scales}\n"
+                for idx in ids)
+            self._timings.write(f"{structure_file},{seconds:.6f}\n")
+            self._progress.write(f"{structure_file},{start_index},{len(ids)},{n_skipped},{n_rejected}\n")
+            self.done[structure_file] = (start_index, len(ids), n_skipped, n_rejected)
+        for f in (self._id_prop, self._manifest, self._timings, self._progress):
+            f.flush()
+        self._pending = []
+
+    def close(self):
+        """Commit the remaining prototypes and write ``gen_stats.json``."""
+        if self.writer is not None:
+            self.writer.close()
+        self._commit()
+        for f in (self._id_prop, self._manifest, self._timings, self._progress):
+            f.close()
+        with open(os.path.join(self.dir, "gen_stats.json"), 'w') as f:
+            counts = np.array([c[1:] for c in self.done.values()], dtype=int).reshape(-1, 3).sum(axis=0)
+            json.dump({"generated": int(counts[0]),
+                       "skipped_equivalent_permutations": int(counts[1]),
+                       "rejected_min_distance": int(counts[2])}, f)
 
 
 def run_gen_structures(config, n_chunks, chunk_id):
@@ -65,6 +666,22 @@ def run_gen_structures(config, n_chunks, chunk_id):
         - ``num_workers`` (int): number of parallel workers for the inner loop
         - ``elements`` (str): target system (e.g., "Ce-Co-B")
         - ``initial_structures_dir`` (str): directory containing initial structures
+        - ``gen_permutations`` (str): ``"all"`` or ``"unique"`` (drop the
+          element permutations that are symmetry-equivalent on the prototype)
+        - ``structure_format`` (str): ``"cif"`` (one CIF file per structure) or
+          ``"npz"`` (a :mod:`tools.structure_store` in the chunk directory)
+        - ``gen_timings`` (str): timings of a previous run used to balance the chunks
+        - ``prototype_cache_dir`` (str): directory of the persistent prototype
+          cache (:mod:`tools.prototype_cache`); empty disables the cache
+        - ``lattice_scales`` (str): comma-separated scales of the lattice
+          vectors, or ``"adaptive"`` (one scale per permutation, estimated
+          from the atomic volumes of the substituted elements)
+        - ``min_distance_factor`` (float): if positive, reject the candidates
+          with two atoms closer than this fraction of the sum of their
+          covalent radii
+        - ``batch_elements`` (str): comma-separated element systems generated
+          in the same pass as ``elements``; the structures of each system are
+          written to ``<work_dir>/../<system>/structures/<chunk_id>``
 
         See :class:`~tools.config_manager.ConfigManager` for complete field
         descriptions and defaults.
@@ -75,59 +692,81 @@ def run_gen_structures(config, n_chunks, chunk_id):
     :param int chunk_id:
         Zero-based index of the partition to execute, where ``0 <= chunk_id < n_chunks``.
 
-    :returns: Absolute path to this chunk’s ``id_prop.csv``.
+    The number of generated structures, of skipped equivalent permutations
+    and of candidates rejected by the distance check is recorded in this chunk's ``gen_stats.json``, and the processing time of
+    each prototype in its ``timings.csv`` (see ``gen_timings``).
+
+    The outputs are written as the prototypes complete, and the completed
+    prototypes are recorded in ``gen_progress.csv``: a chunk interrupted
+    before its ``gen_stats.json`` is written resumes where it stopped, unless
+    the generation options recorded in its ``gen_options.json`` changed, in
+    which case it starts afresh.
+
+    :returns: Absolute path to this chunk’s ``id_prop.csv`` (of the ``elements`` system).
     :rtype: str
 
-    :raises ValueError: if ``n_chunks`` is not positive or ``chunk_id`` is out of range
+    :raises ValueError: if ``n_chunks`` is not positive or ``chunk_id`` is out of range,
+        or if the ``batch_elements`` systems do not match the size of ``elements``
     :raises Exception: on directory navigation or file I/O failures
     """
-    dir_structures = os.path.join(config[CK.WORK_DIR], "structures", str(chunk_id))
-    input_dir = config[CK.INITIAL_STRS]
     num_workers = int(config[CK.NUM_WORKERS])
+    options, structure_format = _generation_options(config)
+    systems = [(elements, os.path.join(work_dir, "structures", str(chunk_id)))
+               for elements, work_dir in _element_systems(config)]
 
-    if not os.path.exists(dir_structures):
-        os.makedirs(dir_structures)
-    os.chdir(dir_structures)
-
-    if chunk_id < 1 or chunk_id > n_chunks:
-        raise SystemExit("chunk_id must be between 1 and n_chunks.")
+    for _, dir_structures in systems:
+        os.makedirs(dir_structures, exist_ok=True)
+    os.chdir(systems[0][1])
 
     warnings.filterwarnings("ignore")
 
-    dirs = os.path.abspath(input_dir)
-    structure_files = [f for f in os.listdir(dirs) if f.endswith('.cif')]
-    elements = [ele for ele in str(config[CK.ELEMENTS]).split('-')]
+    dirs = os.path.abspath(config[CK.INITIAL_STRS])
+    outputs = [_ChunkOutput(dir_structures, chunk_id, _options_record(config, n_chunks, elements))
+               for elements, dir_structures in systems]
 
-    # Divide work into chunks
-    chunk_size = math.ceil(len(structure_files) / n_chunks) if n_chunks > 0 else 0
-    start_file = (chunk_id - 1) * chunk_size
-    end_file = min(start_file + chunk_size, len(structure_files))
-    sel_files = structure_files[start_file:end_file]
+    # skip the prototypes completed by a previous run, for every system
+    args_list = [(f, start_index, dirs, systems, chunk_id, options, structure_format)
+                 for f, start_index in chunk_prototypes(config, n_chunks, chunk_id)
+                 if not all(f in output.done for output in outputs)]
 
-    element_permutations = list(permutations(elements))
-    numall = len(element_permutations) * len(LATTICE_SCALES)
-
-    args_list = []
-    for i, f in enumerate(structure_files):
-        if f not in sel_files:
-            continue
-        args_list.append((f, i * numall + 1, dirs, elements, chunk_id))
-
-    results = []
     if args_list:
+        # small dispatch chunks, so that the outputs are written as the prototypes complete
+        chunksize = max(1, len(args_list) // (4 * num_workers))
         with Pool(num_workers) as pool:
-            results = pool.map(_process_structure, args_list)
+            for (f, start_index), per_system, seconds in pool.imap_unordered(
+                    _process_structure, args_list, chunksize=chunksize):
+                for output, result in zip(outputs, per_system):
+                    if f not in output.done:
+                        output.add(f, start_index, *result, seconds)
 
-    generated_ids = []
-    for (f, start_idx, _, _, _), n in zip(args_list, results):
-        generated_ids.extend(range(start_idx, start_idx + n))
+    for output in outputs:
+        output.close()
 
-    out_csv = "id_prop.csv"
-    with open(out_csv, 'w', newline='') as f:
-        for idx in generated_ids:
-            f.write(f"{chunk_id}_{idx},0.5\n")
+    return os.path.abspath(os.path.join(systems[0][1], "id_prop.csv"))
 
-    return os.path.abspath(out_csv)
+
+def generation_done(config, n_chunks):
+    """
+    True if every chunk of every system of :func:`run_gen_structures` has
+    completed with the options of ``config``, i.e. has written its
+    ``gen_stats.json`` and recorded these options (or, for a work directory
+    of an earlier version, has an ``id_prop.csv`` without a ``PROGRESS_FILE``).
+    Interrupted chunks resume where they stopped.
+    """
+    for elements, work_dir in _element_systems(config):
+        record = _options_record(config, n_chunks, elements)
+        for chunk_id in range(1, n_chunks + 1):
+            chunk_dir = os.path.join(work_dir, "structures", str(chunk_id))
+            options_file = os.path.join(chunk_dir, OPTIONS_FILE)
+            if os.path.exists(os.path.join(chunk_dir, "gen_stats.json")) and os.path.exists(options_file):
+                with open(options_file) as f:
+                    if json.load(f) == record:
+                        continue
+                return False
+            if not (os.path.exists(os.path.join(chunk_dir, "id_prop.csv"))
+                    and not os.path.exists(os.path.join(chunk_dir, PROGRESS_FILE))):
+                return False
+    return True
 
 
 @python_app(executors=[GENERATE_EXECUTOR_LABEL])
@@ -2,13 +2,19 @@ import os
 import csv
 import argparse
 from collections import defaultdict
-from pymatgen.core import Structure, Element
+from pymatgen.core import Element
 from pymatgen.analysis.structure_matcher import StructureMatcher
 import multiprocessing as mp
 import math
 from parsl import python_app
 from parsl_configs.parsl_executors_labels import SELECT_EXECUTOR_LABEL
 from tools.config_labels import ConfigKeys as CK
+from tools.structure_store import load_structure
+
+
+# bounds on the number of candidates kept after the Ef threshold
+MIN_STRUCTURES = 20000
+MAX_STRUCTURES = 300000
 
 
 def read_csv(csv_file, ef_threshold):
@@ -24,8 +30,8 @@ def read_csv(csv_file, ef_threshold):
     all_structures.sort(key=lambda x: x[1])
 
     # Initialize parameters
-    min_structures = 20000
-    max_structures = 300000
+    min_structures = MIN_STRUCTURES
+    max_structures = MAX_STRUCTURES
     structures_data = {}
 
     # First try with original ef_threshold
@@ -55,14 +61,15 @@ def read_csv(csv_file, ef_threshold):
 
 def process_structures(task_queue, result_queue, nomix_dir,
                        natom_threshold, element_fractions):
+    stores = {}
     while True:
         task = task_queue.get()
         if task is None:
             break
         index, ef = task
         prefix_chunk_dir = index.split("_")[0]
-        structure = Structure.from_file(
-            os.path.join(nomix_dir, prefix_chunk_dir, f"{index}.cif"))
+        structure = load_structure(
+            os.path.join(nomix_dir, prefix_chunk_dir), index, stores)
         composition = structure.composition
         reduced_formula = composition.reduced_formula
         flag = 0
@@ -235,7 +242,8 @@ def run_select_structures(nomix_dir="nomix/",
 
     :param str nomix_dir:
         Root directory containing input CIFs laid out as
-        ``{chunk_prefix}/{index}.cif``.
+        ``{chunk_prefix}/{index}.cif``, or one structure store
+        (:mod:`tools.structure_store`) per ``{chunk_prefix}`` directory.
 
     :param str output_dir:
         Directory to write outputs (created if missing). Writes
@@ -0,0 +1,207 @@
+import sys
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(scope="module")
+def cif_dir(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("cgcnn_features")
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp)
+    return tmp / "test_structures" / "1"
+
+
+@pytest.fixture(scope="module")
+def gen_structures_dir(tmp_path_factory):
+    """Candidates generated from the bundled prototype, with their manifest."""
+    import os
+    import shutil
+    import ml_models.cgcnn as cgcnn_pkg
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures
+
+    tmp = tmp_path_factory.mktemp("cgcnn_features_gen")
+    with tarfile.open(Path(__file__).parent / "initial_structures_in.tar") as tar:
+        try:
+            tar.extractall(path=tmp, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp)
+    input_dir = next(p.parent for p in tmp.rglob("*.cif"))
+    config = {
+        CK.WORK_DIR: str(tmp / "work"),
+        CK.INITIAL_STRS: str(input_dir),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Na-B-C",
+    }
+    cwd = os.getcwd()
+    try:
+        out_dir = Path(run_gen_structures(config, n_chunks=1, chunk_id=1)).parent
+    finally:
+        os.chdir(cwd)
+    shutil.copy(Path(cgcnn_pkg.__file__).parent / "atom_init.json", out_dir)
+    return out_dir
+
+
+def test_raw_distances_expanded_on_device(cif_dir):
+    """
+    Expanding the batched raw distances gives the features of the CPU path.
+    """
+    import torch
+    from ml_models.cgcnn.data import CIFData, collate_pool
+
+    expanded = CIFData(str(cif_dir))
+    raw = CIFData(str(cif_dir), raw_distances=True)
+    (_, nbr_fea, nbr_idx, _), _, ids = collate_pool([expanded[i] for i in range(len(expanded))])
+    (_, dist, raw_idx, _), _, raw_ids = collate_pool([raw[i] for i in range(len(raw))])
+
+    assert ids == raw_ids and torch.equal(nbr_idx, raw_idx)
+    assert dist.shape == nbr_fea.shape[:2]
+    assert torch.allclose(raw.gdf.expand_tensor(dist), nbr_fea, atol=1e-5)
+
+
+def _legacy_graph(crystal, radius, max_num_nbr):
+    """
+    Neighbor lists built from get_all_neighbors, as CGCNN originally did,
+    but keeping the lowest indices of a shell of equidistant neighbors across
+    the cutoff (CGCNN kept the first ones of the search).
+    """
+    all_nbrs = crystal.get_all_neighbors(radius, include_index=True)
+    all_nbrs = [sorted(nbrs, key=lambda x: x[1]) for nbrs in all_nbrs]
+    nbr_fea_idx, nbr_dist = [], []
+    for nbr in all_nbrs:
+        if len(nbr) > max_num_nbr:
+            cutoff = nbr[max_num_nbr - 1][1]
+            inner = [x for x in nbr if x[1] < cutoff * (1 - 1e-6)]
+            shell = sorted((x for x in nbr if abs(x[1] - cutoff) <= cutoff * 1e-6), key=lambda x: x[2])
+            nbr = inner + shell[:max_num_nbr - len(inner)]
+        nbr_fea_idx.append([x[2] for x in nbr] + [0] * (max_num_nbr - len(nbr)))
+        nbr_dist.append([x[1] for x in nbr] + [radius + 1.] * (max_num_nbr - len(nbr)))
+    return np.array(nbr_fea_idx), np.array(nbr_dist)
+
+
+@pytest.mark.parametrize("radius, max_num_nbr", [(8, 12), (3, 12)])
+def test_vectorized_graph_matches_legacy(cif_dir, radius, max_num_nbr):
+    import warnings
+    from pymatgen.core import Structure
+    from ml_models.cgcnn.data import CrystalGraphFeaturizer
+
+    featurizer = CrystalGraphFeaturizer(str(cif_dir / "atom_init.json"), max_num_nbr=max_num_nbr, radius=radius)
+    for cif in sorted(cif_dir.glob("*.cif")):
+        crystal = Structure.from_file(str(cif))
+        ref_idx, ref_dist = _legacy_graph(crystal, radius, max_num_nbr)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            numbers, nbr_fea_idx, nbr_dist = featurizer.graph(crystal, cif.stem)
+        assert np.array_equal(numbers, crystal.atomic_numbers)
+        # equidistant neighbors may come in another order
+        assert np.array_equal(np.sort(nbr_fea_idx, axis=1), np.sort(ref_idx, axis=1)), cif.stem
+        assert np.allclose(nbr_dist, ref_dist), cif.stem
+
+
+def _neighbor_shells(numbers, nbr_fea_idx, nbr_dist):
+    """Per site, the sorted (species, distance) pairs of its kept neighbors."""
+    return [sorted(zip(numbers[idx].tolist(), np.round(dist, 6).tolist())) for idx, dist in zip(nbr_fea_idx, nbr_dist)]
+
+
+def test_scale_family_graphs(gen_structures_dir, monkeypatch):
+    """
+    Graphs derived from a family reference match the graphs of a direct
+    neighbor search, whatever variant of the family comes first, and with
+    the sites listed in another order. Every site of this prototype has
+    equidistant neighbors across the 12th one.
+    """
+    import warnings
+    from pymatgen.core import Structure
+    from ml_models.cgcnn.data import CIFData, CrystalGraphFeaturizer
+
+    dataset = CIFData(str(gen_structures_dir))
+    assert len(dataset.families) == len(dataset)
+    direct = CrystalGraphFeaturizer(str(gen_structures_dir / "atom_init.json"))
+    family = CrystalGraphFeaturizer(str(gen_structures_dir / "atom_init.json"))
+    searches = []
+    neighbors = family._neighbors
+    monkeypatch.setattr(family, "_neighbors", lambda crystal, radius: searches.append(radius) or neighbors(crystal, radius))
+    # middle scale first, then the smaller and larger ones
+    ids = sorted(dataset.families, key=lambda i: (dataset.families[i], abs(int(i.split("_")[1]) % 5 - 3)))
+    n_families = len(set(dataset.families.values()))
+    for cif_id in ids:
+        crystal = Structure.from_file(str(gen_structures_dir / f"{cif_id}.cif"))
+        # the sites in reverse order, as after a round trip through another format
+        permuted = Structure(crystal.lattice, crystal.species[::-1], crystal.frac_coords[::-1])
+        for variant in (crystal, permuted):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                numbers, ref_idx, ref_dist = direct.graph(variant, cif_id)
+                _, nbr_fea_idx, nbr_dist = family.graph(variant, cif_id, dataset.families[cif_id])
+            assert np.allclose(nbr_dist, ref_dist), cif_id
+            # equidistant neighbors may come in another order
+            assert np.array_equal(np.sort(nbr_fea_idx, axis=1), np.sort(ref_idx, axis=1)), cif_id
+            assert _neighbor_shells(numbers, nbr_fea_idx, nbr_dist) == _neighbor_shells(numbers, ref_idx, ref_dist), cif_id
+    # one neighbor search per family
+    assert len(searches) == n_families
+
+
+@pytest.mark.parametrize("first", [0, -1])
+def test_family_graphs_with_cutoff_shells(cif_dir, first):
+    """
+    In a perovskite, the O sites have 14 equidistant neighbors across the
+    12th one: scaled, species-swapped and site-permuted members of the family
+    keep the neighbors of a direct search, whichever member comes first.
+    """
+    import warnings
+    from pymatgen.core import Lattice, Structure
+    from ml_models.cgcnn.data import CrystalGraphFeaturizer
+
+    prototype = Structure.from_spacegroup("Pm-3m", Lattice.cubic(4.0), ["Ba", "Ti", "O"],
+                                          [[0, 0, 0], [.5, .5, .5], [.5, .5, 0]])
+    members = []
+    for scale in (0.95, 1.0, 1.05):
+        for species in (["Ba", "Ti", "O"], ["Ce", "Ti", "O"], ["Ti", "Ba", "O"]):
+            crystal = prototype.copy()
+            crystal.replace_species(dict(zip(["Ba", "Ti", "O"], species)))
+            crystal.scale_lattice(prototype.volume * scale ** 3)
+            members.append(crystal)
+            # the same structure with its sites listed in another order
+            members.append(Structure(crystal.lattice, crystal.species[::-1], crystal.frac_coords[::-1]))
+    if first:
+        members = members[::-1]
+    direct = CrystalGraphFeaturizer(str(cif_dir / "atom_init.json"))
+    family = CrystalGraphFeaturizer(str(cif_dir / "atom_init.json"))
+    for k, crystal in enumerate(members):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            numbers, ref_idx, ref_dist = direct.graph(crystal)
+            _, nbr_fea_idx, nbr_dist = family.graph(crystal, family="perovskite")
+        assert _neighbor_shells(numbers, nbr_fea_idx, nbr_dist) == _neighbor_shells(numbers, ref_idx, ref_dist), k
+
+
+def test_atom_budget_batches(cif_dir):
+    """
+    Batches are bounded by their number of crystals and of atoms, and cover
+    every crystal once, in storage order within windows.
+    """
+    import warnings
+    from pymatgen.core import Structure
+    from ml_models.cgcnn.data import CIFData, InferenceBatchSampler
+
+    dataset = CIFData(str(cif_dir), shuffle=False)
+    sizes = dataset.sizes()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        assert sizes == [len(Structure.from_file(str(cif_dir / f"{cif_id}.cif"))) for cif_id, _ in dataset.id_prop_data]
+    max_atoms = 2 * max(sizes)
+    batches = list(InferenceBatchSampler(sizes, batch_size=4, window=2, max_atoms=max_atoms))
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(sizes)))
+    assert all(len(batch) <= 4 and sum(sizes[idx] for idx in batch) <= max_atoms for batch in batches)
+    # a crystal larger than the budget is a batch on its own
+    assert list(InferenceBatchSampler(sizes, batch_size=4, max_atoms=1)) == [[idx] for idx in InferenceBatchSampler(sizes, 4).order()]
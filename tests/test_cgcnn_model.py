@@ -0,0 +1,134 @@
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture
+def model():
+    from ml_models.cgcnn.model import CrystalGraphConvNet
+    torch.manual_seed(0)
+    return CrystalGraphConvNet(8, 5, atom_fea_len=16, n_conv=2, h_fea_len=32, n_h=2).eval()
+
+
+def test_segment_pooling(model):
+    """
+    Pooling from the atom counts of the crystals gives the per-crystal means,
+    and the legacy lists of atom indices are still accepted.
+    """
+    counts = [3, 1, 5, 2]
+    atom_fea = torch.randn(sum(counts), 16)
+    idx_maps = list(torch.arange(sum(counts)).split(counts))
+    expected = torch.stack([atom_fea[idx_map].mean(dim=0) for idx_map in idx_maps])
+
+    assert torch.allclose(model.pooling(atom_fea, torch.LongTensor(counts)), expected, atol=1e-6)
+    assert torch.allclose(model.pooling(atom_fea, idx_maps), expected, atol=1e-6)
+    # the atoms of a crystal need not be consecutive in the legacy form
+    shuffled = torch.randperm(sum(counts))
+    inverse = torch.argsort(shuffled)
+    assert torch.allclose(model.pooling(atom_fea[shuffled], [inverse[idx_map] for idx_map in idx_maps]), expected, atol=1e-6)
+
+
+def test_fold_batch_norm(model):
+    """Folding the batch normalizations does not change the predictions."""
+    for conv in model.convs:
+        conv.bn1.running_mean.uniform_(-1, 1)
+        conv.bn1.running_var.uniform_(0.5, 2)
+        conv.bn1.weight.data.uniform_(0.5, 2)
+        conv.bn1.bias.data.uniform_(-1, 1)
+    counts = torch.LongTensor([3, 1, 5])
+    inputs = (torch.randn(9, 8), torch.randn(9, 4, 5), torch.randint(0, 9, (9, 4)), counts)
+    with torch.no_grad():
+        expected = model(*inputs)
+        folded = model.fold_batch_norm()(*inputs)
+    assert all(isinstance(conv.bn1, torch.nn.Identity) for conv in model.convs)
+    assert torch.allclose(folded, expected, atol=1e-5)
+
+
+def test_checkpoint_loaded_once(tmp_path, monkeypatch):
+    """
+    A process reads a checkpoint once and reuses its engine; the weights-only
+    artifact of the checkpoint gives the same predictions.
+    """
+    import shutil
+    import tarfile
+    import ml_models.cgcnn as cgcnn_pkg
+    import ml_models.cgcnn.predict as predict
+
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp_path, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp_path)
+    cif_dir = tmp_path / "test_structures" / "1"
+    pkg_dir = Path(cgcnn_pkg.__file__).parent
+    shutil.copy(pkg_dir / "atom_init.json", cif_dir)
+    # a copy, not loaded by the other tests of the process
+    model_path = tmp_path / "model.pth.tar"
+    shutil.copy(pkg_dir / "form_1st.pth.tar", model_path)
+
+    loads = []
+    torch_load = torch.load
+    monkeypatch.setattr(predict.torch, "load", lambda *args, **kwargs: loads.append(kwargs) or torch_load(*args, **kwargs))
+
+    def run(out_csv, **kwargs):
+        out_csv = predict.predict_cgcnn(modelpath=str(model_path), cifpath=str(cif_dir), batch_size=4, disable_cuda=True,
+                                        output_csv=str(tmp_path / out_csv), predict_only=True, **kwargs)
+        return Path(out_csv).read_text()
+
+    model_cache = tmp_path / "model_cache"
+    first = run("first.csv", model_cache=str(model_cache))
+    assert run("second.csv") == first
+    assert len(loads) == 1 and len(list(model_cache.glob("*.pt"))) == 1
+
+    # a new process: the artifact is memory-mapped
+    monkeypatch.setattr(predict, "_checkpoints", predict.OrderedDict())
+    monkeypatch.setattr(predict, "_engines", predict.OrderedDict())
+    assert run("artifact.csv", model_cache=str(model_cache)) == first
+    assert len(loads) == 2 and loads[1].get("weights_only") and loads[1].get("mmap")
+
+    # only the entries needed for inference, of the last MAX_ENGINES checkpoints
+    for k in range(predict.MAX_ENGINES + 1):
+        shutil.copy(model_path, tmp_path / f"model_{k}.pth.tar")
+        predict._load_checkpoint(str(tmp_path / f"model_{k}.pth.tar"))
+    assert len(predict._checkpoints) == predict.MAX_ENGINES
+    assert all(set(checkpoint) <= set(predict.ARTIFACT_KEYS) for checkpoint in predict._checkpoints.values())
+
+
+def test_ensemble_loaded_once(tmp_path, monkeypatch):
+    """
+    Repeated predictions of a 3-model ensemble read and build each model
+    once: the caches of the process hold the whole ensemble.
+    """
+    import shutil
+    import tarfile
+    import ml_models.cgcnn as cgcnn_pkg
+    import ml_models.cgcnn.predict as predict
+
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp_path, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp_path)
+    cif_dir = tmp_path / "test_structures" / "1"
+    pkg_dir = Path(cgcnn_pkg.__file__).parent
+    shutil.copy(pkg_dir / "atom_init.json", cif_dir)
+    # copies, not loaded by the other tests of the process
+    models = [tmp_path / f"model_{k}.pth.tar" for k in range(3)]
+    for model in models:
+        shutil.copy(pkg_dir / "form_1st.pth.tar", model)
+
+    loads, builds = [], []
+    torch_load, inference_model = torch.load, predict._inference_model
+    monkeypatch.setattr(predict.torch, "load", lambda *args, **kwargs: loads.append(args[0]) or torch_load(*args, **kwargs))
+    monkeypatch.setattr(predict, "_inference_model", lambda model, args: builds.append(model) or inference_model(model, args))
+    for run in range(2):
+        predict.predict_cgcnn(modelpath=str(models[0]), cifpath=str(cif_dir), batch_size=4, disable_cuda=True,
+                              output_csv=str(tmp_path / f"ensemble_{run}.csv"), ensemble=[str(m) for m in models[1:]])
+    assert sorted(map(str, loads)) == sorted(map(str, models))
+    assert len(builds) == len(models)
@@ -0,0 +1,111 @@
+import sys
+import tarfile
+import threading
+import warnings
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(scope="module")
+def cif_dir(tmp_path_factory):
+    import shutil
+    import ml_models.cgcnn as cgcnn_pkg
+
+    tmp = tmp_path_factory.mktemp("cgcnn_server")
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp)
+    cif_dir = tmp / "test_structures" / "1"
+    shutil.copy(Path(cgcnn_pkg.__file__).parent / "atom_init.json", cif_dir)
+    return cif_dir
+
+
+def _read_rows(csv_path):
+    return [(cid, float(pred)) for cid, _target, pred in (ln.split(",") for ln in Path(csv_path).read_text().split())]
+
+
+def test_prediction_server(cif_dir, tmp_path):
+    """
+    A server predicts directories and in-memory structures as predict_cgcnn
+    does, over several requests and connections.
+    """
+    import ml_models.cgcnn as cgcnn_pkg
+    from pymatgen.core import Structure
+    from ml_models.cgcnn.client import PredictionClient
+    from ml_models.cgcnn.predict import predict_cgcnn
+    from ml_models.cgcnn.server import PredictionServer
+
+    model_path = str(Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar")
+    expected = _read_rows(predict_cgcnn(modelpath=model_path, cifpath=str(cif_dir), batch_size=4, disable_cuda=True,
+                                        output_csv=str(tmp_path / "expected.csv"), predict_only=True))
+
+    server = PredictionServer(model_path, disable_cuda=True, batch_size=4)
+    address = str(tmp_path / "cgcnn.sock")
+    serve = threading.Thread(target=server.serve, args=(address,))
+    serve.start()
+    # listening once the socket exists
+    for _ in range(100):
+        if Path(address).exists():
+            break
+        serve.join(0.1)
+
+    with PredictionClient(address) as client:
+        for run in range(2):
+            out_csv = client.predict_dir(cif_dir, tmp_path / f"served_{run}.csv")
+            rows = _read_rows(out_csv)
+            assert [cid for cid, _ in rows] == [cid for cid, _ in expected]
+            assert all(abs(pred - ref) <= 1e-6 for (_, pred), (_, ref) in zip(rows, expected))
+        with pytest.raises(RuntimeError, match="Unknown options"):
+            client.predict_dir(cif_dir, tmp_path / "bad.csv", precision="bf16")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        structures = [(cid, Structure.from_file(str(cif_dir / f"{cid}.cif"))) for cid, _ in expected]
+    with PredictionClient(address) as client:
+        predictions = client.predict_structures(structures[::-1])
+        assert client.ping()["requests"] == 5
+        client.shutdown()
+    serve.join(10)
+    assert not serve.is_alive()
+    assert [cid for cid, _ in predictions] == [cid for cid, _ in expected[::-1]]
+    assert all(abs(pred - ref) <= 1e-5 for (_, pred), (_, ref) in zip(predictions, expected[::-1]))
+
+
+def test_ensemble_served_once(cif_dir, tmp_path, monkeypatch):
+    """
+    A server with a 4-model ensemble reads and builds each model once,
+    whatever the number of requests.
+    """
+    import shutil
+    import torch
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn import server as server_module
+    from ml_models.cgcnn.server import PredictionServer
+
+    # the prediction module imported by the server (cgcnn.predict)
+    predict = sys.modules[server_module._load_engine.__module__]
+
+    # copies, not loaded by the other tests of the process
+    models = [tmp_path / f"model_{k}.pth.tar" for k in range(4)]
+    for model in models:
+        shutil.copy(Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar", model)
+    loads, builds = [], []
+    torch_load, inference_model = torch.load, predict._inference_model
+    monkeypatch.setattr(predict.torch, "load", lambda *args, **kwargs: loads.append(args[0]) or torch_load(*args, **kwargs))
+    monkeypatch.setattr(predict, "_inference_model", lambda model, args: builds.append(model) or inference_model(model, args))
+
+    server = PredictionServer(str(models[0]), disable_cuda=True, batch_size=4, ensemble=[str(m) for m in models[1:]])
+    for run in range(2):
+        response = server.handle({"op": "predict_dir", "cifpath": str(cif_dir), "output_csv": str(tmp_path / f"served_{run}.csv")})
+        assert "error" not in response
+        rows = [ln.split(",") for ln in Path(response["output_csv"]).read_text().split()]
+        assert rows and all(float(std) <= 1e-6 for _, _, _, std in rows)
+    assert sorted(map(str, loads)) == sorted(map(str, models))
+    assert len(builds) == len(models)
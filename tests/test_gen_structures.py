@@ -78,3 +78,470 @@ def test_run_gen_structures(gen_env, monkeypatch):
     csv_ids = {ln.split(",")[0] for ln in lines}
     cif_ids = {p.stem for p in cif_files}
     assert csv_ids == cif_ids, "csv ids do not match generated CIF filenames"
+
+
+def test_run_gen_structures_unique_permutations(tmp_path):
+    """
+    Rock-salt prototype: exchanging the two sublattices is a symmetry of the
+    skeleton, so (A, B) and (B, A) substitutions are equivalent.
+    """
+    import json
+    from pymatgen.core import Structure, Lattice
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures
+
+    input_dir = tmp_path / "initial"
+    input_dir.mkdir()
+    rock_salt = Structure.from_spacegroup(
+        "Fm-3m", Lattice.cubic(5.0), ["Li", "Be"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    rock_salt.to(filename=str(input_dir / "rock_salt.cif"))
+
+    work_dir = tmp_path / "work"
+    config = {
+        CK.WORK_DIR: str(work_dir),
+        CK.INITIAL_STRS: str(input_dir),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Na-B-C",
+        CK.GEN_PERMUTATIONS: "unique",
+    }
+
+    cwd = os.getcwd()
+    try:
+        out_csv = Path(run_gen_structures(config, n_chunks=1, chunk_id=1))
+    finally:
+        os.chdir(cwd)
+
+    # 6 ordered pairs of 3 elements, only 3 of them are symmetry-distinct
+    lines = [ln.strip() for ln in out_csv.read_text().splitlines() if ln.strip()]
+    assert len(lines) == 15, f"Expected 15 rows in csv, found {len(lines)}"
+
+    out_dir = work_dir / "structures" / "1"
+    assert {ln.split(",")[0] for ln in lines} == {p.stem for p in out_dir.glob("1_*.cif")}
+
+    stats = json.loads((out_dir / "gen_stats.json").read_text())
+    assert stats["generated"] == 15
+    assert stats["skipped_equivalent_permutations"] == 3
+
+
+def test_run_gen_structures_npz(gen_env, tmp_path):
+    """
+    The 'npz' format writes a structure store instead of one CIF per candidate.
+    """
+    from tools.config_labels import ConfigKeys as CK
+    from tools.structure_store import StructureStore
+    from parsl_tasks.gen_structures import run_gen_structures
+
+    work_dir = tmp_path / "work"
+    config = {
+        CK.WORK_DIR: str(work_dir),
+        CK.INITIAL_STRS: str(gen_env["input_dir"]),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Na-B-C",
+        CK.STRUCTURE_FORMAT: "npz",
+    }
+
+    cwd = os.getcwd()
+    try:
+        out_csv = Path(run_gen_structures(config, n_chunks=1, chunk_id=1))
+    finally:
+        os.chdir(cwd)
+
+    out_dir = work_dir / "structures" / "1"
+    assert not list(out_dir.glob("*.cif")), "No CIF file expected with the npz format"
+
+    csv_ids = [ln.split(",")[0] for ln in out_csv.read_text().splitlines() if ln.strip()]
+    store = StructureStore(str(out_dir))
+    assert sorted(store.ids()) == sorted(csv_ids)
+    assert len(csv_ids) == 30
+    assert store.get_structure(csv_ids[0]).composition.reduced_formula
+
+
+def test_gen_cgcnn_stream(gen_env, tmp_path):
+    """
+    Streaming generation + prediction must match the staged pipeline
+    (generate CIFs, then predict on them).
+    """
+    import shutil
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures
+    from parsl_tasks.cgcnn import run_gen_cgcnn_stream
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    def read_preds(csv_path):
+        out = {}
+        for ln in Path(csv_path).read_text().splitlines():
+            if ln.strip():
+                cid, _target, pred = ln.split(",")
+                out[cid] = float(pred)
+        return out
+
+    def make_config(work_dir):
+        return {
+            CK.WORK_DIR: str(work_dir),
+            CK.INITIAL_STRS: str(gen_env["input_dir"]),
+            CK.NUM_WORKERS: 0,
+            CK.ELEMENTS: "Na-B-C",
+            CK.BATCH_SIZE: 8,
+            CK.EF_THR: -0.2,
+        }
+
+    pkg_dir = Path(cgcnn_pkg.__file__).parent
+    staged_dir = tmp_path / "staged"
+    cwd = os.getcwd()
+    try:
+        staged_config = make_config(staged_dir)
+        staged_config[CK.NUM_WORKERS] = 1
+        run_gen_structures(staged_config, n_chunks=1, chunk_id=1)
+        cif_dir = staged_dir / "structures" / "1"
+        shutil.copy(pkg_dir / "atom_init.json", cif_dir)
+        staged_csv = predict_cgcnn(modelpath=str(pkg_dir / "form_1st.pth.tar"), cifpath=str(cif_dir),
+                                   workers=0, disable_cuda=True, output_csv=str(tmp_path / "staged.csv"))
+
+        stream_dir = tmp_path / "stream"
+        stream_csv = run_gen_cgcnn_stream(make_config(stream_dir), n_chunks=1, chunk_id=1)
+    finally:
+        os.chdir(cwd)
+
+    staged, streamed = read_preds(staged_csv), read_preds(stream_csv)
+    assert set(staged) == set(streamed)
+    for cid in staged:
+        assert abs(staged[cid] - streamed[cid]) <= 1e-4, cid
+
+    # fewer candidates than the selection minimum: all of them are written
+    out_dir = stream_dir / "structures" / "1"
+    rows = [ln.split(",")[0] for ln in (out_dir / "id_prop.csv").read_text().splitlines() if ln.strip()]
+    assert set(rows) == set(streamed)
+    assert {p.stem for p in out_dir.glob("1_*.cif")} == set(streamed)
+
+
+def test_generate_structures_matches_reference(gen_env):
+    """
+    The vectorized generation must match a per-site replace + scale_lattice
+    reference implementation.
+    """
+    from itertools import permutations
+    import numpy as np
+    from pymatgen.core import Structure
+    from parsl_tasks.gen_structures import _generate_structures, LATTICE_SCALES
+
+    elements = ["Na", "B", "C"]
+    cif = next(p for p in gen_env["input_dir"].iterdir() if p.suffix == ".cif")
+    original = Structure.from_file(str(cif))
+    substituted = [el.symbol for el in original.composition]
+
+    reference = []
+    for perm in permutations(elements):
+        for scale in LATTICE_SCALES:
+            new_structure = original.copy()
+            for i, site in enumerate(new_structure):
+                new_structure.replace(i, perm[substituted.index(site.specie.symbol)])
+            new_structure.scale_lattice(new_structure.volume * (scale ** 3))
+            reference.append(new_structure)
+
+    candidates, n_skipped = _generate_structures(cif.name, elements, str(gen_env["input_dir"]))
+    assert n_skipped == 0
+    assert [offset for offset, _ in candidates] == list(range(len(reference)))
+    for (_, got), ref in zip(candidates, reference):
+        assert got.atomic_numbers == ref.atomic_numbers
+        assert np.allclose(got.lattice.matrix, ref.lattice.matrix, atol=1e-8)
+        assert np.allclose(got.frac_coords, ref.frac_coords)
+
+
+def test_prototype_cache(gen_env, tmp_path, monkeypatch):
+    import numpy as np
+    import shutil
+    import tools.prototype_cache as prototype_cache
+    from parsl_tasks.gen_structures import _generate_arrays, badele_vec
+
+    input_dir = tmp_path / "initial"
+    shutil.copytree(gen_env["input_dir"], input_dir)
+    cif = next(p for p in input_dir.iterdir() if p.suffix == ".cif")
+    cache_dir = str(tmp_path / "cache")
+    elements = ["Na", "B", "C"]
+
+    ref_coords, ref, _ = _generate_arrays(cif.name, elements, str(input_dir))
+    first = prototype_cache.load_prototype(str(cif), badele_vec, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # a valid entry is read without parsing the CIF file
+    def no_parse(path):
+        raise AssertionError("prototype parsed despite a valid cache entry")
+    monkeypatch.setattr(prototype_cache.Structure, "from_file", no_parse)
+    cached = prototype_cache.load_prototype(str(cif), badele_vec, cache_dir)
+    assert cached.species == first.species and cached.allowed == first.allowed
+    coords, candidates, _ = _generate_arrays(cif.name, elements, str(input_dir), prototype_cache=cache_dir)
+    assert np.allclose(coords, ref_coords)
+    for (offset, lattice, numbers), (ref_offset, ref_lattice, ref_numbers) in zip(candidates, ref):
+        assert offset == ref_offset
+        assert np.allclose(lattice, ref_lattice)
+        assert np.array_equal(numbers, ref_numbers)
+
+    # another element filter, or a modified file, invalidates the entry
+    with pytest.raises(AssertionError):
+        prototype_cache.load_prototype(str(cif), [first.species[0]], cache_dir)
+    monkeypatch.undo()
+    assert not prototype_cache.load_prototype(str(cif), [first.species[0]], cache_dir).allowed
+    st = cif.stat()
+    os.utime(cif, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    monkeypatch.setattr(prototype_cache.Structure, "from_file", no_parse)
+    with pytest.raises(AssertionError):
+        prototype_cache.load_prototype(str(cif), badele_vec, cache_dir)
+
+
+def test_run_gen_structures_batch(gen_env, tmp_path):
+    """
+    A batch of systems is generated in one pass; each system gets the output a
+    single-system run would produce.
+    """
+    from pymatgen.core import Structure
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "Na-B-C"),
+        CK.INITIAL_STRS: str(gen_env["input_dir"]),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Na-B-C",
+        CK.BATCH_ELEMENTS: "K-Al-Si, Na-B-C",
+    }
+
+    cwd = os.getcwd()
+    try:
+        run_gen_structures(config, n_chunks=1, chunk_id=1)
+        single = dict(config, **{CK.WORK_DIR: str(tmp_path / "single"), CK.ELEMENTS: "K-Al-Si", CK.BATCH_ELEMENTS: ""})
+        run_gen_structures(single, n_chunks=1, chunk_id=1)
+    finally:
+        os.chdir(cwd)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["K-Al-Si", "Na-B-C", "single"]
+    batch_dir = tmp_path / "K-Al-Si" / "structures" / "1"
+    single_dir = tmp_path / "single" / "structures" / "1"
+    assert (batch_dir / "id_prop.csv").read_text() == (single_dir / "id_prop.csv").read_text()
+    assert len((tmp_path / "Na-B-C" / "structures" / "1" / "id_prop.csv").read_text().splitlines()) == 30
+    for cif in single_dir.glob("*.cif"):
+        got = Structure.from_file(str(batch_dir / cif.name))
+        assert got == Structure.from_file(str(cif))
+        assert {el.symbol for el in got.composition} <= {"K", "Al", "Si"}
+
+    with pytest.raises(ValueError):
+        run_gen_structures(dict(config, **{CK.BATCH_ELEMENTS: "Ce-Co"}), n_chunks=1, chunk_id=1)
+
+
+def test_element_systems_deduplicated(tmp_path):
+    """
+    Repeated systems of a batch are generated once; a permutation of another
+    system, whose work directory would be left empty, is rejected.
+    """
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import _element_systems
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "Na-B-C"),
+        CK.ELEMENTS: "Na-B-C",
+        CK.BATCH_ELEMENTS: "K-Al-Si,K-Al-Si, Na-B-C ,Li-B-C",
+    }
+    assert _element_systems(config) == [
+        (["Na", "B", "C"], str(tmp_path / "Na-B-C")),
+        (["K", "Al", "Si"], str(tmp_path / "K-Al-Si")),
+        (["Li", "B", "C"], str(tmp_path / "Li-B-C")),
+    ]
+    for batch in ("K-Al-Si,Si-K-Al", "B-Na-C"):
+        with pytest.raises(ValueError, match="permutation"):
+            _element_systems(dict(config, **{CK.BATCH_ELEMENTS: batch}))
+
+
+def test_gen_timings_of_this_run_rejected(gen_env, tmp_path):
+    """The chunks cannot balance their work on the timings they are writing."""
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import chunk_prototypes
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "Na-B-C"),
+        CK.INITIAL_STRS: str(gen_env["input_dir"]),
+        CK.ELEMENTS: "Na-B-C",
+        CK.BATCH_ELEMENTS: "K-Al-Si",
+    }
+    previous = tmp_path / "previous" / "structures" / "1"
+    previous.mkdir(parents=True)
+    (previous / "timings.csv").write_text("")
+    assert len(chunk_prototypes(dict(config, **{CK.GEN_TIMINGS: str(previous.parent)}), 1, 1)) == 1
+
+    for timings in ("Na-B-C/structures", "Na-B-C/structures/1/timings.csv", "K-Al-Si/structures"):
+        with pytest.raises(ValueError, match=CK.GEN_TIMINGS):
+            chunk_prototypes(dict(config, **{CK.GEN_TIMINGS: str(tmp_path / timings)}), 1, 1)
+
+
+def test_lattice_scales(gen_env):
+    import numpy as np
+    from pymatgen.core import Element, Lattice, Structure
+    from tools.prototype_cache import Prototype
+    from parsl_tasks.gen_structures import _generate_arrays, _substitute, _parse_lattice_scales
+
+    elements = ["Na", "B", "C"]
+    cif = next(p for p in gen_env["input_dir"].iterdir() if p.suffix == ".cif")
+    prototype = Structure.from_file(str(cif))
+    _, candidates, _ = _generate_arrays(cif.name, elements, str(gen_env["input_dir"]), lattice_scales=(1.0, 1.1))
+    assert [c[0] for c in candidates] == list(range(12))
+    assert np.allclose(candidates[3][1], 1.1 * prototype.lattice.matrix)
+
+    # adaptive: one candidate per permutation, scaled by the atomic volume ratio
+    rock_salt = Structure.from_spacegroup("Fm-3m", Lattice.cubic(4.0), ["Li", "F"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    species = [site.specie.symbol for site in rock_salt]
+    candidates, _, _ = _substitute(Prototype(rock_salt.lattice.matrix, rock_salt.frac_coords, species, True),
+                                   ["Cs", "Cl"], lattice_scales=_parse_lattice_scales("adaptive"))
+    assert [c[0] for c in candidates] == [0, 1]
+    volume = {el: Element(el).atomic_radius ** 3 for el in ["Li", "F", "Cs", "Cl"]}
+    expected = np.cbrt((volume["Cs"] + volume["Cl"]) / (volume["Li"] + volume["F"]))
+    assert np.allclose(candidates[0][1], expected * rock_salt.lattice.matrix)
+    assert set(candidates[0][2]) == {55, 17}
+
+    with pytest.raises(ValueError):
+        _parse_lattice_scales("0.9,-1")
+
+
+def test_run_gen_structures_resume(tmp_path):
+    """
+    An interrupted chunk skips its completed prototypes and regenerates the
+    others without duplicating their rows.
+    """
+    import json
+    from pymatgen.core import Structure, Lattice
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures, PROGRESS_FILE
+
+    input_dir = tmp_path / "initial"
+    input_dir.mkdir()
+    for name, a in [("a", 4.0), ("b", 5.0)]:
+        Structure.from_spacegroup("Fm-3m", Lattice.cubic(a), ["Li", "Be"],
+                                  [[0, 0, 0], [0.5, 0.5, 0.5]]).to(filename=str(input_dir / f"{name}.cif"))
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "work"),
+        CK.INITIAL_STRS: str(input_dir),
+        CK.NUM_WORKERS: 2,
+        CK.ELEMENTS: "Na-B",
+    }
+    cwd = os.getcwd()
+    try:
+        out_csv = Path(run_gen_structures(config, n_chunks=1, chunk_id=1))
+        out_dir = out_csv.parent
+        rows = sorted(out_csv.read_text().splitlines())
+        assert len(rows) == 20
+        stats = (out_dir / "gen_stats.json").read_text()
+
+        # interrupt after the first prototype: its rows are committed, the
+        # second one was partially written, and so was its progress row
+        progress = (out_dir / PROGRESS_FILE).read_text().splitlines()
+        first = progress[0].split(",")
+        (out_dir / PROGRESS_FILE).write_text(progress[0] + "\n" + progress[1].rsplit(",", 2)[0] + ",")
+        (out_dir / "gen_stats.json").unlink()
+        first_ids = [r.split(",")[0] for r in rows if (int(r.split(",")[0].split("_")[1]) - 1) // 10 == (int(first[1]) - 1) // 10]
+        with open(out_csv, "a") as f:
+            f.write(next(r for r in rows if r.split(",")[0] not in first_ids) + "\n")
+        (out_dir / f"{first_ids[0]}.cif").unlink()
+
+        run_gen_structures(config, n_chunks=1, chunk_id=1)
+    finally:
+        os.chdir(cwd)
+
+    assert sorted(out_csv.read_text().splitlines()) == rows
+    assert json.loads((out_dir / "gen_stats.json").read_text()) == json.loads(stats)
+    # the completed prototype was not regenerated
+    assert not (out_dir / f"{first_ids[0]}.cif").exists()
+    assert len((out_dir / "timings.csv").read_text().splitlines()) == 2
+    assert (out_dir / PROGRESS_FILE).read_text().splitlines() == progress
+
+
+def test_run_gen_structures_options_changed(tmp_path):
+    """
+    A chunk generated with other options is started afresh, and the
+    generation is not considered done until it is.
+    """
+    import json
+    from pymatgen.core import Structure, Lattice
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import generation_done, run_gen_structures, PROGRESS_FILE
+
+    input_dir = tmp_path / "initial"
+    input_dir.mkdir()
+    for name, a in [("a", 4.0), ("b", 5.0)]:
+        Structure.from_spacegroup("Fm-3m", Lattice.cubic(a), ["Li", "Be"],
+                                  [[0, 0, 0], [0.5, 0.5, 0.5]]).to(filename=str(input_dir / f"{name}.cif"))
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "work"),
+        CK.INITIAL_STRS: str(input_dir),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Na-B",
+    }
+    rescaled = dict(config, **{CK.LATTICE_SCALES: "0.98,1.02"})
+    assert not generation_done(config, 1)
+    cwd = os.getcwd()
+    try:
+        out_csv = Path(run_gen_structures(config, n_chunks=1, chunk_id=1))
+        assert generation_done(config, 1)
+        for changed in (rescaled, dict(config, **{CK.MIN_DISTANCE_FACTOR: 0.5}),
+                        dict(config, **{CK.BATCH_ELEMENTS: "K-Al"})):
+            assert not generation_done(changed, 1)
+        assert not generation_done(config, 2)
+
+        # interrupted after the first prototype, then resumed with other scales
+        progress = (out_csv.parent / PROGRESS_FILE).read_text().splitlines()
+        (out_csv.parent / PROGRESS_FILE).write_text(progress[0] + "\n")
+        (out_csv.parent / "gen_stats.json").unlink()
+        run_gen_structures(rescaled, n_chunks=1, chunk_id=1)
+    finally:
+        os.chdir(cwd)
+
+    # 2 prototypes x 2 permutations x 2 scales, none of the previous run
+    ids = sorted(int(r.split(",")[0].split("_")[1]) for r in out_csv.read_text().splitlines())
+    assert ids == list(range(1, 9))
+    manifest = (out_csv.parent / "manifest.csv").read_text().splitlines()
+    assert len(manifest) == 9 and {r.split(",")[3] for r in manifest[1:]} == {"0", "1"}
+    assert json.loads((out_csv.parent / "gen_stats.json").read_text())["generated"] == 8
+    assert generation_done(rescaled, 1) and not generation_done(config, 1)
+
+
+def test_min_distance_filter(tmp_path):
+    """
+    Cs-Cl on a compressed rock-salt prototype is rejected at every scale,
+    on a dilated one only at the smallest scales.
+    """
+    import json
+    from pymatgen.core import Structure, Lattice
+    from pymatgen.analysis.molecule_structure_comparator import CovalentRadius
+    from tools.config_labels import ConfigKeys as CK
+    from parsl_tasks.gen_structures import run_gen_structures, LATTICE_SCALES
+
+    factor = 0.9
+    r = CovalentRadius.radius["Cs"] + CovalentRadius.radius["Cl"]
+    # nearest Cs-Cl distance is a/2: rejected below 2 * factor * r / scale
+    a_small, a_large = 1.5 * factor * r, 2 * factor * r / 0.985
+    input_dir = tmp_path / "initial"
+    input_dir.mkdir()
+    for name, a in [("small", a_small), ("large", a_large)]:
+        Structure.from_spacegroup("Fm-3m", Lattice.cubic(a), ["Li", "Be"],
+                                  [[0, 0, 0], [0.5, 0.5, 0.5]]).to(filename=str(input_dir / f"{name}.cif"))
+
+    config = {
+        CK.WORK_DIR: str(tmp_path / "work"),
+        CK.INITIAL_STRS: str(input_dir),
+        CK.NUM_WORKERS: 1,
+        CK.ELEMENTS: "Cs-Cl",
+        CK.MIN_DISTANCE_FACTOR: factor,
+    }
+    cwd = os.getcwd()
+    try:
+        out_csv = Path(run_gen_structures(config, n_chunks=1, chunk_id=1))
+    finally:
+        os.chdir(cwd)
+
+    n_kept = 2 * sum(scale >= 0.985 for scale in LATTICE_SCALES)
+    assert len(out_csv.read_text().splitlines()) == n_kept
+    stats = json.loads((out_csv.parent / "gen_stats.json").read_text())
+    assert stats["generated"] == n_kept
+    assert stats["rejected_min_distance"] == 2 * 2 * len(LATTICE_SCALES) - n_kept
+    for cif in out_csv.parent.glob("*.cif"):
+        structure = Structure.from_file(str(cif))
+        assert structure.lattice.a > a_large * 0.98
@@ -0,0 +1,75 @@
+import sys
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(scope="module")
+def cif_dir(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("graph_cache")
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp)
+    return tmp / "test_structures" / "1"
+
+
+def _items(dataset):
+    return {cif_id: graph for graph, _, cif_id in (dataset[i] for i in range(len(dataset)))}
+
+
+def test_graph_cache_reuse(cif_dir, tmp_path, monkeypatch):
+    """
+    Graphs built once (by DataLoader workers) are read back by a new dataset
+    without building any graph.
+    """
+    from torch.utils.data import DataLoader
+    from ml_models.cgcnn.data import CIFData, CrystalGraphFeaturizer, collate_pool
+
+    cache_dir = tmp_path / "cache"
+    reference = _items(CIFData(str(cif_dir)))
+
+    dataset = CIFData(str(cif_dir), graph_cache_dir=str(cache_dir))
+    n_loaded = sum(len(ids) for _, _, ids in DataLoader(dataset, batch_size=4, num_workers=2, collate_fn=collate_pool))
+    assert n_loaded == len(reference)
+    # one index file per worker, written at exit
+    assert len(list(cache_dir.glob("index_*.csv"))) == 2
+
+    def no_graph(self, crystal, cif_id=None, family=None):
+        raise AssertionError(f"graph of {cif_id} built despite the cache")
+    monkeypatch.setattr(CrystalGraphFeaturizer, "graph", no_graph)
+    cached = _items(CIFData(str(cif_dir), graph_cache_dir=str(cache_dir)))
+    assert cached.keys() == reference.keys()
+    for cif_id, (atom_fea, nbr_fea, nbr_fea_idx) in reference.items():
+        assert np.allclose(cached[cif_id][0], atom_fea)
+        assert np.allclose(cached[cif_id][1], nbr_fea, atol=1e-5)
+        assert np.array_equal(cached[cif_id][2], nbr_fea_idx)
+
+    # the key depends on the graph parameters
+    with pytest.raises(AssertionError):
+        CIFData(str(cif_dir), graph_cache_dir=str(cache_dir), max_num_nbr=8)[0]
+
+
+def test_graph_cache_flush(tmp_path):
+    from ml_models.cgcnn.graph_cache import GraphCache
+
+    cache = GraphCache(str(tmp_path), flush_size=2)
+    graphs = {f"k{i}": (np.arange(i + 1), np.zeros((i + 1, 3), dtype=int), np.full((i + 1, 3), 0.5 * i))
+              for i in range(3)}
+    for key, graph in graphs.items():
+        cache.put(key, *graph)
+    assert len(list(tmp_path.glob("*_offsets.npy"))) == 1
+    cache.flush()
+
+    reopened = GraphCache(str(tmp_path))
+    assert reopened.get("missing") is None
+    for key, graph in graphs.items():
+        for got, expected in zip(reopened.get(key), graph):
+            assert np.allclose(got, expected)
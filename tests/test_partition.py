@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+def test_count_cif_sites(tmp_path):
+    from pymatgen.core import Structure, Lattice
+    from tools.partition import count_cif_sites
+    structure = Structure.from_spacegroup(
+        "Fm-3m", Lattice.cubic(5.0), ["Li", "Be"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    structure.to(filename=str(tmp_path / "rock_salt.cif"))
+    assert count_cif_sites(str(tmp_path / "rock_salt.cif")) == len(structure)
+
+
+def test_count_cif_sites_multiplicity(tmp_path):
+    """
+    A symmetrized CIF lists its symmetry-unique sites, each with its
+    multiplicity; the tags after the site loop are not counted as sites.
+    """
+    from pymatgen.core import Structure, Lattice
+    from pymatgen.io.cif import CifWriter
+    from tools.partition import count_cif_sites
+    structure = Structure.from_spacegroup(
+        "Fm-3m", Lattice.cubic(5.0), ["Li", "Be"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    path = tmp_path / "rock_salt_sym.cif"
+    CifWriter(structure, symprec=0.01).write_file(str(path))
+    assert count_cif_sites(str(path)) == 2
+    assert count_cif_sites(str(path), multiplicity=True) == len(structure)
+    with open(path, "a") as f:
+        f.write("_cell_formula_units_Z 4\n_journal_year 2024\n")
+    assert count_cif_sites(str(path), multiplicity=True) == len(structure)
+
+
+@pytest.mark.parametrize("costs, n_chunks", [
+    ([5, 4, 3, 3, 3, 1], 2),
+    ([100, 1, 1, 1, 1, 1, 1, 1], 3),
+    ([2] * 7, 4),
+    ([1, 2], 4),
+])
+def test_balanced_partition(costs, n_chunks):
+    from tools.partition import balanced_partition
+    chunks = balanced_partition(costs, n_chunks)
+    assert len(chunks) == n_chunks
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(len(costs)))
+
+    # LPT bound: the largest load exceeds the smallest by at most one item
+    loads = [sum(costs[i] for i in chunk) for chunk in chunks]
+    assert max(loads) - min(loads) <= max(costs)
+
+
+def test_estimate_costs_with_timings(tmp_path):
+    from pymatgen.core import Structure, Lattice
+    from tools.partition import estimate_costs, read_timings
+
+    files = []
+    for name, n in [("a.cif", 2), ("b.cif", 4), ("c.cif", 8)]:
+        Structure(Lattice.cubic(10.0), ["Na"] * n, [[i / n, 0, 0] for i in range(n)]).to(
+            filename=str(tmp_path / name))
+        files.append(name)
+
+    assert estimate_costs(str(tmp_path), files, n_variants=30) == [60, 120, 240]
+
+    (tmp_path / "1").mkdir()
+    (tmp_path / "1" / "timings.csv").write_text("a.cif,6.0\nb.cif,30.0\n")
+    timings = read_timings(str(tmp_path))
+    assert timings == {"a.cif": 6.0, "b.cif": 30.0}
+
+    # measured timings are used as is; c.cif is rescaled with the median ratio (0.175 s per unit)
+    costs = estimate_costs(str(tmp_path), files, n_variants=30, timings=timings)
+    assert costs[:2] == [6.0, 30.0]
+    assert costs[2] == pytest.approx(240 * 0.175)
@@ -0,0 +1,83 @@
+import sys
+import shutil
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(scope="module")
+def store_env(tmp_path_factory):
+    """
+    Convert the CIF test structures into a structure store.
+    """
+    from pymatgen.core import Structure
+    from tools.structure_store import StructureStoreWriter
+
+    tmp = tmp_path_factory.mktemp("structure_store")
+    with tarfile.open(Path(__file__).parent / "test_structures.tar") as tar:
+        try:
+            tar.extractall(path=tmp, filter="data")  # Python 3.12+
+        except TypeError:
+            tar.extractall(path=tmp)
+    cif_dir = tmp / "test_structures" / "1"
+
+    store_dir = tmp / "store"
+    store_dir.mkdir()
+    shutil.copy(cif_dir / "id_prop.csv", store_dir)
+    shutil.copy(cif_dir / "atom_init.json", store_dir)
+    ids = sorted(p.stem for p in cif_dir.glob("*.cif"))
+    # small shards to exercise multi-shard reads
+    with StructureStoreWriter(str(store_dir), shard_size=4) as writer:
+        for cif_id in ids:
+            writer.add_structure(cif_id, Structure.from_file(str(cif_dir / f"{cif_id}.cif")))
+
+    return {"cif_dir": cif_dir, "store_dir": store_dir, "ids": ids}
+
+
+def test_store_roundtrip(store_env):
+    from pymatgen.core import Structure
+    from tools.structure_store import StructureStore, is_structure_store
+
+    assert is_structure_store(str(store_env["store_dir"]))
+    assert not is_structure_store(str(store_env["cif_dir"]))
+    assert len(list(store_env["store_dir"].glob("shard_*.npz"))) == 4
+
+    store = StructureStore(str(store_env["store_dir"]), max_open_shards=1)
+    assert store.ids() == store_env["ids"]
+    for cif_id in store_env["ids"]:
+        ref = Structure.from_file(str(store_env["cif_dir"] / f"{cif_id}.cif"))
+        got = store.get_structure(cif_id)
+        assert got.atomic_numbers == ref.atomic_numbers
+        assert np.allclose(got.lattice.matrix, ref.lattice.matrix)
+        assert np.allclose(got.frac_coords, ref.frac_coords)
+
+
+def test_export_cif(store_env, tmp_path):
+    from tools.structure_store import export_cif
+
+    cif_id = store_env["ids"][0]
+    assert export_cif(str(store_env["store_dir"]), str(tmp_path), ids=[cif_id]) == 1
+    assert [p.name for p in tmp_path.iterdir()] == [f"{cif_id}.cif"]
+
+
+def test_cifdata_from_store(store_env):
+    """
+    CIFData must produce the same crystal graphs from CIF files and from a store.
+    """
+    from ml_models.cgcnn.data import CIFData
+
+    from_cif = CIFData(str(store_env["cif_dir"]))
+    from_store = CIFData(str(store_env["store_dir"]))
+    assert from_store.store is not None
+    for idx in range(len(from_cif)):
+        (a1, n1, i1), t1, id1 = from_cif[idx]
+        (a2, n2, i2), t2, id2 = from_store[idx]
+        assert id1 == id2
+        assert np.allclose(a1, a2) and np.allclose(n1, n2, atol=1e-6)
+        assert np.array_equal(i1, i2) and np.allclose(t1, t2)
@@ -117,6 +117,161 @@ def test_cgcnn_reproducible_predictions(cgcnn_output, tmp_path, monkeypatch):
             assert abs(first[k] - cur[k]) <= 1e-6, f"Unstable CGCNN prediction for {k} on run {j}"
 
 
+def test_cgcnn_resume(cgcnn_output):
+    """
+    A prediction killed mid-run resumes after its complete rows, in the same
+    order and with the same predictions as an uninterrupted run.
+    """
+    from pathlib import Path
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    base = cgcnn_output["base"]
+    cif_dir = cgcnn_output["structures"] / "1"
+    model_path = Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar"
+
+    def run(out_csv, resume=False):
+        return predict_cgcnn(modelpath=str(model_path), cifpath=str(cif_dir), batch_size=4, workers=0,
+                             disable_cuda=True, output_csv=str(out_csv), resume=resume)
+
+    def read_rows(csv_path):
+        return [(cid, float(pred)) for cid, _target, pred in (ln.split(",") for ln in Path(csv_path).read_text().split())]
+
+    def assert_same(rows, ref):
+        assert [cid for cid, _ in rows] == [cid for cid, _ in ref]
+        assert all(abs(pred - ref_pred) <= 1e-6 for (_, pred), (_, ref_pred) in zip(rows, ref))
+
+    full_csv = run(base / "full.csv")
+    full = read_rows(full_csv)
+    lines = Path(full_csv).read_text().splitlines(keepends=True)
+    assert len(lines) > 8
+    # killed while writing the 7th row
+    partial = base / "partial.csv"
+    partial.write_text("".join(lines[:6]) + lines[6][:5])
+    assert_same(read_rows(run(partial, resume=True)), full)
+    # rows of other structures are not resumed
+    stale = base / "stale.csv"
+    stale.write_text("".join(lines[1:4]))
+    assert_same(read_rows(run(stale, resume=True)), full)
+
+
+# int8: ~0.02 eV/atom mean, ~0.06 max error of the quantized layers on these structures
+@pytest.mark.parametrize("precision, compile_model, tolerance", [("fp32", True, 1e-4), ("bf16", False, 0.05), ("int8", False, 0.1)])
+def test_cgcnn_inference_engine(cgcnn_output, precision, compile_model, tolerance):
+    """
+    Predictions of the compiled, reduced precision or quantized engines stay
+    close to the fp32 eager predictions (formation energies, eV/atom).
+    """
+    from pathlib import Path
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    if compile_model:
+        pytest.importorskip("torch._dynamo")
+    base = cgcnn_output["base"]
+    model_path = Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar"
+
+    def run(out_csv, **kwargs):
+        out_csv = predict_cgcnn(modelpath=str(model_path), cifpath=str(cgcnn_output["structures"] / "1"),
+                                batch_size=8, workers=0, disable_cuda=True, output_csv=str(out_csv), **kwargs)
+        return {cid: float(pred) for cid, _target, pred in (ln.split(",") for ln in Path(out_csv).read_text().split())}
+
+    baseline = run(base / "fp32.csv")
+    preds = run(base / f"{precision}_{compile_model}.csv", precision=precision, compile_model=compile_model)
+    assert preds.keys() == baseline.keys()
+    assert max(abs(preds[cid] - baseline[cid]) for cid in baseline) <= tolerance
+
+
+def test_cgcnn_predict_only(cgcnn_output):
+    """
+    The prediction-only loop writes the rows of the validation loop, whatever
+    the number of batches copied to the host at once.
+    """
+    from pathlib import Path
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    base = cgcnn_output["base"]
+    model_path = Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar"
+
+    def run(out_csv, **kwargs):
+        out_csv = predict_cgcnn(modelpath=str(model_path), cifpath=str(cgcnn_output["structures"] / "1"),
+                                batch_size=4, workers=0, disable_cuda=True, output_csv=str(out_csv), **kwargs)
+        return [(cid, float(target), float(pred)) for cid, target, pred in (ln.split(",") for ln in Path(out_csv).read_text().split())]
+
+    expected = run(base / "validate.csv")
+    for copy_every in (1, 3):
+        rows = run(base / f"predict_only_{copy_every}.csv", predict_only=True, copy_every=copy_every)
+        assert [row[:2] for row in rows] == [row[:2] for row in expected]
+        assert all(abs(row[2] - ref[2]) <= 1e-6 for row, ref in zip(rows, expected))
+
+
+def test_cgcnn_ensemble(cgcnn_output):
+    """
+    An ensemble writes the mean and the standard deviation of the predictions
+    of its checkpoints, here the model and a copy shifted by 0.2 eV/atom.
+    """
+    from pathlib import Path
+    import torch
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    base = cgcnn_output["base"]
+    model_path = Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar"
+    checkpoint = torch.load(model_path, map_location="cpu", weights_only=False)
+    checkpoint["normalizer"]["mean"] = checkpoint["normalizer"]["mean"] + 0.2
+    shifted = base / "shifted.pth.tar"
+    torch.save(checkpoint, shifted)
+
+    def run(out_csv, **kwargs):
+        out_csv = predict_cgcnn(modelpath=str(model_path), cifpath=str(cgcnn_output["structures"] / "1"),
+                                batch_size=4, workers=0, disable_cuda=True, output_csv=str(out_csv), **kwargs)
+        return [ln.split(",") for ln in Path(out_csv).read_text().split()]
+
+    single = run(base / "single_model.csv", predict_only=True)
+    rows = run(base / "ensemble.csv", ensemble=[str(shifted)])
+    assert [row[:2] for row in rows] == [row[:2] for row in single]
+    assert all(abs(float(mean) - float(pred) - 0.1) <= 1e-5 and abs(float(std) - 0.1) <= 1e-5
+               for (_, _, mean, std), (_, _, pred) in zip(rows, single))
+    # the same checkpoint twice: no spread
+    rows = run(base / "same.csv", ensemble=str(model_path))
+    assert all(abs(float(mean) - float(pred)) <= 1e-6 and float(std) == 0
+               for (_, _, mean, std), (_, _, pred) in zip(rows, single))
+
+
+def test_cgcnn_multi_device(cgcnn_output):
+    """
+    Sharding the prediction among one process per device (or CPU socket)
+    gives the rows of a single-device run, and resumes a merged output.
+    """
+    from pathlib import Path
+    import ml_models.cgcnn as cgcnn_pkg
+    from ml_models.cgcnn.predict import predict_cgcnn
+
+    base = cgcnn_output["base"]
+    model_path = Path(cgcnn_pkg.__file__).parent / "form_1st.pth.tar"
+
+    def run(out_csv, **kwargs):
+        out_csv = predict_cgcnn(modelpath=str(model_path), cifpath=str(cgcnn_output["structures"] / "1"),
+                                batch_size=4, workers=0, disable_cuda=True, output_csv=str(out_csv),
+                                predict_only=True, **kwargs)
+        return [(cid, float(pred)) for cid, _target, pred in (ln.split(",") for ln in Path(out_csv).read_text().split())]
+
+    def assert_same(rows, ref):
+        assert [cid for cid, _ in rows] == [cid for cid, _ in ref]
+        assert all(abs(pred - ref_pred) <= 1e-6 for (_, pred), (_, ref_pred) in zip(rows, ref))
+
+    expected = run(base / "single_device.csv")
+    assert_same(run(base / "two_devices.csv", devices=["cpu", "cpu"]), expected)
+    assert not list(base.glob("two_devices.csv.part*"))
+    # a killed merged run
+    merged = base / "two_devices.csv"
+    merged.write_text("".join(merged.read_text().splitlines(keepends=True)[:5]))
+    assert_same(run(merged, devices="cpu,cpu", resume=True), expected)
+    # one process per CPU socket, on the CPUs of its socket
+    assert_same(run(base / "sockets.csv", devices="sockets", threads=1), expected)
+
+
 def test_select_structure(cgcnn_output):
     """
     test select structures using the callable (no subprocess, no cms_dir)
@@ -31,6 +31,22 @@ class ConfigKeys:
     MPRester_API_KEY = "mp_rester_api_key"
     HULL_ENERGY_THR = "hull_energy_threshold"
     GEN_STRUCTURES_NNODES = "pre_processing_nnodes"
+    GEN_PERMUTATIONS = "gen_permutations"
+    STRUCTURE_FORMAT = "structure_format"
+    PIPELINE_MODE = "pipeline_mode"
+    GEN_TIMINGS = "gen_timings"
+    PROTOTYPE_CACHE = "prototype_cache_dir"
+    BATCH_ELEMENTS = "batch_elements"
+    LATTICE_SCALES = "lattice_scales"
+    MIN_DISTANCE_FACTOR = "min_distance_factor"
+    CGCNN_GRAPH_CACHE = "cgcnn_graph_cache_dir"
+    CGCNN_MAX_ATOMS = "cgcnn_max_atoms"
+    CGCNN_PRECISION = "cgcnn_precision"
+    CGCNN_COMPILE = "cgcnn_compile"
+    CGCNN_GPUS = "cgcnn_gpus_per_task"
+    CGCNN_SERVER = "cgcnn_server"
+    CGCNN_MODEL_CACHE = "cgcnn_model_cache_dir"
+    CGCNN_ENSEMBLE = "cgcnn_ensemble"
 
     # hardcoded keys
     SUBDIR_STABLE_PHASES = "stable_phases_work_dir"
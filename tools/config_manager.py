@@ -32,6 +32,17 @@ def _find_next_vasp_structure(work_dir):
     return next_number
 
 
+def get_optional(config, key):
+    """
+    Read an optional field from a config (a :class:`ConfigManager` or a plain dict).
+    Fall back to the :attr:`ConfigManager.OPTIONAL_PARAMS` default if the field is absent.
+    """
+    try:
+        return config[key]
+    except KeyError:
+        return ConfigManager.OPTIONAL_PARAMS[key][0]
+
+
 class ConfigManager:
     """
     Manages configuration settings loaded from the JSON config file and optionally overridden
@@ -72,7 +83,23 @@ class ConfigManager:
         CK.MPRester_API_KEY: ("", f"An API key for accessing the MP data (https://docs.materialsproject.org). Required if --{CK.POST_PROCESSING_OUT_DIR} is set. "),
         CK.HULL_ENERGY_THR: (
             0.1, "Maximum Ehull (eV/atom) to display for metastable phases"),
-        CK.GEN_STRUCTURES_NNODES: (1, "Number of nodes used for the pre-processing phases")
+        CK.GEN_STRUCTURES_NNODES: (1, "Number of nodes used for the pre-processing phases"),
+        CK.GEN_PERMUTATIONS: ("all", "Element permutations used when generating the structures: 'all' keeps every permutation, 'unique' drops the permutations that are symmetry-equivalent on the prototype."),
+        CK.STRUCTURE_FORMAT: ("cif", "Storage of the generated structures: 'cif' writes one CIF file per structure, 'npz' writes a sharded structure store (see tools/structure_store.py)."),
+        CK.PIPELINE_MODE: ("staged", "'staged' writes all the generated structures before the CGCNN prediction, 'streaming' predicts the structures as they are generated and only writes the ones kept for the selection."),
+        CK.GEN_TIMINGS: ("", "Per-prototype timings of a previous run, used to balance the pre-processing chunks: a timings.csv file or a 'structures' directory of a previous work_dir. If not set, the cost is estimated from the number of sites of each prototype."),
+        CK.PROTOTYPE_CACHE: ("", "Directory of a persistent cache of the parsed initial structures, shared across runs and element systems. If not set, the initial structures are parsed by every run."),
+        CK.BATCH_ELEMENTS: ("", "Comma-separated element systems (e.g. 'Ce-Fe-In,Ce-Ni-B') whose structures are generated in the same pass as 'elements', each in the work directory of its own system. All the systems must have as many elements as 'elements'."),
+        CK.LATTICE_SCALES: ("0.96,0.98,1.0,1.02,1.04", "Comma-separated scales applied to the lattice vectors of every substituted prototype, or 'adaptive' to generate a single candidate per substitution, with the volume estimated from the atomic volumes of the original and the substituted elements."),
+        CK.MIN_DISTANCE_FACTOR: (0.0, "Reject the generated structures with two atoms closer than this fraction of the sum of their covalent radii (e.g. 0.7). The number of rejected structures is reported in the gen_stats.json of each chunk. If 0, no structure is rejected."),
+        CK.CGCNN_GRAPH_CACHE: ("", "Directory of a persistent cache of the crystal graphs built for the CGCNN prediction, keyed by the content of the structures. A new prediction over the same structures (e.g. with another model) skips the graph construction. If not set, the graphs are built by every prediction."),
+        CK.CGCNN_MAX_ATOMS: (0, "Maximum total number of atoms of a CGCNN prediction batch (batch_size still bounds its number of structures). If 0, the budget is derived from the free memory of the GPU, and not bounded on a CPU."),
+        CK.CGCNN_PRECISION: ("fp32", "Precision of the CGCNN prediction: fp32, bf16/fp16 (fp16 on a GPU only) to run the model under autocast, or int8 (CPU only) to quantize its linear layers."),
+        CK.CGCNN_COMPILE: (0, "If 1, the CGCNN model is compiled with torch.compile before the prediction."),
+        CK.CGCNN_GPUS: (1, "Number of GPUs of a CGCNN prediction task. With more than one GPU, the structures of a chunk are split among one process per GPU, e.g. 4 to predict a chunk per Perlmutter GPU node. With 0, the chunk is predicted on the num_workers CPUs of the task, with one process per socket."),
+        CK.CGCNN_SERVER: ("", "Address (host:port, or path of a Unix socket) of a running CGCNN inference server (ml_models/cgcnn/server.py), which then predicts the chunks with its model instead of a new process per chunk. The key of a TCP server is read from $CGCNN_SERVER_AUTHKEY."),
+        CK.CGCNN_MODEL_CACHE: ("", "Directory of weights-only artifacts of the CGCNN checkpoints, memory-mapped by the predictions instead of unpickling the full checkpoint. If not set, every prediction reads the checkpoint."),
+        CK.CGCNN_ENSEMBLE: ("", "Comma-separated paths of further CGCNN checkpoints, evaluated with the bundled model on the same batches. The predictions CSVs then hold the mean and the standard deviation of the ensemble (the selection reads the mean).")
     }
 
     CONFIG_HELP_MSG = "Path to the JSON configuration file (required)."
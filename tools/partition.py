@@ -0,0 +1,123 @@
+"""
+Cost-balanced partitioning of the prototype files among chunks.
+
+Splitting the prototypes into equal-count chunks leaves some chunks with much
+more work than others, since the generation (and the prediction of the
+generated candidates) scales with the number of sites of each prototype. The
+functions below estimate a cost per prototype and assign the prototypes to
+chunks with the longest-processing-time-first (LPT) heuristic.
+"""
+
+import csv
+import glob
+import heapq
+import os
+
+import numpy as np
+
+TIMINGS_FILE = "timings.csv"
+
+
+def count_cif_sites(path, multiplicity=False):
+    """
+    Estimate the number of sites of a CIF file by counting the rows of its
+    ``_atom_site_`` loop, without parsing the structure.
+
+    With ``multiplicity``, a row counts for the
+    ``_atom_site_symmetry_multiplicity`` of its site, if the loop has that
+    column (the symmetry operations and occupancies are not applied).
+
+    :returns: number of sites (at least 1)
+    :rtype: int
+    """
+    n_sites = 0
+    in_loop = in_header = is_site_loop = False
+    columns = []
+    with open(path) as f:
+        for line in f:
+            token = line.strip()
+            if not token or token.startswith("#"):
+                continue
+            if token.startswith("loop_"):
+                in_loop, in_header, is_site_loop = True, True, False
+                columns = []
+            elif token.startswith("data_"):
+                in_loop = False
+            elif token.startswith("_"):
+                if in_loop and in_header:
+                    is_site_loop |= token.startswith("_atom_site_") and not token.startswith("_atom_site_aniso")
+                    columns.append(token.split()[0])
+                else:
+                    in_loop = False
+            elif in_loop:
+                in_header = False
+                if is_site_loop:
+                    n_sites += _site_multiplicity(token.split(), columns) if multiplicity else 1
+    return max(n_sites, 1)
+
+
+def _site_multiplicity(row, columns):
+    """Multiplicity of an ``_atom_site_`` loop row (1 if not given)."""
+    if "_atom_site_symmetry_multiplicity" not in columns or len(row) != len(columns):
+        return 1
+    value = row[columns.index("_atom_site_symmetry_multiplicity")]
+    return int(value) if value.isdigit() else 1
+
+
+def read_timings(path):
+    """
+    Read per-prototype generation timings recorded by a previous run.
+
+    :param str path: a ``timings.csv`` file, or a directory searched for
+        ``*/timings.csv`` files (e.g. ``work_dir/structures``)
+    :returns: ``{structure_file: seconds}``
+    :rtype: dict
+    """
+    if not path:
+        return {}
+    files = [path] if os.path.isfile(path) else glob.glob(os.path.join(path, "*", TIMINGS_FILE))
+    timings = {}
+    for file in files:
+        with open(file) as f:
+            for structure_file, seconds in csv.reader(f):
+                timings[structure_file] = float(seconds)
+    return timings
+
+
+def estimate_costs(structure_dir, structure_files, n_variants=1, timings=None):
+    """
+    Estimate the processing cost of each prototype.
+
+    The cost is ``num_sites * n_variants``, where ``n_variants`` is the number
+    of candidates generated per prototype. Measured timings, when available,
+    take precedence; the estimates of the other prototypes are rescaled to the
+    same unit with the median ratio between timings and estimates.
+
+    :returns: list of costs, in the order of ``structure_files``
+    :rtype: list
+    """
+    costs = [count_cif_sites(os.path.join(structure_dir, f)) * n_variants for f in structure_files]
+    if not timings:
+        return costs
+
+    ratios = [timings[f] / c for f, c in zip(structure_files, costs) if f in timings]
+    scale = float(np.median(ratios)) if ratios else 1.0
+    return [timings[f] if f in timings else c * scale for f, c in zip(structure_files, costs)]
+
+
+def balanced_partition(costs, n_chunks):
+    """
+    Assign items to ``n_chunks`` chunks with the LPT heuristic: items are taken
+    by decreasing cost and given to the currently least loaded chunk.
+
+    :returns: ``n_chunks`` lists of item indices, each sorted in increasing order
+    :rtype: list
+    """
+    chunks = [[] for _ in range(n_chunks)]
+    loads = [(0.0, c) for c in range(n_chunks)]
+    heapq.heapify(loads)
+    for i in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+        load, c = heapq.heappop(loads)
+        chunks[c].append(i)
+        heapq.heappush(loads, (load + costs[i], c))
+    return [sorted(chunk) for chunk in chunks]
@@ -0,0 +1,85 @@
+"""
+Persistent cache of parsed prototype structures.
+
+Every run, and every chunk of a run, reads the same prototype library. The
+cache keeps, for each prototype CIF file, its lattice, fractional coordinates,
+site species and the element-filter verdict, so that runs over different
+element systems skip the CIF parsing entirely.
+
+An entry is stored in ``<cache_dir>/<sha1 of the absolute path>.npz`` and is
+valid as long as the modification time and the size of the CIF file, and the
+set of excluded elements, are unchanged. Entries are written atomically, so concurrent chunks can share the
+same cache directory.
+"""
+
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+from pymatgen.core import Structure
+
+Prototype = namedtuple("Prototype", ["lattice", "frac_coords", "species", "allowed"])
+Prototype.__doc__ = """
+Parsed prototype.
+
+- ``lattice`` (3, 3) lattice matrix
+- ``frac_coords`` (n, 3) fractional coordinates
+- ``species`` list of the n site species symbols
+- ``allowed`` False if the prototype contains an excluded element
+"""
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+
+def _entry_path(cache_dir, path):
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.npz")
+
+
+def _parse(path, excluded_elements):
+    structure = Structure.from_file(path)
+    species = [site.specie.symbol for site in structure]
+    allowed = not any(el in excluded_elements for el in species)
+    return Prototype(structure.lattice.matrix, structure.frac_coords, species, allowed)
+
+
+def load_prototype(path, excluded_elements=(), cache_dir=""):
+    """
+    Load a prototype CIF file, through the cache if ``cache_dir`` is set.
+
+    The filter verdict is part of the entry; an entry written with other
+    ``excluded_elements`` is treated as stale.
+
+    :param str path: path to the CIF file
+    :param excluded_elements: element symbols that make the prototype not ``allowed``
+    :param str cache_dir: cache directory (created if missing); empty disables the cache
+
+    :returns: the parsed prototype
+    :rtype: Prototype
+    """
+    if not cache_dir:
+        return _parse(path, excluded_elements)
+
+    key = _file_key(path)
+    excluded = np.array(sorted(excluded_elements), dtype=str)
+    entry = _entry_path(cache_dir, path)
+    try:
+        with np.load(entry) as data:
+            if np.array_equal(data["key"], key) and np.array_equal(data["excluded"], excluded):
+                return Prototype(data["lattice"], data["frac_coords"],
+                                 data["species"].tolist(), bool(data["allowed"]))
+    except (OSError, KeyError, ValueError):
+        pass
+
+    prototype = _parse(path, excluded_elements)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, key=key, excluded=excluded, lattice=prototype.lattice, frac_coords=prototype.frac_coords,
+                 species=np.array(prototype.species), allowed=prototype.allowed)
+    os.replace(tmp, entry)
+    return prototype
@@ -0,0 +1,238 @@
+"""
+Compact sharded storage for generated crystal structures.
+
+Writing one CIF file per candidate produces millions of small files, which is
+expensive for parallel file systems and forces every downstream stage to
+re-parse CIF text. A structure store keeps the candidates of a directory in a
+few binary shards instead:
+
+    store_dir
+    ├── store_index.csv      "<id>,<shard>,<row>" for every stored structure
+    ├── shard_00000.npz
+    ├── shard_00001.npz
+    ├── ...
+
+Each shard holds the arrays ``ids`` (n,), ``lattices`` (n, 3, 3),
+``natoms`` (n,), ``frac_coords`` (sum(natoms), 3) and ``numbers``
+(sum(natoms),) (atomic numbers).
+"""
+
+import argparse
+import csv
+import os
+from collections import OrderedDict
+
+import numpy as np
+from pymatgen.core import Lattice, Structure
+
+INDEX_FILE = "store_index.csv"
+SHARD_PREFIX = "shard_"
+DEFAULT_SHARD_SIZE = 10000
+
+
+def is_structure_store(store_dir):
+    """Return True if ``store_dir`` contains a structure store."""
+    return os.path.isfile(os.path.join(store_dir, INDEX_FILE))
+
+
+def _shard_name(shard_id):
+    return f"{SHARD_PREFIX}{shard_id:05d}.npz"
+
+
+class StructureStoreWriter:
+    """
+    Append structures to a store, one shard every ``shard_size`` structures.
+
+    A shard is first written under a temporary name and renamed once complete,
+    then its rows are appended to the index, so an interrupted writer never
+    leaves a partially written shard referenced by the index.
+
+    Args:
+        store_dir (str): directory of the store (created if missing).
+        shard_size (int, optional): number of structures per shard.
+    """
+
+    def __init__(self, store_dir, shard_size=DEFAULT_SHARD_SIZE):
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        os.makedirs(store_dir, exist_ok=True)
+        self._next_shard = len([f for f in os.listdir(store_dir)
+                                if f.startswith(SHARD_PREFIX) and f.endswith(".npz")])
+        self._reset()
+
+    def _reset(self):
+        self._ids, self._lattices, self._frac_coords, self._numbers = [], [], [], []
+
+    def add(self, structure_id, lattice, frac_coords, numbers):
+        """
+        Add one structure given as arrays.
+
+        :returns: True if the call flushed a shard to disk.
+        """
+        self._ids.append(str(structure_id))
+        self._lattices.append(np.asarray(lattice, dtype=np.float64))
+        self._frac_coords.append(np.asarray(frac_coords, dtype=np.float64))
+        self._numbers.append(np.asarray(numbers, dtype=np.int16))
+        if len(self._ids) >= self.shard_size:
+            self.flush()
+            return True
+        return False
+
+    def add_structure(self, structure_id, structure):
+        """Add one :class:`pymatgen.core.Structure`."""
+        return self.add(structure_id, structure.lattice.matrix,
+                        structure.frac_coords, structure.atomic_numbers)
+
+    def flush(self):
+        """Write the buffered structures as a new shard."""
+        if not self._ids:
+            return
+        shard = _shard_name(self._next_shard)
+        path = os.path.join(self.store_dir, shard)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f,
+                     ids=np.array(self._ids),
+                     lattices=np.stack(self._lattices),
+                     natoms=np.array([len(n) for n in self._numbers], dtype=np.int64),
+                     frac_coords=np.concatenate(self._frac_coords).reshape(-1, 3),
+                     numbers=np.concatenate(self._numbers))
+        os.replace(path + ".tmp", path)
+        with open(os.path.join(self.store_dir, INDEX_FILE), "a") as f:
+            for row, structure_id in enumerate(self._ids):
+                f.write(f"{structure_id},{self._next_shard},{row}\n")
+        self._next_shard += 1
+        self._reset()
+
+    def close(self):
+        """Flush the remaining structures."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class StructureStore:
+    """
+    Read-only access to a structure store.
+
+    Shards are loaded on demand; the ``max_open_shards`` most recently used
+    shards are kept in memory.
+
+    Args:
+        store_dir (str): directory of the store.
+        max_open_shards (int, optional): number of shards kept in memory.
+    """
+
+    def __init__(self, store_dir, max_open_shards=4):
+        self.store_dir = store_dir
+        self.max_open_shards = max_open_shards
+        self._index = {}
+        with open(os.path.join(store_dir, INDEX_FILE)) as f:
+            for structure_id, shard, row in csv.reader(f):
+                self._index[structure_id] = (int(shard), int(row))
+        self._shards = OrderedDict()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, structure_id):
+        return structure_id in self._index
+
+    def ids(self):
+        """Identifiers of the stored structures, in storage order."""
+        return list(self._index.keys())
+
+    def num_atoms(self):
+        """
+        :returns: number of atoms of every stored structure, in storage order
+            (read without loading the coordinates).
+        """
+        natoms = {}
+        for shard_id in sorted({shard_id for shard_id, _ in self._index.values()}):
+            with np.load(os.path.join(self.store_dir, _shard_name(shard_id))) as data:
+                natoms[shard_id] = data["natoms"]
+        return [int(natoms[shard_id][row]) for shard_id, row in self._index.values()]
+
+    def _shard(self, shard_id):
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            with np.load(os.path.join(self.store_dir, _shard_name(shard_id))) as data:
+                shard = {key: data[key] for key in data.files}
+            shard["offsets"] = np.concatenate(([0], np.cumsum(shard["natoms"])))
+            self._shards[shard_id] = shard
+            if len(self._shards) > self.max_open_shards:
+                self._shards.popitem(last=False)
+        else:
+            self._shards.move_to_end(shard_id)
+        return shard
+
+    def get_arrays(self, structure_id):
+        """
+        :returns: ``(lattice, frac_coords, numbers)`` of a stored structure.
+        :raises KeyError: if ``structure_id`` is not in the store
+        """
+        shard_id, row = self._index[structure_id]
+        shard = self._shard(shard_id)
+        start, end = shard["offsets"][row], shard["offsets"][row + 1]
+        return (shard["lattices"][row],
+                shard["frac_coords"][start:end],
+                shard["numbers"][start:end].astype(np.int64))
+
+    def get_structure(self, structure_id):
+        """:returns: a stored structure as a :class:`pymatgen.core.Structure`."""
+        lattice, frac_coords, numbers = self.get_arrays(structure_id)
+        return Structure(Lattice(lattice), numbers.tolist(), frac_coords)
+
+
+def load_structure(structure_dir, structure_id, stores=None):
+    """
+    Load a structure from ``structure_dir``, either from its structure store or
+    from ``<structure_id>.cif``.
+
+    :param dict stores: optional cache of opened stores, keyed by directory.
+    """
+    if stores is None:
+        stores = {}
+    if structure_dir not in stores:
+        stores[structure_dir] = StructureStore(structure_dir) if is_structure_store(structure_dir) else None
+    store = stores[structure_dir]
+    if store is not None:
+        return store.get_structure(structure_id)
+    return Structure.from_file(os.path.join(structure_dir, f"{structure_id}.cif"))
+
+
+def export_cif(store_dir, output_dir, ids=None):
+    """
+    Export structures of a store as ``<id>.cif`` files.
+
+    :param str store_dir: directory of the store
+    :param str output_dir: destination directory (created if missing)
+    :param list ids: identifiers to export (default: all)
+
+    :returns: number of written CIF files
+    :rtype: int
+    """
+    store = StructureStore(store_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    ids = store.ids() if ids is None else ids
+    for structure_id in ids:
+        store.get_structure(structure_id).to(
+            filename=os.path.join(output_dir, f"{structure_id}.cif"))
+    return len(ids)
+
+
+def _build_argparser():
+    parser = argparse.ArgumentParser(description="Export structures of a structure store as CIF files.")
+    parser.add_argument("store_dir", help="path to the structure store.")
+    parser.add_argument("output_dir", help="path to the output directory.")
+    parser.add_argument("--ids", nargs="+", default=None, help="identifiers to export (default: all)")
+    return parser
+
+
+if __name__ == "__main__":
+    cli = _build_argparser().parse_args()
+    n = export_cif(cli.store_dir, cli.output_dir, cli.ids)
+    print(f"Exported {n} structures to: {cli.output_dir}")
@@ -7,7 +7,7 @@ from tools.errors import VaspNonReached
 from parsl.app.errors import AppTimeout
 from parsl.app.errors import BashExitFailure
 from tools.logging_config import amd_logger
-from tools.config_manager import ConfigManager
+from tools.config_manager import ConfigManager, get_optional
 from tools.config_labels import ConfigKeys as CK
 
 from parsl_tasks.ehull import calculate_ehul
@@ -95,6 +95,15 @@ def generate_structures(config):
         amd_logger.critical(f"An exception occurred: {e}")
 
 
+def _generation_done(config):
+    """
+    True if the structure generation has completed with the current options
+    (see :func:`parsl_tasks.gen_structures.generation_done`).
+    """
+    from parsl_tasks.gen_structures import generation_done
+    return generation_done(config.get_json_config(), config[CK.GEN_STRUCTURES_NNODES])
+
+
 def select_structures(config):
     """
     Filter, deduplicate, and select candidate structures.
@@ -135,26 +144,58 @@ def run_cgcnn(config):
         for future in l_futures:
             future.exception()
 
-        # merge results
-        pattern = os.path.join(config[CK.WORK_DIR], "test_results_*.csv")
-        files_to_merge = list(glob.iglob(pattern))
-        if not files_to_merge:
-            return
+        _merge_predictions(config)
+
+    except Exception as e:
+        amd_logger.critical(f"An exception occurred: {e}")
+
+
+def generate_and_predict(config):
+    """
+    Generate the candidates and predict their formation energy in one pass
+    (``pipeline_mode = "streaming"``).
+
+    Submits :func:`parsl_tasks.cgcnn.gen_cgcnn_stream` for each chunk
+    ``i ∈ [1, n_chunks]`` where ``n_chunks = config[CK.GEN_STRUCTURES_NNODES]``,
+    then merges ``work_dir/test_results_*.csv`` into ``work_dir/test_results.csv``.
+    Only the candidates that may be selected are written to ``work_dir/structures``.
+
+    :param ConfigManager config: workflow configuration
 
-        dataframes = pd.concat(
-            (pd.read_csv(file, header=None) for file in files_to_merge),
-            ignore_index=True
-        )
-        dataframes.to_csv(os.path.join(config[CK.WORK_DIR], "test_results.csv"), index=False)
+    :returns: None
+    :rtype: None
+    """
+    from parsl_tasks.cgcnn import gen_cgcnn_stream
+    try:
+        n_chunks = config[CK.GEN_STRUCTURES_NNODES]
+        l_futures = [gen_cgcnn_stream(config.get_json_config(), n_chunks, i) for i in range(1, n_chunks + 1)]
+        for future in l_futures:
+            future.result()
 
-        # cleanup
-        for file in files_to_merge:
-            os.remove(file)
+        _merge_predictions(config)
 
     except Exception as e:
         amd_logger.critical(f"An exception occurred: {e}")
 
 
+def _merge_predictions(config):
+    """Merge ``work_dir/test_results_*.csv`` into ``work_dir/test_results.csv`` and delete the shards."""
+    pattern = os.path.join(config[CK.WORK_DIR], "test_results_*.csv")
+    files_to_merge = list(glob.iglob(pattern))
+    if not files_to_merge:
+        return
+
+    dataframes = pd.concat(
+        (pd.read_csv(file, header=None) for file in files_to_merge),
+        ignore_index=True
+    )
+    dataframes.to_csv(os.path.join(config[CK.WORK_DIR], "test_results.csv"), index=False)
+
+    # cleanup
+    for file in files_to_merge:
+        os.remove(file)
+
+
 def post_processing(config):
     """
     Compute Ehull, color the convex hull, and collect promising candidates.
@@ -211,6 +252,9 @@ def run_workflow(config):
     2. **CGCNN Prediction**
        :func:`~parsl_tasks.cgcnn.run_cgcnn`.
 
+       With ``pipeline_mode = "streaming"``, steps 1 and 2 run as one pass:
+       :func:`~workflows.vasp_based.generate_and_predict`.
+
     3. **Structure Selection**
        :func:`~parsl_tasks.cgcnn.select_structures`.
 
@@ -232,16 +276,21 @@ def run_workflow(config):
     """
     amd_logger.info("Start 'vasp_based' workflow")
 
-    if not os.path.exists(os.path.join(
-            config[CK.WORK_DIR], 'structures/1')):
-        generate_structures(config)
-    amd_logger.info(f"generate_structures done")
-
-    if not os.path.exists(os.path.join(
-            config[CK.WORK_DIR], 'test_results.csv')):
-        run_cgcnn(config)
-
-    amd_logger.info(f"cgcnn done")
+    if get_optional(config, CK.PIPELINE_MODE) == "streaming":
+        if not os.path.exists(os.path.join(
+                config[CK.WORK_DIR], 'test_results.csv')):
+            generate_and_predict(config)
+        amd_logger.info(f"generate_and_predict done")
+    else:
+        if not _generation_done(config):
+            generate_structures(config)
+        amd_logger.info(f"generate_structures done")
+
+        if not os.path.exists(os.path.join(
+                config[CK.WORK_DIR], 'test_results.csv')):
+            run_cgcnn(config)
+
+        amd_logger.info(f"cgcnn done")
 
     if not os.path.exists(os.path.join(config[CK.WORK_DIR], 'new/POSCAR_1')):
         select_structures(config)